@@ -104,9 +104,9 @@ cd "$source_dir"/log_parser/package || exit 1
 zip -q -r9 "$build_dist_dir"/log_parser.zip .
 cd "$source_dir"/log_parser || exit 1
 mkdir -p lib
-echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/cw_metrics_util.py $source_dir/lib/logging_util.py $source_dir/lib/s3_util.py lib"
-cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/cw_metrics_util.py "$source_dir"/lib/logging_util.py "$source_dir"/lib/s3_util.py lib
-zip -g -r "$build_dist_dir"/log_parser.zip log_parser.py partition_s3_logs.py add_athena_partitions.py build_athena_queries.py lambda_log_parser.py athena_log_parser.py lib test
+echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/ip_util.py $source_dir/lib/ip_set_updater.py $source_dir/lib/ip_set_mutations.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/cw_metrics_util.py $source_dir/lib/logging_util.py $source_dir/lib/s3_util.py lib"
+cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/ip_util.py "$source_dir"/lib/ip_set_updater.py "$source_dir"/lib/ip_set_mutations.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/cw_metrics_util.py "$source_dir"/lib/logging_util.py "$source_dir"/lib/s3_util.py lib
+zip -g -r "$build_dist_dir"/log_parser.zip log_parser.py partition_s3_logs.py add_athena_partitions.py build_athena_queries.py lambda_log_parser.py athena_log_parser.py s3_log_stream.py waf_log_decoder.py request_counter.py parallel_log_reader.py config_cache.py window_store.py heavy_hitters.py columnar_log_reader.py log_formats.py uri_matcher.py stage_metrics.py requester_state.py cidr_aggregator.py lib test
 
 
 echo "------------------------------------------------------------------------------"
@@ -119,8 +119,8 @@ cd "$source_dir"/access_handler/package || exit 1
 zip -q -r9 "$build_dist_dir"/access_handler.zip .
 cd "$source_dir"/access_handler || exit 1
 mkdir -p lib
-echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/cw_metrics_util.py $source_dir/lib/logging_util.py lib"
-cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/cw_metrics_util.py "$source_dir"/lib/logging_util.py lib
+echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/ip_util.py $source_dir/lib/ip_set_updater.py $source_dir/lib/ip_set_mutations.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/cw_metrics_util.py $source_dir/lib/logging_util.py lib"
+cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/ip_util.py "$source_dir"/lib/ip_set_updater.py "$source_dir"/lib/ip_set_mutations.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/cw_metrics_util.py "$source_dir"/lib/logging_util.py lib
 zip -g -r "$build_dist_dir"/access_handler.zip access_handler.py lib
 
 
@@ -134,8 +134,8 @@ cd "$source_dir"/reputation_lists_parser/package || exit 1
 zip -q -r9 "$build_dist_dir"/reputation_lists_parser.zip .
 cd "$source_dir"/reputation_lists_parser || exit 1
 mkdir -p lib
-echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/cfn_response.py $source_dir/lib/cw_metrics_util.py  $source_dir/lib/logging_util.py lib"
-cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/cfn_response.py "$source_dir"/lib/cw_metrics_util.py "$source_dir"/lib/logging_util.py lib
+echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/ip_util.py $source_dir/lib/ip_set_updater.py $source_dir/lib/ip_set_mutations.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/cfn_response.py $source_dir/lib/cw_metrics_util.py  $source_dir/lib/logging_util.py lib"
+cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/ip_util.py "$source_dir"/lib/ip_set_updater.py "$source_dir"/lib/ip_set_mutations.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/cfn_response.py "$source_dir"/lib/cw_metrics_util.py "$source_dir"/lib/logging_util.py lib
 zip -g -r "$build_dist_dir"/reputation_lists_parser.zip reputation_lists.py lib
 
 
@@ -149,8 +149,8 @@ cd "$source_dir"/custom_resource/package || exit 1
 zip -q -r9 "$build_dist_dir"/custom_resource.zip .
 cd "$source_dir"/custom_resource || exit 1
 mkdir -p lib
-echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/s3_util.py $source_dir/lib/cfn_response.py  $source_dir/lib/logging_util.py lib"
-cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/s3_util.py "$source_dir"/lib/cfn_response.py "$source_dir"/lib/logging_util.py lib
+echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/ip_util.py $source_dir/lib/ip_set_updater.py $source_dir/lib/ip_set_mutations.py $source_dir/lib/solution_metrics.py $source_dir/lib/boto3_util.py $source_dir/lib/s3_util.py $source_dir/lib/cfn_response.py  $source_dir/lib/logging_util.py lib"
+cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/ip_util.py "$source_dir"/lib/ip_set_updater.py "$source_dir"/lib/ip_set_mutations.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/s3_util.py "$source_dir"/lib/cfn_response.py "$source_dir"/lib/logging_util.py lib
 zip -g -r "$build_dist_dir"/custom_resource.zip custom_resource.py resource_manager.py log_group_retention.py lib operations
 
 
@@ -164,8 +164,8 @@ cd "$source_dir"/helper/package || exit 1
 zip -q -r9 "$build_dist_dir"/helper.zip ./*
 cd "$source_dir"/helper || exit 1
 mkdir -p lib
-echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/boto3_util.py $source_dir/lib/s3_util.py $source_dir/lib/cfn_response.py $source_dir/lib/logging_util.py lib"
-cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/s3_util.py "$source_dir"/lib/cfn_response.py "$source_dir"/lib/logging_util.py lib
+echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/ip_util.py $source_dir/lib/ip_set_updater.py $source_dir/lib/ip_set_mutations.py $source_dir/lib/boto3_util.py $source_dir/lib/s3_util.py $source_dir/lib/cfn_response.py $source_dir/lib/logging_util.py lib"
+cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/ip_util.py "$source_dir"/lib/ip_set_updater.py "$source_dir"/lib/ip_set_mutations.py "$source_dir"/lib/boto3_util.py "$source_dir"/lib/s3_util.py "$source_dir"/lib/cfn_response.py "$source_dir"/lib/logging_util.py lib
 zip -g -r "$build_dist_dir"/helper.zip helper.py stack_requirements.py lib
 
 
@@ -196,6 +196,6 @@ cd "$source_dir"/ip_retention_handler/package || exit 1
 zip -q -r9 "$build_dist_dir"/ip_retention_handler.zip ./*
 cd "$source_dir"/ip_retention_handler || exit 1
 mkdir -p lib
-echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/solution_metrics.py $source_dir/lib/sns_util.py $source_dir/lib/dynamodb_util.py $source_dir/lib/boto3_util.py  $source_dir/lib/logging_util.py lib"
-cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/sns_util.py "$source_dir"/lib/dynamodb_util.py $source_dir/lib/boto3_util.py "$source_dir"/lib/logging_util.py lib
-zip -g -r "$build_dist_dir"/ip_retention_handler.zip set_ip_retention.py remove_expired_ip.py lib test
\ No newline at end of file
+echo "cp $source_dir/lib/waflibv2.py $source_dir/lib/ip_util.py $source_dir/lib/ip_set_updater.py $source_dir/lib/ip_set_mutations.py $source_dir/lib/solution_metrics.py $source_dir/lib/sns_util.py $source_dir/lib/dynamodb_util.py $source_dir/lib/boto3_util.py  $source_dir/lib/logging_util.py lib"
+cp -rf "$source_dir"/lib/waflibv2.py "$source_dir"/lib/ip_util.py "$source_dir"/lib/ip_set_updater.py "$source_dir"/lib/ip_set_mutations.py "$source_dir"/lib/solution_metrics.py "$source_dir"/lib/sns_util.py "$source_dir"/lib/dynamodb_util.py $source_dir/lib/boto3_util.py "$source_dir"/lib/logging_util.py lib
+zip -g -r "$build_dist_dir"/ip_retention_handler.zip set_ip_retention.py remove_expired_ip.py apply_ip_set_mutations.py lib test
\ No newline at end of file
@@ -2,14 +2,14 @@
 #  SPDX-License-Identifier: Apache-2.0
 
 import os
-from ipaddress import IPv4Network
-from ipaddress import IPv6Network
-from ipaddress import ip_address
 from os import environ
+from time import monotonic
 
 from aws_lambda_powertools import Logger
 
-from lib.cw_metrics_util import WAFCloudWatchMetrics
+from lib.cw_metrics_util import UsageReportTimer, WAFCloudWatchMetrics
+from lib.ip_set_mutations import ADD, get_ip_set_mutation_queue, make_intents
+from lib.ip_util import format_cidr, parse_ip
 from lib.solution_metrics import send_metrics
 from lib.waflibv2 import WAFLIBv2
 
@@ -19,6 +19,52 @@ logger = Logger(
 
 waflib = WAFLIBv2()
 CW_METRIC_PERIOD_SECONDS = 12 * 3600    # Twelve hours in seconds
+usage_report_timer = UsageReportTimer(CW_METRIC_PERIOD_SECONDS)
+DEFAULT_BLOCKED_IP_CACHE_TTL_SECONDS = 300
+DEFAULT_QUEUED_IP_CACHE_TTL_SECONDS = 10
+MAX_BLOCKED_IP_CACHE_SIZE = 100000
+
+
+class BlockedIPCache(object):
+    """
+    Addresses (canonical CIDRs) known to be in the bad bot IP sets, for ttl seconds each, so repeat hits
+    on a warm container are answered without any WAF call. An address removed from the IP set meanwhile
+    (IP retention) is added again once its entry expired.
+    """
+
+    def __init__(self, ttl, max_size=MAX_BLOCKED_IP_CACHE_SIZE, clock=monotonic):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.clock = clock
+        self.expires = {}
+
+    def __contains__(self, address):
+        expires_at = self.expires.get(address)
+        if expires_at is None:
+            return False
+        if expires_at <= self.clock():
+            del self.expires[address]
+            return False
+        return True
+
+    def add(self, addresses):
+        if self.ttl <= 0:
+            return
+        now = self.clock()
+        addresses = list(addresses)
+        if len(self.expires) + len(addresses) > self.max_size:
+            self.expires = {address: expires_at for address, expires_at in self.expires.items() if expires_at > now}
+            if len(self.expires) + len(addresses) > self.max_size:
+                self.expires = {}
+        expires_at = now + self.ttl
+        for address in addresses[:self.max_size]:
+            self.expires[address] = expires_at
+
+
+blocked_ips = BlockedIPCache(float(os.getenv('BLOCKED_IP_CACHE_TTL_SECONDS', DEFAULT_BLOCKED_IP_CACHE_TTL_SECONDS)))
+# Addresses only queued, not known to be in the IP set yet: kept just long enough to absorb a burst of
+# hits, so a lost or failed mutation is queued again on the next hit instead of being skipped for minutes
+queued_ips = BlockedIPCache(float(os.getenv('QUEUED_IP_CACHE_TTL_SECONDS', DEFAULT_QUEUED_IP_CACHE_TTL_SECONDS)))
 
 def initialize_usage_data():
     usage_data = {
@@ -34,7 +80,11 @@ def initialize_usage_data():
     return usage_data
 
 
-def get_bad_bot_usage_data(scope, cw, ipset_name_v4, ipset_arn_v4, ipset_name_v6, ipset_arn_v6, usage_data):
+def get_bad_bot_usage_data(scope, ipset_name_v4, ipset_arn_v4, ipset_name_v6, ipset_arn_v6, usage_data):
+    """
+    Add the bad bot IP set size to usage_data, return the CloudWatch metrics of the bad bot
+    rule to add to it (see WAFCloudWatchMetrics.add_waf_cw_metrics_to_usage_data).
+    """
     logger.info("[get_bad_bot_usage_data] Get bad bot data")
 
     if 'IP_SET_ID_BAD_BOTV4' in environ or 'IP_SET_ID_BAD_BOTV6' in environ:
@@ -43,16 +93,9 @@ def get_bad_bot_usage_data(scope, cw, ipset_name_v4, ipset_arn_v4, ipset_name_v6
         ipv6_count = waflib.get_ip_address_count(logger, scope, ipset_name_v6, ipset_arn_v6)
         usage_data['bad_bot_ip_set_size'] = str(ipv4_count + ipv6_count)
 
-        # Get the count of blocked requests for the bad bot rule from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            os.getenv('METRIC_NAME_PREFIX') + 'BadBotRule',
-            usage_data,
-            'blocked_requests_bad_bot',
-            0
-        )
-    return usage_data
+        # The count of blocked requests for the bad bot rule
+        return [('BlockedRequests', os.getenv('METRIC_NAME_PREFIX') + 'BadBotRule', 'blocked_requests_bad_bot', 0)]
+    return []
 
 
 def send_anonymized_usage_data(scope, ipset_name_v4, ipset_arn_v4, ipset_name_v6, ipset_arn_v6):
@@ -60,34 +103,29 @@ def send_anonymized_usage_data(scope, ipset_name_v4, ipset_arn_v4, ipset_name_v6
         if 'SEND_ANONYMIZED_USAGE_DATA' not in environ or os.getenv('SEND_ANONYMIZED_USAGE_DATA').lower() != 'yes':
             return
 
+        # At most one report per metric period per container, not one per bad bot hit
+        if not usage_report_timer.due():
+            logger.info("[send_anonymized_usage_data] Usage data sent less than %d seconds ago"
+                        % CW_METRIC_PERIOD_SECONDS)
+            return
+
         logger.info("[send_anonymized_usage_data] Start")
 
         cw = WAFCloudWatchMetrics(logger)
         usage_data = initialize_usage_data()
 
-        # Get the count of allowed requests for all the waf rules from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'AllowedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            'ALL',
-            usage_data,
-            'allowed_requests',
-            0
-        )
-
-        # Get the count of blocked requests for all the waf rules from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            'ALL',
-            usage_data,
-            'blocked_requests_all',
-            0
-        )
+        # The count of allowed and blocked requests for all the waf rules
+        metrics = [
+            ('AllowedRequests', 'ALL', 'allowed_requests', 0),
+            ('BlockedRequests', 'ALL', 'blocked_requests_all', 0)
+        ]
 
         # Get bad bot specific usage data
-        usage_data = get_bad_bot_usage_data(scope, cw, ipset_name_v4, ipset_arn_v4, ipset_name_v6, ipset_arn_v6,
-                                            usage_data)
+        metrics += get_bad_bot_usage_data(scope, ipset_name_v4, ipset_arn_v4, ipset_name_v6, ipset_arn_v6,
+                                          usage_data)
+
+        # Get all of them from cloudwatch metrics with one request
+        usage_data = cw.add_waf_cw_metrics_to_usage_data(metrics, CW_METRIC_PERIOD_SECONDS, usage_data)
 
         # Send usage data
         logger.info('[send_anonymized_usage_data] Send usage data: \n{}'.format(usage_data))
@@ -105,19 +143,36 @@ def add_ip_to_ip_set(scope, ip_type, source_ip, ipset_name, ipset_arn):
     new_address = []
     output = None
     
-    if ip_type == "IPV4":
-        new_address.append(IPv4Network(source_ip).with_prefixlen)
-    elif ip_type == "IPV6":
-        new_address.append(IPv6Network(source_ip).with_prefixlen)
+    if ip_type in ["IPV4", "IPV6"]:
+        new_address.append(format_cidr(parse_ip(source_ip)))
     
-    ipset = waflib.get_ip_set(logger, scope, ipset_name, ipset_arn)
-    # merge old addresses with this one
-    logger.info(ipset)
-    current_list = ipset["IPSet"]["Addresses"]
-    logger.info(current_list)
-    new_list = list(set(current_list) | set(new_address))
-    logger.info(new_list)
-    output = waflib.update_ip_set(logger, scope, ipset_name, ipset_arn, new_list)
+    # Asynchronous mode (IP_SET_MUTATION_QUEUE_URL, set by the IPSetMutationQueueParam template parameter):
+    # buffer the address for the IP set mutation applier, which adds all the buffered addresses of an IP set
+    # in one update per window, and answer right away. The address is only cached for a few seconds
+    # (queued_ips), it is not in the IP set until the applier wrote it
+    mutation_queue = get_ip_set_mutation_queue()
+    if mutation_queue is not None:
+        try:
+            queued = mutation_queue.send(make_intents(scope, ipset_name, ipset_arn, ADD, new_address))
+            logger.info("Queued %d IP set mutations for IPSet %s", queued, ipset_name)
+            queued_ips.add(new_address)
+            return {'Queued': queued}
+        except Exception as error:
+            # Still blocked, synchronously
+            logger.error("Failed to queue %s for IPSet %s: %s", str(new_address), ipset_name, str(error))
+
+    # merge old addresses with this one, using the lock token of the cached IP set snapshot. Nothing is
+    # written when the IP set already holds the address
+    applied, output = waflib.commit_ip_set(logger, scope, ipset_name, ipset_arn, new_address, read_back=True,
+                                           merge=True)
+    logger.info("IPSet %s %s", ipset_name, "updated" if applied else "unchanged")
+    logger.info(output)
+
+    # Seed the cache with the whole IP set, the other crawlers it holds are answered from the cache too
+    if output is not None:
+        blocked_ips.add(new_address)
+        blocked_ips.add(format_cidr(parsed) for parsed in map(parse_ip, output['IPSet']['Addresses'])
+                        if parsed is not None)
 
     return output
 
@@ -159,9 +214,17 @@ def lambda_handler(event, _):
         logger.info("IPARNV6 = %s", ipset_arn_v6)
         logger.info("source_ip = %s", source_ip)
 
-        ip_type = "IPV%s" % ip_address(source_ip).version
+        parsed = parse_ip(source_ip)
+        if parsed is None or '/' in source_ip:
+            raise ValueError("%r does not appear to be an IPv4 or IPv6 address" % source_ip)
+        ip_type = "IPV%s" % parsed[0]
         output = None
-        if ip_type == "IPV4":
+        if format_cidr(parsed) in blocked_ips:
+            # Repeat hit, already blocked: no WAF call, no usage data
+            logger.info("source_ip %s is already in the bad bot IP set", source_ip)
+        elif format_cidr(parsed) in queued_ips:
+            logger.info("source_ip %s is already queued for the bad bot IP set", source_ip)
+        elif ip_type == "IPV4":
             output = add_ip_to_ip_set(scope, ip_type, source_ip, ipset_name_v4, ipset_arn_v4)
         elif ip_type == "IPV6":
             output = add_ip_to_ip_set(scope, ip_type, source_ip, ipset_name_v6, ipset_arn_v6)
@@ -177,7 +240,8 @@ def lambda_handler(event, _):
             'body': message
         }
 
-    if output is not None:
+    # Not for queued addresses, the usage data calls would hold the response again
+    if output is not None and 'Queued' not in output:
         send_anonymized_usage_data(scope, ipset_name_v4, ipset_arn_v4, ipset_name_v6, ipset_arn_v6)
     logger.info('[lambda_handler] End')
 
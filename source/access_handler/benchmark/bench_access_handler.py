@@ -0,0 +1,175 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Load test the bad bot access handler of one warm container: --hits honeypot
+hits from --crawlers crawlers (a few of them make most hits) on IP sets already
+holding --ip-set-size addresses, and report the p50 and p99 handler latency and
+the WAF calls of:
+
+    legacy      the previous add_ip_to_ip_set: get, union, get, update, get
+    snapshots   IP set snapshots (lib.waflibv2) without the recently-blocked cache
+    cache       the recently-blocked IP cache
+    async       the recently-blocked IP cache, addresses queued (--sqs-ms per send) for the IP
+                set mutation applier, flushed every --flush-every hits, and cached for a few
+                seconds (queued_ips) while queued
+
+WAFv2 is an in-memory stand-in with --waf-ms of latency per call. The WAF calls
+of the applier flushes are counted with the handler ones.
+
+Run it from source/access_handler:
+
+    python -m benchmark.bench_access_handler --hits 1000 --crawlers 20
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+os.environ['LOG_LEVEL'] = 'CRITICAL'
+os.environ['SEND_ANONYMIZED_USAGE_DATA'] = 'No'
+os.environ['SCOPE'] = 'REGIONAL'
+for version in ['V4', 'V6']:
+    os.environ['IP_SET_NAME_BAD_BOT' + version] = 'bad-bot-' + version
+    os.environ['IP_SET_ID_BAD_BOT' + version] = 'arn:aws:wafv2:us-east-1:123456789012:regional/ipset/bad-bot/' + version
+
+CONTEXT = SimpleNamespace(function_name='access_handler', memory_limit_in_mb='128',
+                          invoked_function_arn='arn:aws:lambda:us-east-1:123456789012:function:access_handler',
+                          aws_request_id='benchmark')
+
+
+class LatencyMutationQueue(object):
+
+    def __init__(self, seconds):
+        from lib.ip_set_mutations import LocalMutationQueue
+
+        self.seconds = seconds
+        self.queue = LocalMutationQueue()
+
+    def send(self, intents):
+        time.sleep(self.seconds)
+        return self.queue.send(intents)
+
+
+class LatencyWAFv2Client(object):
+    """
+    In-memory WAFv2 IP sets with --waf-ms of latency per call and a new lock
+    token on each update.
+    """
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.ip_sets = {}
+        self.calls = {}
+
+    def _count(self, operation):
+        time.sleep(self.seconds)
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def get_ip_set(self, Scope, Name, Id):
+        self._count('get_ip_set')
+        ip_set = self.ip_sets.setdefault(Id, {'Name': Name, 'Id': Id, 'Description': Name, 'Addresses': []})
+        return {'IPSet': dict(ip_set), 'LockToken': 'token-%d' % self.calls.get('update_ip_set', 0)}
+
+    def update_ip_set(self, Scope, Name, Id, Addresses, LockToken, Description=None):
+        self._count('update_ip_set')
+        self.ip_sets[Id] = {'Name': Name, 'Id': Id, 'Description': Description, 'Addresses': list(Addresses)}
+        return {'NextLockToken': 'token-%d' % self.calls['update_ip_set']}
+
+
+def make_events(hits, crawlers, seed):
+    rng = random.Random(seed)
+    ips = ['198.51.%d.%d' % (i >> 8, i & 255) for i in range(crawlers)]
+    weights = [1.0 / (i + 1) for i in range(crawlers)]
+    return [{'headers': {}, 'requestContext': {'identity': {'sourceIp': ip}}}
+            for ip in rng.choices(ips, weights, k=hits)]
+
+
+def legacy_add_ip_to_ip_set(scope, ip_type, source_ip, ipset_name, ipset_arn):
+    import lib.waflibv2
+    from lib.ip_util import format_cidr, parse_ip
+
+    client = lib.waflibv2.client
+    ip_set_id = ipset_arn.split('/')[-1]
+    ipset = client.get_ip_set(Scope=scope, Name=ipset_name, Id=ip_set_id)
+    new_list = list(set(ipset['IPSet']['Addresses']) | {format_cidr(parse_ip(source_ip))})
+    ipset = client.get_ip_set(Scope=scope, Name=ipset_name, Id=ip_set_id)
+    client.update_ip_set(Scope=scope, Name=ipset_name, Id=ip_set_id, Addresses=new_list,
+                         LockToken=ipset['LockToken'], Description=ipset['IPSet']['Description'])
+    return client.get_ip_set(Scope=scope, Name=ipset_name, Id=ip_set_id)
+
+
+def run(events, ip_set_size, waf_seconds, mode, sqs_seconds, flush_every):
+    import lib.waflibv2
+    import access_handler.access_handler as access_handler
+    from lib.ip_set_mutations import IPSetMutationApplier
+    from lib.ip_set_updater import IPSetUpdater, TokenBucket
+
+    client = lib.waflibv2.client = LatencyWAFv2Client(waf_seconds)
+    for version in ['V4', 'V6']:
+        client.ip_sets[version] = {'Name': 'bad-bot-' + version, 'Id': version, 'Description': 'bad bot',
+                                   'Addresses': ['203.0.%d.%d/32' % (i >> 8 & 255, i & 255) if version == 'V4'
+                                                 else '2001:db8::%x/128' % i for i in range(ip_set_size)]}
+    lib.waflibv2.ip_set_snapshots = lib.waflibv2.IPSetSnapshotCache()
+    access_handler.blocked_ips = access_handler.BlockedIPCache(300 if mode in ['cache', 'async'] else 0)
+    access_handler.queued_ips = access_handler.BlockedIPCache(
+        access_handler.DEFAULT_QUEUED_IP_CACHE_TTL_SECONDS if mode == 'async' else 0)
+    add_ip_to_ip_set = access_handler.add_ip_to_ip_set
+    get_ip_set_mutation_queue = access_handler.get_ip_set_mutation_queue
+    if mode == 'legacy':
+        access_handler.add_ip_to_ip_set = legacy_add_ip_to_ip_set
+    queue = LatencyMutationQueue(sqs_seconds)
+    applier = IPSetMutationApplier(access_handler.logger, queue.queue,
+                                   IPSetUpdater(access_handler.logger, access_handler.waflib, TokenBucket(1000, 1000)))
+    if mode == 'async':
+        access_handler.get_ip_set_mutation_queue = lambda: queue
+    latencies = []
+    try:
+        for i, event in enumerate(events):
+            start = time.perf_counter()
+            access_handler.lambda_handler(event, CONTEXT)
+            latencies.append(time.perf_counter() - start)
+            if mode == 'async' and ((i + 1) % flush_every == 0 or i + 1 == len(events)):
+                applier.apply(queue.queue.receive(max_messages=len(events)))
+    finally:
+        access_handler.add_ip_to_ip_set = add_ip_to_ip_set
+        access_handler.get_ip_set_mutation_queue = get_ip_set_mutation_queue
+    return sorted(latencies), client.calls
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--hits', type=int, default=1000)
+    arg_parser.add_argument('--crawlers', type=int, default=20)
+    arg_parser.add_argument('--ip-set-size', type=int, default=5000)
+    arg_parser.add_argument('--waf-ms', type=float, default=20)
+    arg_parser.add_argument('--sqs-ms', type=float, default=10)
+    arg_parser.add_argument('--flush-every', type=int, default=100)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    args = arg_parser.parse_args()
+
+    events = make_events(args.hits, args.crawlers, args.seed)
+    print("%d hits from %d crawlers, %d addresses per IP set, WAF calls %.0f ms" % (
+        args.hits, args.crawlers, args.ip_set_size, args.waf_ms))
+    print("%-10s %10s %10s %10s %10s %16s" % ('', 'p50 ms', 'p99 ms', 'gets', 'updates', 'WAF calls/1000'))
+    for mode in ['legacy', 'snapshots', 'cache', 'async']:
+        latencies, calls = run(events, args.ip_set_size, args.waf_ms / 1000.0, mode, args.sqs_ms / 1000.0,
+                               args.flush_every)
+        waf_calls = calls.get('get_ip_set', 0) + calls.get('update_ip_set', 0)
+        print("%-10s %10.3f %10.3f %10d %10d %16.1f" % (
+            mode, latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000,
+            calls.get('get_ip_set', 0), calls.get('update_ip_set', 0), waf_calls * 1000.0 / len(events)))
+
+
+if __name__ == '__main__':
+    main()
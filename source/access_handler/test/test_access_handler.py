@@ -51,3 +51,94 @@ def test_send_anonymized_usage_data(cloudwatch_client, expected_cw_resp):
         ipset_arn_v6='ipset_arn_v6'
     )
     assert result == expected_cw_resp
+
+def test_repeat_hits_are_answered_from_cache(ipset_env_var_setup, badbot_event, mocker):
+    mocker.patch('access_handler.access_handler.blocked_ips', BlockedIPCache(300))
+    commit_ip_set = mocker.patch.object(waflib, 'commit_ip_set', return_value=(
+        True, {'IPSet': {'Addresses': ['99.99.99.99/32', '2001:db8::1/128']}}))
+    send_usage_data = mocker.patch('access_handler.access_handler.send_anonymized_usage_data')
+
+    for _ in range(3):
+        assert lambda_handler(badbot_event, context)['statusCode'] == 200
+    assert commit_ip_set.call_count == 1
+    assert send_usage_data.call_count == 1
+
+    # Seeded with the IP set addresses
+    badbot_event['requestContext']['identity']['sourceIp'] = '2001:db8::1'
+    try:
+        lambda_handler(badbot_event, context)
+    finally:
+        badbot_event['requestContext']['identity']['sourceIp'] = '99.99.99.99'
+    assert commit_ip_set.call_count == 1
+
+
+def test_blocked_ip_cache_expires_entries():
+    now = [0.0]
+    cache = BlockedIPCache(10, max_size=3, clock=lambda: now[0])
+    cache.add(['10.0.0.1/32', '10.0.0.2/32'])
+    assert '10.0.0.1/32' in cache
+    now[0] = 5
+    cache.add(['10.0.0.3/32'])
+    now[0] = 11
+    assert '10.0.0.1/32' not in cache
+    assert '10.0.0.3/32' in cache
+    # Full: expired entries are dropped first
+    cache.add(['10.0.0.4/32', '10.0.0.5/32'])
+    assert sorted(cache.expires) == ['10.0.0.3/32', '10.0.0.4/32', '10.0.0.5/32']
+
+    disabled = BlockedIPCache(0)
+    disabled.add(['10.0.0.1/32'])
+    assert '10.0.0.1/32' not in disabled
+
+
+def test_async_mode_buffers_addresses_for_one_update_per_ip_set(ipset_env_var_setup, badbot_event, mocker):
+    from lib.ip_set_mutations import IPSetMutationApplier, LocalMutationQueue
+    from lib.ip_set_updater import IPSetUpdater, TokenBucket
+
+    queue = LocalMutationQueue()
+    mocker.patch('access_handler.access_handler.get_ip_set_mutation_queue', return_value=queue)
+    blocked = mocker.patch('access_handler.access_handler.blocked_ips', BlockedIPCache(300))
+    now = [0.0]
+    mocker.patch('access_handler.access_handler.queued_ips', BlockedIPCache(10, clock=lambda: now[0]))
+    commit_ip_set = mocker.patch.object(waflib, 'commit_ip_set', return_value=(True, {}))
+    send_usage_data = mocker.patch('access_handler.access_handler.send_anonymized_usage_data')
+
+    identity = badbot_event['requestContext']['identity']
+    try:
+        for source_ip in ['10.0.0.1', '10.0.0.2', '10.0.0.1', '2001:db8::1']:
+            identity['sourceIp'] = source_ip
+            assert lambda_handler(badbot_event, context)['statusCode'] == 200
+    finally:
+        identity['sourceIp'] = '99.99.99.99'
+    assert len(queue) == 3
+    commit_ip_set.assert_not_called()
+    send_usage_data.assert_not_called()
+
+    # One flush: the buffered addresses of each IP set in one update
+    applier = IPSetMutationApplier(log, queue, IPSetUpdater(log, waflib, TokenBucket(100, 100)), window_seconds=0)
+    assert applier.apply(queue.receive()) == []
+    assert [(call[0][2], call[0][4]) for call in commit_ip_set.call_args_list] == [
+        ('IP_SET_NAME_BAD_BOTV4', ['10.0.0.1/32', '10.0.0.2/32']), ('IP_SET_NAME_BAD_BOTV6', ['2001:db8::1/128'])]
+
+    # Queued addresses are not taken as blocked: once the short TTL passed, a hit queues the address again
+    assert '10.0.0.1/32' not in blocked
+    now[0] = 10
+    identity['sourceIp'] = '10.0.0.1'
+    try:
+        lambda_handler(badbot_event, context)
+    finally:
+        identity['sourceIp'] = '99.99.99.99'
+    assert len(queue) == 1
+
+
+def test_async_mode_falls_back_to_synchronous_writes(ipset_env_var_setup, badbot_event, mocker):
+    queue = mocker.Mock()
+    queue.send.side_effect = RuntimeError('queue unavailable')
+    mocker.patch('access_handler.access_handler.get_ip_set_mutation_queue', return_value=queue)
+    mocker.patch('access_handler.access_handler.blocked_ips', BlockedIPCache(300))
+    commit_ip_set = mocker.patch.object(waflib, 'commit_ip_set', return_value=(
+        True, {'IPSet': {'Addresses': ['99.99.99.99/32']}}))
+    mocker.patch('access_handler.access_handler.send_anonymized_usage_data')
+
+    assert lambda_handler(badbot_event, context)['statusCode'] == 200
+    commit_ip_set.assert_called_once()
@@ -49,6 +49,7 @@ class LogGroupRetention:
             'AddAthenaPartitionsLambdaName',
             'SetIPRetentionLambdaName',
             'RemoveExpiredIPLambdaName',
+            'ApplyIPSetMutationsLambdaName',
             'ReputationListsParserLambdaName',
             'BadBotParserLambdaName',
             'HelperLambdaName',
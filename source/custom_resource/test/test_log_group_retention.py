@@ -55,6 +55,7 @@ def test_get_lambda_names():
         'AddAthenaPartitionsLambdaName': 'TESTAddAthenaPartitionsLambdaName',
         'SetIPRetentionLambdaName': 'TESTSetIPRetentionLambdaName',
         'RemoveExpiredIPLambdaName': 'TESTRemoveExpiredIPLambdaName',
+        'ApplyIPSetMutationsLambdaName': 'TESTApplyIPSetMutationsLambdaName',
         'ReputationListsParserLambdaName': 'TESTReputationListsParserLambdaName',
         'BadBotParserLambdaName': 'TESTBadBotParserLambdaName',
         'CustomResourceLambdaName': 'TESTCustomResourceLambdaName',
@@ -67,6 +68,7 @@ def test_get_lambda_names():
         '/aws/lambda/TESTAddAthenaPartitionsLambdaName',
         '/aws/lambda/TESTSetIPRetentionLambdaName',
         '/aws/lambda/TESTRemoveExpiredIPLambdaName',
+        '/aws/lambda/TESTApplyIPSetMutationsLambdaName',
         '/aws/lambda/TESTReputationListsParserLambdaName',
         '/aws/lambda/TESTBadBotParserLambdaName',
         '/aws/lambda/TESTCustomResourceLambdaName',
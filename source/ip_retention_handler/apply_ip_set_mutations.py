@@ -0,0 +1,43 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from os import getenv
+from lib.waflibv2 import WAFLIBv2
+from lib.ip_set_updater import get_ip_set_updater
+from lib.ip_set_mutations import get_ip_set_mutation_applier, get_ip_set_mutation_queue
+from aws_lambda_powertools import Logger
+
+logger = Logger(
+    level=getenv('LOG_LEVEL')
+)
+
+waflib = WAFLIBv2()
+# Kept across warm invocations, it holds the parts of split replaces until all of them arrived. The
+# template gives this function a reserved concurrency of 1, so every part reaches the same applier
+applier = None
+
+
+@logger.inject_lambda_context
+def lambda_handler(event, _):
+    """
+    Apply the IP set mutations queued by the log parsers, access handler, reputation lists parser and
+    RemoveExpiredIP lambda, one IP set update per IP set per batch.
+    It is triggered by the IP set mutation SQS queue, its batching window being the coalescing window,
+    with ReportBatchItemFailures so only the intents of IP sets that failed are delivered again.
+    """
+    global applier
+    try:
+        logger.info('[apply_ip_set_mutations: lambda_handler] Start')
+        logger.info("Lambda Handler Event: {} records".format(len(event.get('Records', []))))
+
+        if applier is None:
+            applier = get_ip_set_mutation_applier(logger, get_ip_set_mutation_queue(),
+                                                  get_ip_set_updater(logger, waflib))
+        response = applier.apply_sqs_records(event.get('Records', []))
+        logger.info("[apply_ip_set_mutations: lambda_handler] {}".format(applier.stats))
+    except Exception as error:
+        logger.error(str(error))
+        raise
+
+    logger.info('[apply_ip_set_mutations: lambda_handler] End')
+    return response
@@ -1,11 +1,12 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-from time import sleep
 from os import environ, getenv
 from datetime import datetime
 from boto3.dynamodb.types import TypeDeserializer
 from lib.waflibv2 import WAFLIBv2
+from lib.ip_set_updater import get_ip_set_updater
+from lib.ip_set_mutations import REMOVE, get_ip_set_mutation_queue, make_intents
 from lib.sns_util import SNS
 from lib.solution_metrics import send_metrics
 from aws_lambda_powertools import Logger
@@ -16,8 +17,6 @@ logger = Logger(
 
 waflib = WAFLIBv2()
 
-DELAY_BETWEEN_UPDATES = 5
-
 class RemoveExpiredIP(object):
     """
     This class contains functions to delete expired ips from waf ip set
@@ -116,20 +115,34 @@ class RemoveExpiredIP(object):
         
         log.info('[remove_expired_id: update_ip_set] Start')
         
-        response = waflib.update_ip_set_by_id(log, scope, name, ip_set_id, keep_ip_list, lock_token, description)
+        # Rate limited, retried when throttled (see lib.ip_set_updater)
+        response = waflib.update_ip_set_by_id(log, scope, name, ip_set_id, keep_ip_list, lock_token, description,
+                                              call=get_ip_set_updater(log, waflib).call)
         
         log.info("[remove_expired_id: update_ip_set] response \n{}.".format(response))
         
-        # Sleep for a few seconds to mitigate AWS WAF Update API call throttling issue
-        sleep(DELAY_BETWEEN_UPDATES)
-        
         log.info('[remove_expired_id: update_ip_set] End')
         
         return response
         
-    def send_notification(self, log, topic_arn, ip_set_name, ip_set_id, ip_retention_period, lambda_function_name):
+    def queue_ip_removal(self, log, mutation_queue, scope, name, ip_set_id, remove_ip_list):
         """
-        Send email notification to user about the IP expiration
+        Queue the removal of expired ip addresses for the IP set mutation applier.
+        """
+
+        log.info('[remove_expired_id: queue_ip_removal] Start')
+
+        queued = mutation_queue.send(make_intents(scope, name, ip_set_id, REMOVE, remove_ip_list))
+
+        log.info("[remove_expired_id: queue_ip_removal] Queued {} IP set mutations. End".format(queued))
+
+        return queued
+
+    def send_notification(self, log, topic_arn, ip_set_name, ip_set_id, ip_retention_period, lambda_function_name,
+                          queued=False):
+        """
+        Send email notification to user about the IP expiration. queued: the IPs were queued for removal
+        by the IP set mutation applier, not removed yet.
         """
         
         log.info('[remove_expired_id: send_notification] Start')
@@ -137,11 +150,12 @@ class RemoveExpiredIP(object):
         notify = SNS(log)
         
         subject = "Security Automations for AWS WAF - IP Expiration Notification"
+        action = "have been queued for removal from" if queued else "have been removed from"
         message = "You are receiving this email because you have configured IP retention in Security Automations for AWS WAF. " \
-                  "Expired IPs have been removed from the following IP set. For details, locate and view {} lambda logs using the " \
+                  "Expired IPs {} the following IP set. For details, locate and view {} lambda logs using the " \
                   "timestamp below. \n\n" \
                   "IP set name: {}\n IP set id: {}\n IP retention period (minute): {}\n Region: {}\n UTC Time: {}" \
-                  .format(lambda_function_name, ip_set_name, ip_set_id, ip_retention_period, environ.get('AWS_REGION'), \
+                  .format(action, lambda_function_name, ip_set_name, ip_set_id, ip_retention_period, environ.get('AWS_REGION'), \
                    datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ'))
         
         log.info("Message: {}".format(message))
@@ -226,13 +240,22 @@ def lambda_handler(event, context):
                 logger.info('[remove_expired_id: lambda_handler] No IPs to remove. End.')
                 return response
 
-            lock_token = reip.is_none(str(waf_ip_set.get('LockToken')))
-            
-            response = reip.update_ip_set(logger, scope, name, ip_set_id, keep_ip_list, lock_token, description)
+            mutation_queue = get_ip_set_mutation_queue()
+            queued = mutation_queue is not None
+            if queued:
+                # Removed by the IP set mutation applier
+                is_updated = reip.queue_ip_removal(logger, mutation_queue, scope, name, ip_set_id, remove_ip_list) > 0
+            else:
+                lock_token = reip.is_none(str(waf_ip_set.get('LockToken')))
+
+                response = reip.update_ip_set(logger, scope, name, ip_set_id, keep_ip_list, lock_token, description)
+                is_updated = response.get('ResponseMetadata',{}).get('HTTPStatusCode') == 200
             
-            # Send email notification to user if sns email is configured and ip set is successfully updated 
-            if (environ.get('SNS_EMAIL').lower() == 'yes' and response.get('ResponseMetadata',{}).get('HTTPStatusCode') == 200):
-                response = reip.send_notification(logger, environ.get('SNS_TOPIC_ARN'), name, ip_set_id, ip_retention_period, context.function_name)
+            # Send email notification to user if sns email is configured and ip set is successfully updated
+            # (queued, the applier removes the IPs later)
+            if (environ.get('SNS_EMAIL').lower() == 'yes' and is_updated):
+                response = reip.send_notification(logger, environ.get('SNS_TOPIC_ARN'), name, ip_set_id, ip_retention_period, context.function_name,
+                                                  queued)
         
             # send anonymized solution metrics
             reip.send_anonymized_usage_data(logger, remove_ip_list, name)
@@ -124,8 +124,11 @@ def lambda_handler(event, _):
         event_user_arn = event_detail.get('userIdentity',{}).get('arn')
         response = {}
         
-        # If event for UpdateIPSet api call is not created by the RemoveExpiredIP lambda, continue to put item into DDB
-        if event_user_arn.find(environ.get('REMOVE_EXPIRED_IP_LAMBDA_ROLE_NAME')) == -1:
+        # If event for UpdateIPSet api call is not created by the RemoveExpiredIP lambda (or the IP set mutation
+        # applier writing its removals), continue to put item into DDB
+        applier_role_name = environ.get('IP_SET_MUTATION_APPLIER_ROLE_NAME')
+        if event_user_arn.find(environ.get('REMOVE_EXPIRED_IP_LAMBDA_ROLE_NAME')) == -1 and \
+                (not applier_role_name or event_user_arn.find(applier_role_name) == -1):
             sipr = SetIPRetention(event_detail, logger)
             response = sipr.put_item(environ.get('TABLE_NAME'))
         else:
@@ -0,0 +1,39 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+from types import SimpleNamespace
+
+import apply_ip_set_mutations
+from apply_ip_set_mutations import lambda_handler
+
+context = SimpleNamespace(**{
+    'function_name': 'foo',
+    'memory_limit_in_mb': '512',
+    'invoked_function_arn': ':::invoked_function_arn',
+    'log_group_name': 'log_group_name',
+    'log_stream_name': 'log_stream_name',
+    'aws_request_id': 'baz'
+})
+
+
+def make_record(message_id, action, addresses):
+    return {'messageId': message_id, 'body': json.dumps({
+        'scope': 'CLOUDFRONT', 'name': 'fake-ip-set-name', 'ip_set_arn': 'fake-ip-set-id', 'action': action,
+        'addresses': addresses, 'enqueued_at': 1628203246, 'part': 0})}
+
+
+def test_apply_ip_set_mutations(mocker):
+    mocker.patch.object(apply_ip_set_mutations, 'applier', None)
+    commit_ip_set = mocker.patch.object(apply_ip_set_mutations.waflib, 'commit_ip_set', return_value=(True, {}))
+    event = {'Records': [make_record('m1', 'remove', ['x.x.x.x']), make_record('m2', 'remove', ['y.y.y.y'])]}
+    assert lambda_handler(event, context) == {'batchItemFailures': []}
+    commit_ip_set.assert_called_once()
+    assert commit_ip_set.call_args[1]['removed'] == ['x.x.x.x', 'y.y.y.y']
+
+
+def test_apply_ip_set_mutations_failure(mocker):
+    mocker.patch.object(apply_ip_set_mutations, 'applier', None)
+    mocker.patch.object(apply_ip_set_mutations.waflib, 'commit_ip_set', return_value=(False, None))
+    event = {'Records': [make_record('m1', 'remove', ['x.x.x.x'])]}
+    assert lambda_handler(event, context) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
@@ -141,6 +141,14 @@ def test_send_notification(sns_topic):
     assert result == True
 
 
+def test_send_notification_queued(mocker):
+    sns = mocker.patch('remove_expired_ip.SNS')
+    reip.send_notification(log, "fake_topic_arn", "fake_ip_set_name", "fake_ip_set_id", 30, "fake_lambda_name",
+                           queued=True)
+    message = sns.return_value.publish.call_args[0][1]
+    assert "Expired IPs have been queued for removal from the following IP set" in message
+
+
 def test_send_anonymized_usage_data_allowed_list():
     try:
         reip.send_anonymized_usage_data(log, REMOVE_IP_LIST, 'Whitelist')
@@ -0,0 +1,237 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Measure IP set mutations from many producers at --rate events per second, each
+producer writing the IP sets itself (the previous get, update, read back with
+retries on WAFOptimisticLockException) against queuing intents for one applier
+(lib.ip_set_mutations) that writes each IP set once per --window seconds.
+
+Events: access handler adds to the bad bot IP set, log parser replaces of the
+HTTP flood IP set and IP retention removals from the denylist. WAFv2 is an
+in-memory stand-in with --get-ms and --update-ms of latency and lock tokens,
+so a write based on a stale read fails like WAF does.
+
+Run it from source:
+
+    python -m lib.benchmark.bench_mutation_queue --rate 150 --seconds 5
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+SOURCE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if SOURCE_DIR not in sys.path:
+    sys.path.insert(0, SOURCE_DIR)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+SCOPE = 'REGIONAL'
+IP_SETS = {
+    'bad-bot': 'arn:aws:wafv2:us-east-1:123456789012:regional/ipset/bad-bot/bad-bot',
+    'http-flood': 'arn:aws:wafv2:us-east-1:123456789012:regional/ipset/http-flood/http-flood',
+    'denylist': 'arn:aws:wafv2:us-east-1:123456789012:regional/ipset/denylist/denylist'
+}
+MAX_TRIES = 5
+
+
+class LatencyWAFv2Client(object):
+    """
+    In-memory WAFv2 IP sets with call latency and lock tokens.
+    """
+
+    def __init__(self, get_seconds, update_seconds):
+        self.get_seconds = get_seconds
+        self.update_seconds = update_seconds
+        self.ip_sets = {}
+        self.tokens = {}
+        self.calls = {'get_ip_set': 0, 'update_ip_set': 0, 'conflicts': 0}
+        self.lock = threading.Lock()
+
+    def get_ip_set(self, Scope, Name, Id):
+        time.sleep(self.get_seconds)
+        with self.lock:
+            self.calls['get_ip_set'] += 1
+            ip_set = self.ip_sets.setdefault(Id, {'Name': Name, 'Id': Id, 'Description': Name, 'Addresses': []})
+            return {'IPSet': dict(ip_set, Addresses=list(ip_set['Addresses'])),
+                    'LockToken': str(self.tokens.get(Id, 0))}
+
+    def update_ip_set(self, Scope, Name, Id, Addresses, LockToken, Description=None):
+        time.sleep(self.update_seconds)
+        with self.lock:
+            self.calls['update_ip_set'] += 1
+            if LockToken != str(self.tokens.get(Id, 0)):
+                self.calls['conflicts'] += 1
+                raise ClientError({'Error': {'Code': 'WAFOptimisticLockException', 'Message': 'Stale lock token'}},
+                                  'UpdateIPSet')
+            self.ip_sets[Id] = {'Name': Name, 'Id': Id, 'Description': Description, 'Addresses': list(Addresses)}
+            self.tokens[Id] = self.tokens.get(Id, 0) + 1
+            return {'NextLockToken': str(self.tokens[Id])}
+
+
+def null_logger():
+    log = logging.getLogger('ip_set_mutations_benchmark')
+    log.setLevel(logging.CRITICAL)
+    return log
+
+
+def make_events(rate, seconds, seed):
+    """
+    Return [(offset in seconds, ip set name, action, addresses)].
+    """
+    rng = random.Random(seed)
+    events = []
+    for i in range(int(rate * seconds)):
+        kind = rng.random()
+        if kind < 0.7:
+            event = ('bad-bot', 'add', ['10.%d.%d.%d/32' % (i >> 16 & 255, i >> 8 & 255, i & 255)])
+        elif kind < 0.95:
+            event = ('http-flood', 'replace', ['172.16.%d.%d/32' % (j >> 8 & 255, j & 255)
+                                               for j in rng.sample(range(4096), 200)])
+        else:
+            event = ('denylist', 'remove', ['192.168.%d.%d/32' % (rng.randrange(16), rng.randrange(256))])
+        events.append((i / float(rate),) + event)
+    return events
+
+
+def legacy_commit(client, name, action, addresses):
+    """
+    Previous producer write: read the IP set for its addresses and lock token, write, read back.
+    """
+    ip_set_id = IP_SETS[name].split('/')[-1]
+    for attempt in range(MAX_TRIES):
+        ip_set = client.get_ip_set(Scope=SCOPE, Name=name, Id=ip_set_id)
+        current = ip_set['IPSet']['Addresses']
+        if action == 'add':
+            new_addresses = list(set(current) | set(addresses))
+        elif action == 'remove':
+            new_addresses = list(set(current) - set(addresses))
+        else:
+            new_addresses = addresses
+        try:
+            client.update_ip_set(Scope=SCOPE, Name=name, Id=ip_set_id, Addresses=new_addresses,
+                                 LockToken=ip_set['LockToken'], Description=name)
+            client.get_ip_set(Scope=SCOPE, Name=name, Id=ip_set_id)
+            return True
+        except ClientError:
+            # backoff expo with full jitter, as waflibv2 retried
+            time.sleep(random.uniform(0, 2 ** attempt))
+    return False
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else 0.0
+
+
+def run_direct(events, client, producers):
+    lags = []
+    failed = [0]
+
+    def produce(created_at, name, action, addresses):
+        if legacy_commit(client, name, action, addresses):
+            lags.append(time.perf_counter() - created_at)
+        else:
+            failed[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=producers) as executor:
+        for offset, name, action, addresses in events:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            executor.submit(produce, time.perf_counter(), name, action, addresses)
+    return time.perf_counter() - start, lags, failed[0]
+
+
+def run_queue(events, client, window_seconds, waf_calls_per_second):
+    import lib.waflibv2
+    from lib.ip_set_mutations import IPSetMutationApplier, LocalMutationQueue, make_intents
+    from lib.ip_set_updater import IPSetUpdater, TokenBucket
+
+    lib.waflibv2.ip_set_snapshots = lib.waflibv2.IPSetSnapshotCache()
+    log = null_logger()
+    queue = LocalMutationQueue()
+    updater = IPSetUpdater(log, lib.waflibv2.WAFLIBv2(), TokenBucket(waf_calls_per_second, 4))
+    applier = IPSetMutationApplier(log, queue, updater, window_seconds)
+    lags = []
+    failed = [0]
+    apply = applier.apply
+
+    def apply_and_measure(messages):
+        failed_receipts = apply(messages)
+        now = time.time()
+        lags.extend(now - intent['enqueued_at'] for receipt, intent in messages if receipt not in failed_receipts)
+        failed[0] += len(failed_receipts)
+        return failed_receipts
+
+    applier.apply = apply_and_measure
+    stop = threading.Event()
+
+    def run_applier():
+        while not stop.is_set() or len(queue):
+            applier.run_once()
+
+    thread = threading.Thread(target=run_applier)
+    start = time.perf_counter()
+    thread.start()
+    for offset, name, action, addresses in events:
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        queue.send(make_intents(SCOPE, name, IP_SETS[name], action, addresses))
+    stop.set()
+    thread.join()
+    return time.perf_counter() - start, lags, failed[0], applier.stats
+
+
+def report(label, events, elapsed, lags, failed, client):
+    calls = client.calls
+    print("%-8s %7d %9.1f %8d %8d %9d %8.1f%% %8.2f %8.2f %7d" % (
+        label, len(events), len(lags) / elapsed, calls['get_ip_set'], calls['update_ip_set'], calls['conflicts'],
+        100.0 * calls['conflicts'] / max(calls['update_ip_set'], 1), percentile(lags, 0.5), percentile(lags, 0.99),
+        failed))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--rate', type=float, default=150, help='producer events per second')
+    arg_parser.add_argument('--seconds', type=float, default=5)
+    arg_parser.add_argument('--producers', type=int, default=64, help='concurrent direct producers')
+    arg_parser.add_argument('--window', type=float, default=1.0, help='applier coalescing window, seconds')
+    arg_parser.add_argument('--waf-calls-per-second', type=float, default=5.0)
+    arg_parser.add_argument('--get-ms', type=float, default=15)
+    arg_parser.add_argument('--update-ms', type=float, default=40)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    args = arg_parser.parse_args()
+
+    import lib.waflibv2
+
+    events = make_events(args.rate, args.seconds, args.seed)
+    print("%d events over %.0f s, WAF get %.0f ms, update %.0f ms" % (
+        len(events), args.seconds, args.get_ms, args.update_ms))
+    print("%-8s %7s %9s %8s %8s %9s %9s %8s %8s %7s" % (
+        '', 'events', 'applied/s', 'gets', 'updates', 'conflicts', 'rate', 'lag p50', 'lag p99', 'failed'))
+
+    client = LatencyWAFv2Client(args.get_ms / 1000.0, args.update_ms / 1000.0)
+    elapsed, lags, failed = run_direct(events, client, args.producers)
+    report('direct', events, elapsed, lags, failed, client)
+
+    client = lib.waflibv2.client = LatencyWAFv2Client(args.get_ms / 1000.0, args.update_ms / 1000.0)
+    elapsed, lags, failed, stats = run_queue(events, client, args.window, args.waf_calls_per_second)
+    report('queue', events, elapsed, lags, failed, client)
+    print("applier: %s" % stats)
+
+
+if __name__ == '__main__':
+    main()
@@ -14,96 +14,138 @@
 
 import datetime
 from os import environ
+from time import monotonic
 from lib.boto3_util import create_client
 
+MAX_METRIC_DATA_QUERIES = 500
+
+
 class WAFCloudWatchMetrics(object):
     """
-    This class creates a wrapper function for cloudwatch get_metric_statistics API
-    and another function to add the waf cw metric statistics to the anonymized usage
-    data that the solution collects
+    This class creates a wrapper function for cloudwatch get_metric_data API
+    and another function to add the waf cw metrics to the anonymized usage
+    data that the solution collects, all of them with a single request
     """
     def __init__(self, log):
         self.log = log
         self.cw_client = create_client('cloudwatch')
 
-    def get_cw_metric_statistics(self, metric_name, period_seconds, waf_rule,
-                                namespace='AWS/WAFV2',
-                                statistics=['Sum'], 
-                                start_time=datetime.datetime.utcnow(),
-                                end_time=datetime.datetime.utcnow(),
-                                web_acl='STACK_NAME'):
+    def get_waf_cw_metrics(self, metrics, period_seconds, end_time=None,
+                           namespace='AWS/WAFV2', statistic='Sum', web_acl='STACK_NAME'):
         """
-        Get a WAF CloudWatch metric given a WAF rule and metric name.
+        Get WAF CloudWatch metrics, given as (metric name, WAF rule) pairs, with one
+        GetMetricData request (one per MAX_METRIC_DATA_QUERIES metrics).
             Parameters:
-                metric_name: string. The name of the metric. Optional.
-                period_seconds: integer. The granularity, in seconds, of the returned data points.
-                waf_rule: string. The name of the WAF rule.
-                namespace: string. The namespace of the metric. Optional.
-                statistics: list. The metric statistics, other than percentile. Optional.
-                start_time: datetime. The time stamp that determines the first data point to return. Optional.
-                end_time: datetime. The time stamp that determines the last data point to return. Optional.
-                web_acl: string. The name of the WebACL. Optional
-
-            Returns: Metric data points if any, or None
+                metrics: list. (metric_name, waf_rule) pairs.
+                period_seconds: integer. The length, in seconds, of the time window, a multiple of 60.
+                end_time: datetime. The end of the time window. Optional, now.
+                namespace: string. The namespace of the metrics. Optional.
+                statistic: string. The metric statistic. Optional.
+                web_acl: string. The environment variable of the name of the WebACL. Optional
+
+            Returns: list. The statistic of each metric over the time window, None for the
+                     metrics without data points. None for all of them if the request failed.
         """
+        # The window is computed at every call, aligned to the minute
+        if end_time is None:
+            end_time = datetime.datetime.now(datetime.timezone.utc)
+        end_time = end_time.replace(second=0, microsecond=0)
+        start_time = end_time - datetime.timedelta(seconds=period_seconds)
+
+        queries = [{
+            'Id': 'm%d' % i,
+            'MetricStat': {
+                'Metric': {
+                    'Namespace': namespace,
+                    'MetricName': metric_name,
+                    'Dimensions': [
+                        {'Name': 'Rule', 'Value': waf_rule},
+                        {'Name': 'WebACL', 'Value': environ.get(web_acl)},
+                        {'Name': 'Region', 'Value': environ.get('AWS_REGION')}
+                    ]
+                },
+                'Period': period_seconds,
+                'Stat': statistic
+            },
+            'ReturnData': True
+        } for i, (metric_name, waf_rule) in enumerate(metrics)]
+
+        values = {}
         try:
-            response = self.cw_client.get_metric_statistics(
-                MetricName=metric_name,
-                Namespace=namespace,
-                Statistics=statistics,
-                Period=period_seconds,
-                StartTime=start_time - datetime.timedelta(seconds=period_seconds),
-                EndTime=end_time,
-                Dimensions=[
-                    {
-                        "Name": "Rule",
-                        "Value": waf_rule
-                    },
-                    {
-                        "Name": "WebACL",
-                        "Value": environ.get(web_acl)
-                    },
-                    {
-                        "Name": "Region",
-                        "Value": environ.get('AWS_REGION')
-                    }
-                ]
-            )
-            self.log.debug("[cw_metrics_util: get_cw_metric_statistics] response:\n{}".format(response))
-            return response if len(response['Datapoints']) > 0 else None
+            for start in range(0, len(queries), MAX_METRIC_DATA_QUERIES):
+                kwargs = {
+                    'MetricDataQueries': queries[start:start + MAX_METRIC_DATA_QUERIES],
+                    'StartTime': start_time,
+                    'EndTime': end_time
+                }
+                while True:
+                    response = self.cw_client.get_metric_data(**kwargs)
+                    self.log.debug("[cw_metrics_util: get_waf_cw_metrics] response:\n{}".format(response))
+                    for result in response.get('MetricDataResults', []):
+                        values.setdefault(result['Id'], []).extend(result.get('Values', []))
+                    if not response.get('NextToken'):
+                        break
+                    kwargs['NextToken'] = response['NextToken']
         except Exception as e:
-            self.log.error("[cw_metrics_util: get_cw_metric_statistics] Failed to get metric %s.", metric_name)
+            self.log.error("[cw_metrics_util: get_waf_cw_metrics] Failed to get %d metrics.", len(metrics))
             self.log.error(e)
-            return None
+            return [None] * len(metrics)
+
+        return [sum(values['m%d' % i]) if values.get('m%d' % i) else None for i in range(len(metrics))]
+
+    def add_waf_cw_metrics_to_usage_data(self, metrics, period_seconds, usage_data):
+        """
+        Get the CloudWatch metrics of WAF rules with a single request, and add them
+        to the anonymized usage data collected by the solution.
+            Parameters:
+                metrics: list. (metric_name, waf_rule, usage_data_field_name, default_value) of the
+                         usage data fields whose value will be replaced by the waf cloudwatch metric
+                period_seconds: integer. The length, in seconds, of the time window, up to now.
+                usage_data: JSON. Anonymized customer usage data of the solution
+
+            Returns: JSON. usage data.
+        """
+        self.log.info("[cw_metrics_util: add_waf_cw_metrics_to_usage_data] "
+            + "Get %d metrics of the last %d seconds." % (len(metrics), period_seconds))
+
+        values = self.get_waf_cw_metrics([(metric_name, waf_rule) for metric_name, waf_rule, _, _ in metrics],
+                                         period_seconds)
+        for (metric_name, waf_rule, usage_data_field_name, default_value), value in zip(metrics, values):
+            usage_data[usage_data_field_name] = value if value is not None else default_value
+            self.log.info("[cw_metrics_util: add_waf_cw_metrics_to_usage_data] "
+                + "%s  - rule %s: %s" % (metric_name, waf_rule, str(usage_data[usage_data_field_name])))
+
+        return usage_data
 
     def add_waf_cw_metric_to_usage_data(self, metric_name, period_seconds, waf_rule,
                                         usage_data, usage_data_field_name, default_value):
         """
         Get the CloudWatch metric statistics given a WAF rule and metric name, and
-        add it to the anonymized usage data collected by the solution.
-            Parameters:
-                metric_name: string. The name of the metric. Optional.
-                period_seconds: integer. The granularity, in seconds, of the returned data points.
-                waf_rule: string. The name of the WAF rule.
-                usage_data: JSON. Anonymized customer usage data of the solution
-                usage_data_field_name: string. The field name in the usage data whose value will be
-                                       replaced by the waf cloudwatch metric (if any)
-                default_value: number. The default value of the field in the usage data 
+        add it to the anonymized usage data collected by the solution. To add several
+        metrics, use add_waf_cw_metrics_to_usage_data, that gets them in one request.
 
             Returns: JSON. usage data.
         """
-        self.log.info("[cw_metrics_util: add_waf_cw_metric_to_usage_data] "
-            + "Get metric %s for waf rule %s." %(metric_name, waf_rule))
+        return self.add_waf_cw_metrics_to_usage_data(
+            [(metric_name, waf_rule, usage_data_field_name, default_value)], period_seconds, usage_data)
 
-        response = self.get_cw_metric_statistics(
-            metric_name=metric_name,
-            period_seconds=period_seconds,
-            waf_rule=waf_rule
-        )
-        usage_data[usage_data_field_name] = \
-            response['Datapoints'][0]['Sum'] if response is not None else default_value
 
-        self.log.info("[cw_metrics_util: add_waf_cw_metric_to_usage_data] "
-            + "%s  - rule %s: %s"%(metric_name, waf_rule, str(usage_data[usage_data_field_name])))
+class UsageReportTimer(object):
+    """
+    In-container timer of the anonymized usage reports: due at most once per period_seconds,
+    the first time at the first call of a container.
+    """
+    def __init__(self, period_seconds, clock=monotonic):
+        self.period_seconds = period_seconds
+        self.clock = clock
+        self.reported_at = None
 
-        return usage_data
\ No newline at end of file
+    def due(self):
+        """
+        Return True, and start a new period, if no report was made in the current period.
+        """
+        now = self.clock()
+        if self.reported_at is not None and now - self.reported_at < self.period_seconds:
+            return False
+        self.reported_at = now
+        return True
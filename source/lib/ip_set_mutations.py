@@ -0,0 +1,508 @@
+######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                #
+#                                                                                                                    #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance    #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+
+
+import json
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from os import getenv
+from time import monotonic, sleep, time
+from uuid import uuid4
+
+from botocore.exceptions import ClientError
+
+from lib.boto3_util import create_client, create_resource
+from lib.ip_util import format_cidr, parse_ip
+
+# IP set mutation intents, queued by the producers (log parser, Athena log parser, access handler, reputation
+# lists parser, IP retention handler) instead of writing the IP sets themselves:
+#   {"scope": "REGIONAL", "name": "<ip set name>", "ip_set_arn": "<ip set arn or id>",
+#    "action": "add" | "remove" | "replace", "addresses": ["10.0.0.1/32"], "enqueued_at": 1682370000.5, "part": 0}
+# A replace split in several parts also has "replace_id" and "parts", its number of parts.
+# A replace also has "generation", "<enqueued_at in microseconds, 16 digits>#<replace id>", shared by its
+# parts: the applier drops a replace not newer than the last one it applied to the IP set.
+# The applier folds the intents of a window into one net update per IP set.
+ADD = 'add'
+REMOVE = 'remove'
+REPLACE = 'replace'
+ACTIONS = [ADD, REMOVE, REPLACE]
+
+DEFAULT_WINDOW_SECONDS = 5
+SQS_BATCH_SIZE = 10
+SQS_MAX_BATCH_BYTES = 256 * 1024
+# 4000 IPv6 CIDRs fit in a 256 KiB SQS message
+MAX_ADDRESSES_PER_MESSAGE = 4000
+IDLE_POLL_SECONDS = 0.05
+# Intents already applied, remembered to acknowledge them when they are delivered again
+MAX_APPLIED_INTENTS = 100000
+
+QUEUES = {}
+
+
+def make_intents(scope, name, ip_set_arn, action, addresses, max_addresses=MAX_ADDRESSES_PER_MESSAGE):
+    """
+    Return the intents to apply action to addresses of an IP set, in parts of at most max_addresses
+    addresses. The parts of a replace share a replace_id: the applier holds them until it has all of
+    them, so the IP set is never left with only some of them.
+    """
+    if action not in ACTIONS:
+        raise ValueError("Unknown IP set mutation action %s" % action)
+    addresses = list(addresses)
+    enqueued_at = time()
+    starts = range(0, max(len(addresses), 1), max_addresses)
+    replace_id = uuid4().hex if action == REPLACE and len(starts) > 1 else None
+    generation = '%016d#%s' % (int(enqueued_at * 1000000), replace_id or uuid4().hex) if action == REPLACE \
+        else None
+    intents = []
+    for part, start in enumerate(starts):
+        intent = {
+            'scope': scope,
+            'name': name,
+            'ip_set_arn': ip_set_arn,
+            'action': action,
+            'addresses': addresses[start:start + max_addresses],
+            'enqueued_at': enqueued_at,
+            'part': part
+        }
+        if replace_id is not None:
+            intent['replace_id'] = replace_id
+            intent['parts'] = len(starts)
+        if generation is not None:
+            intent['generation'] = generation
+        intents.append(intent)
+    return intents
+
+
+class SQSMutationQueue(object):
+    """
+    Intents as the JSON bodies of SQS messages. With a FIFO queue, the intents of an IP set share a
+    message group and keep their order.
+    """
+
+    def __init__(self, queue_url, client=None):
+        self.queue_url = queue_url
+        self.fifo = queue_url.endswith('.fifo')
+        self.client = client or create_client('sqs')
+
+    def entry(self, i, intent):
+        entry = {'Id': str(i), 'MessageBody': json.dumps(intent, separators=(',', ':'))}
+        if self.fifo:
+            entry['MessageGroupId'] = intent['ip_set_arn'].split('/')[-1]
+            entry['MessageDeduplicationId'] = uuid4().hex
+        return entry
+
+    def send(self, intents):
+        """
+        Queue intents, return their number. Raise RuntimeError if some could not be queued.
+        """
+        batches = [[]]
+        size = 0
+        for i, intent in enumerate(intents):
+            entry = self.entry(i, intent)
+            if len(batches[-1]) == SQS_BATCH_SIZE or size + len(entry['MessageBody']) > SQS_MAX_BATCH_BYTES:
+                batches.append([])
+                size = 0
+            batches[-1].append(entry)
+            size += len(entry['MessageBody'])
+
+        for entries in batches:
+            if not entries:
+                continue
+            response = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            if response.get('Failed'):
+                raise RuntimeError("%d IP set mutations not queued: %s" % (
+                    len(response['Failed']), response['Failed'][0].get('Message')))
+        return len(intents)
+
+    def receive(self, max_messages=SQS_BATCH_SIZE, wait_seconds=0):
+        """
+        Return up to max_messages [(receipt handle, intent)].
+        """
+        response = self.client.receive_message(QueueUrl=self.queue_url, MaxNumberOfMessages=max_messages,
+                                               WaitTimeSeconds=wait_seconds)
+        return [(message['ReceiptHandle'], json.loads(message['Body'])) for message in response.get('Messages', [])]
+
+    def delete(self, receipts):
+        for start in range(0, len(receipts), SQS_BATCH_SIZE):
+            self.client.delete_message_batch(QueueUrl=self.queue_url, Entries=[
+                {'Id': str(i), 'ReceiptHandle': receipt}
+                for i, receipt in enumerate(receipts[start:start + SQS_BATCH_SIZE])])
+
+
+class LocalMutationQueue(object):
+    """
+    In-memory stand-in for SQSMutationQueue, in order, for tests and benchmarks. Received intents stay
+    in flight until deleted. Thread safe.
+    """
+
+    def __init__(self):
+        self.messages = deque()
+        self.in_flight = {}
+        self.next_receipt = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.messages)
+
+    def send(self, intents):
+        with self.lock:
+            # Serialized like SQS does, so producers can't change queued intents
+            self.messages.extend(json.dumps(intent) for intent in intents)
+        return len(intents)
+
+    def receive(self, max_messages=SQS_BATCH_SIZE, wait_seconds=0):
+        received = []
+        with self.lock:
+            while self.messages and len(received) < max_messages:
+                self.next_receipt += 1
+                body = self.in_flight[self.next_receipt] = self.messages.popleft()
+                received.append((self.next_receipt, json.loads(body)))
+        return received
+
+    def delete(self, receipts):
+        with self.lock:
+            for receipt in receipts:
+                self.in_flight.pop(receipt, None)
+
+
+def get_ip_set_mutation_queue():
+    """
+    Return the SQSMutationQueue of IP_SET_MUTATION_QUEUE_URL, None when IP set mutations are not queued.
+    """
+    queue_url = getenv('IP_SET_MUTATION_QUEUE_URL')
+    if not queue_url:
+        return None
+    if queue_url not in QUEUES:
+        QUEUES[queue_url] = SQSMutationQueue(queue_url)
+    return QUEUES[queue_url]
+
+
+class ReplaceGenerationStore(ABC):
+    """
+    Generation of the last replace applied to each IP set, keyed by ip_set_key, so a replace delivered
+    again after a newer one was applied (a failed batch item) does not revert the IP set.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """
+        Return the generation of the last replace applied to the IP set, None if there is none.
+        """
+
+    @abstractmethod
+    def put(self, key, generation):
+        """
+        Record generation for the IP set, unless a newer one is recorded already.
+        """
+
+
+class MemoryReplaceGenerationStore(ReplaceGenerationStore):
+    """
+    Generations kept in memory by the applier, lost with its container.
+    """
+
+    def __init__(self):
+        self.generations = {}
+
+    def get(self, key):
+        return self.generations.get(key)
+
+    def put(self, key, generation):
+        if self.generations.get(key, '') < generation:
+            self.generations[key] = generation
+
+
+class DynamoDBReplaceGenerationStore(ReplaceGenerationStore):
+    """
+    Generations in a DynamoDB table with a string partition key named pk, one item per IP set
+    ('<scope>#<ip set id>'). A generation is only written over an older one.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, key):
+        response = self.table.get_item(Key={'pk': '%s#%s' % key}, ProjectionExpression='#generation',
+                                       ExpressionAttributeNames={'#generation': 'generation'}, ConsistentRead=True)
+        return response.get('Item', {}).get('generation')
+
+    def put(self, key, generation):
+        try:
+            self.table.update_item(
+                Key={'pk': '%s#%s' % key},
+                UpdateExpression='SET #generation = :generation',
+                ConditionExpression='attribute_not_exists(#generation) OR #generation < :generation',
+                ExpressionAttributeNames={'#generation': 'generation'},
+                ExpressionAttributeValues={':generation': generation})
+        except ClientError as e:
+            # A newer replace is recorded already
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+
+
+def get_replace_generation_store():
+    """
+    Return the DynamoDBReplaceGenerationStore of IP_SET_MUTATION_TABLE_NAME, a MemoryReplaceGenerationStore
+    when it is not set.
+    """
+    table_name = getenv('IP_SET_MUTATION_TABLE_NAME')
+    if not table_name:
+        return MemoryReplaceGenerationStore()
+    return DynamoDBReplaceGenerationStore(create_resource('dynamodb').Table(table_name))
+
+
+def canonical_address(address):
+    parsed = parse_ip(address)
+    return format_cidr(parsed) if parsed is not None else address.strip()
+
+
+class IPSetMutation(object):
+    """
+    Net change of an IP set for a sequence of intents: its addresses (replaced) or the addresses to
+    add and remove (not replaced).
+    """
+
+    def __init__(self, scope, name, ip_set_arn):
+        self.scope = scope
+        self.name = name
+        self.ip_set_arn = ip_set_arn
+        self.replaced = None
+        self.replace_id = None
+        self.generation = None
+        self.added = set()
+        self.removed = set()
+        self.intents = 0
+        self.receipts = []
+
+    def apply(self, intent):
+        addresses = set(canonical_address(address) for address in intent['addresses'])
+        self.intents += 1
+        if intent['action'] == REPLACE:
+            if intent.get('replace_id') is not None and intent['replace_id'] == self.replace_id:
+                # Next part of the same replace
+                self.replaced |= addresses
+            else:
+                self.replaced = addresses
+                self.replace_id = intent.get('replace_id')
+            if intent.get('generation') is not None and (self.generation is None or
+                                                         intent['generation'] > self.generation):
+                self.generation = intent['generation']
+            self.added.clear()
+            self.removed.clear()
+        elif self.replaced is not None:
+            if intent['action'] == ADD:
+                self.replaced |= addresses
+            else:
+                self.replaced -= addresses
+        elif intent['action'] == ADD:
+            self.added |= addresses
+            self.removed -= addresses
+        else:
+            self.removed |= addresses
+            self.added -= addresses
+
+
+def ip_set_key(intent):
+    return intent['scope'], intent['ip_set_arn'].split('/')[-1]
+
+
+def intent_order(message):
+    return message[1].get('enqueued_at', 0), message[1].get('part', 0)
+
+
+def intent_id(intent):
+    return json.dumps(intent, sort_keys=True, separators=(',', ':'))
+
+
+def coalesce(messages):
+    """
+    Fold [(receipt, intent)] into one IPSetMutation per IP set, intents in enqueued order.
+    """
+    mutations = {}
+    for receipt, intent in sorted(messages, key=intent_order):
+        if intent.get('action') not in ACTIONS:
+            raise ValueError("Unknown IP set mutation action %s" % intent.get('action'))
+        key = ip_set_key(intent)
+        mutation = mutations.get(key)
+        if mutation is None:
+            mutation = mutations[key] = IPSetMutation(intent['scope'], intent['name'], intent['ip_set_arn'])
+        mutation.apply(intent)
+        mutation.receipts.append(receipt)
+    return list(mutations.values())
+
+
+class IPSetMutationApplier(object):
+    """
+    Apply queued intents with one IP set update per IP set per window, through an IPSetUpdater
+    (lib.ip_set_updater).
+
+    The parts of a split replace may be delivered in different batches and in any order: from the
+    first replace missing parts on, the intents of its IP set are held (reported failed, so the queue
+    delivers them again) until all the parts arrived. Keep the applier across batches (warm Lambda
+    invocations) for that.
+
+    A replace whose generation is not newer than the last one applied to its IP set (generations) is
+    dropped and acknowledged.
+    """
+
+    def __init__(self, log, queue, updater, window_seconds=DEFAULT_WINDOW_SECONDS, clock=monotonic, sleep=sleep,
+                 generations=None):
+        self.log = log
+        self.queue = queue
+        self.updater = updater
+        self.window_seconds = window_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.generations = generations if generations is not None else MemoryReplaceGenerationStore()
+        self.stats = {'intents': 0, 'updates': 0, 'applied': 0, 'skipped': 0, 'failed': 0, 'held': 0, 'stale': 0}
+        self.held = {}                  # ip set key -> {intent id: (receipt, intent)}
+        self.applied = OrderedDict()    # intent id -> None
+
+    def hold_incomplete_replaces(self, messages):
+        """
+        Return the messages that can be applied, with the held ones they complete, and the messages held.
+        """
+        by_ip_set = {}
+        for receipt, intent in messages:
+            id_ = intent_id(intent)
+            if id_ not in self.applied:
+                # A message delivered again replaces the held one, the receipt of the last delivery is the valid one
+                key = ip_set_key(intent)
+                if key not in by_ip_set:
+                    by_ip_set[key] = dict(self.held.get(key, {}))
+                by_ip_set[key][id_] = (receipt, intent)
+
+        ready = []
+        held = []
+        for key, pending in by_ip_set.items():
+            pending = sorted(pending.values(), key=intent_order)
+            parts = {}
+            for _, intent in pending:
+                if intent.get('replace_id') is not None:
+                    parts.setdefault(intent['replace_id'], set()).add(intent.get('part', 0))
+            cut = len(pending)
+            for i, (_, intent) in enumerate(pending):
+                if intent.get('replace_id') is not None and len(parts[intent['replace_id']]) < intent['parts']:
+                    cut = i
+                    break
+            ready.extend(pending[:cut])
+            held.extend(pending[cut:])
+            if cut < len(pending):
+                self.held[key] = {intent_id(intent): (receipt, intent) for receipt, intent in pending[cut:]}
+            else:
+                self.held.pop(key, None)
+        return ready, held
+
+    def drop_stale_replaces(self, messages):
+        """
+        Return the messages without the replaces older than the last one applied to their IP set.
+        """
+        last = {}
+        fresh = []
+        for receipt, intent in messages:
+            if intent['action'] == REPLACE and intent.get('generation') is not None:
+                key = ip_set_key(intent)
+                if key not in last:
+                    last[key] = self.generations.get(key)
+                if last[key] is not None and intent['generation'] <= last[key]:
+                    self.stats['stale'] += 1
+                    self.log.info("[ip_set_mutations: drop_stale_replaces] Dropping replace %s of IPSet %s, "
+                                  "%s was applied" % (intent['generation'], intent['name'], last[key]))
+                    continue
+            fresh.append((receipt, intent))
+        return fresh
+
+    def apply(self, messages):
+        """
+        Apply [(receipt, intent)], return the receipts of the intents whose IP set could not be updated
+        and of the intents held.
+        """
+        ready, held = self.hold_incomplete_replaces(messages)
+        ready = self.drop_stale_replaces(ready)
+        received = set(receipt for receipt, _ in messages)
+        failed = [receipt for receipt, _ in held if receipt in received]
+        if held:
+            self.stats['held'] += len(held)
+            self.log.info("[ip_set_mutations: apply] Holding %d intents until their replace is complete" % len(held))
+
+        intents = dict((receipt, intent) for receipt, intent in ready)
+        for mutation in coalesce(ready):
+            if mutation.replaced is not None:
+                applied, response = self.updater.commit(mutation.scope, mutation.name, mutation.ip_set_arn,
+                                                        sorted(mutation.replaced))
+            else:
+                applied, response = self.updater.commit(mutation.scope, mutation.name, mutation.ip_set_arn,
+                                                        sorted(mutation.added), merge=True,
+                                                        removed=sorted(mutation.removed))
+            self.stats['intents'] += mutation.intents
+            self.stats['updates'] += 1
+            if response is None:
+                self.stats['failed'] += 1
+                failed.extend(mutation.receipts)
+                self.log.error("[ip_set_mutations: apply] Failed to update IPSet %s, %d intents" % (
+                    mutation.name, mutation.intents))
+            else:
+                self.stats['applied' if applied else 'skipped'] += 1
+                self.log.info("[ip_set_mutations: apply] IPSet %s %s, %d intents" % (
+                    mutation.name, 'updated' if applied else 'unchanged', mutation.intents))
+                for receipt in mutation.receipts:
+                    self.applied[intent_id(intents[receipt])] = None
+                if mutation.generation is not None:
+                    self.generations.put((mutation.scope, mutation.ip_set_arn.split('/')[-1]), mutation.generation)
+        while len(self.applied) > MAX_APPLIED_INTENTS:
+            self.applied.popitem(last=False)
+        return failed
+
+    def run_once(self):
+        """
+        Receive intents for window_seconds, then apply them. Failed intents are not deleted, the queue
+        delivers them again. Return the number of intents received.
+        """
+        messages = []
+        deadline = self.clock() + self.window_seconds
+        while True:
+            remaining = deadline - self.clock()
+            if remaining <= 0:
+                break
+            received = self.queue.receive(wait_seconds=min(int(remaining), 20))
+            if received:
+                messages.extend(received)
+            else:
+                self.sleep(min(IDLE_POLL_SECONDS, remaining))
+        if messages:
+            held = self.held_receipts()
+            failed = set(self.apply(messages))
+            # With the intents held by earlier runs and applied now
+            released = held - self.held_receipts()
+            receipts = [receipt for receipt, _ in messages if receipt not in failed]
+            self.queue.delete(receipts + [receipt for receipt in released - failed if receipt not in receipts])
+        return len(messages)
+
+    def held_receipts(self):
+        return set(receipt for pending in self.held.values() for receipt, _ in pending.values())
+
+    def apply_sqs_records(self, records):
+        """
+        Apply the records of an SQS event, return the batch item failures of the event response.
+        """
+        failed = set(self.apply([(record['messageId'], json.loads(record['body'])) for record in records]))
+        # Only the records of this batch, not the held ones of earlier batches applied with them
+        return {'batchItemFailures': [{'itemIdentifier': record['messageId']} for record in records
+                                      if record['messageId'] in failed]}
+
+
+def get_ip_set_mutation_applier(log, queue, updater):
+    return IPSetMutationApplier(log, queue, updater,
+                                float(getenv('IP_SET_MUTATION_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)),
+                                generations=get_replace_generation_store())
@@ -0,0 +1,140 @@
+######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                #
+#                                                                                                                    #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance    #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+
+
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import getenv
+from time import monotonic, sleep
+
+from botocore.exceptions import ClientError
+
+from lib import waflibv2
+
+# WAF API calls per second and burst shared by the IP set updates of a container. The defaults stay below
+# the per-account AWS WAF control plane limits, raise them if the account quotas allow more.
+DEFAULT_CALLS_PER_SECOND = 1.0
+DEFAULT_BURST = 4
+DEFAULT_CONCURRENCY = 2
+MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+THROTTLING_ERROR_CODES = ['WAFLimitsExceededException', 'ThrottlingException', 'TooManyRequestsException']
+
+# Module level, so concurrent updates and warm invocations share the same budget
+TOKEN_BUCKET = None
+TOKEN_BUCKET_LOCK = threading.Lock()
+
+
+class TokenBucket(object):
+    """
+    Allow rate calls per second on average and up to burst at once. Thread safe.
+    """
+
+    def __init__(self, rate=DEFAULT_CALLS_PER_SECOND, burst=DEFAULT_BURST, clock=monotonic, sleep=sleep):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self.tokens = float(burst)
+        self.updated_at = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """
+        Wait until tokens are available and take them. Return the seconds waited.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return waited
+                wait = (tokens - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+
+def is_throttling_error(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+
+
+class IPSetUpdater(object):
+    """
+    Commit IP set updates (see WAFLIBv2.commit_ip_set) concurrently, every WAF API call
+    taking a token of the bucket. Calls are retried with exponential backoff and full
+    jitter only when WAF throttles them.
+    """
+
+    def __init__(self, log, waflib, bucket, max_workers=DEFAULT_CONCURRENCY, max_retries=MAX_RETRIES,
+                 sleep=sleep):
+        self.log = log
+        self.waflib = waflib
+        self.bucket = bucket
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.throttled = 0
+
+    def call(self, operation, **kwargs):
+        """
+        Call a WAFv2 client operation under the token bucket.
+        """
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                return getattr(waflibv2.client, operation)(**kwargs)
+            except ClientError as error:
+                if not is_throttling_error(error) or attempt == self.max_retries:
+                    raise
+                self.throttled += 1
+                delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                self.log.warning("[ip_set_updater: call] %s throttled, retrying in %.2f s" % (operation, delay))
+                self.sleep(delay)
+
+    def commit(self, scope, name, ip_set_arn, addresses, read_back=False, **kwargs):
+        return self.waflib.commit_ip_set(self.log, scope, name, ip_set_arn, addresses, read_back, call=self.call,
+                                         **kwargs)
+
+    def commit_all(self, scope, updates, read_back=False):
+        """
+        Commit [(name, ip set arn, addresses)] at the same time, return their
+        (applied, response) in the same order.
+        """
+        if len(updates) <= 1 or self.max_workers <= 1:
+            return [self.commit(scope, *update, read_back=read_back) for update in updates]
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(updates))) as executor:
+            futures = [executor.submit(self.commit, scope, *update, read_back=read_back) for update in updates]
+            return [future.result() for future in futures]
+
+
+def get_token_bucket():
+    global TOKEN_BUCKET
+    with TOKEN_BUCKET_LOCK:
+        if TOKEN_BUCKET is None:
+            TOKEN_BUCKET = TokenBucket(float(getenv('WAF_API_CALLS_PER_SECOND', DEFAULT_CALLS_PER_SECOND)),
+                                       int(getenv('WAF_API_BURST', DEFAULT_BURST)))
+        return TOKEN_BUCKET
+
+
+def get_ip_set_updater(log, waflib):
+    """
+    Return an IPSetUpdater sharing the container token bucket, configured by WAF_API_CALLS_PER_SECOND,
+    WAF_API_BURST and IP_SET_UPDATE_CONCURRENCY.
+    """
+    return IPSetUpdater(log, waflib, get_token_bucket(),
+                        max_workers=int(getenv('IP_SET_UPDATE_CONCURRENCY', DEFAULT_CONCURRENCY)))
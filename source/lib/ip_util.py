@@ -0,0 +1,117 @@
+######################################################################################################################
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.                                                #
+#                                                                                                                    #
+#  Licensed under the Apache License, Version 2.0 (the "License"). You may not use this file except in compliance    #
+#  with the License. A copy of the License is located at                                                             #
+#                                                                                                                    #
+#      http://www.apache.org/licenses/LICENSE-2.0                                                                    #
+#                                                                                                                    #
+#  or in the "license" file accompanying this file. This file is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES #
+#  OR CONDITIONS OF ANY KIND, express or implied. See the License for the specific language governing permissions    #
+#  and limitations under the License.                                                                                #
+######################################################################################################################
+
+
+from functools import lru_cache
+from socket import AF_INET, AF_INET6, inet_ntop, inet_pton
+
+IP_CACHE_SIZE = 65536
+FAMILIES = {4: AF_INET, 6: AF_INET6}
+ADDRESS_BITS = {4: 32, 6: 128}
+ADDRESS_BYTES = {4: 4, 6: 16}
+
+
+def parse_address(text):
+    """
+    Return (version, address as an integer) of an ip address string, None if it is
+    not one. Not cached: for hot paths with their own cache.
+    """
+    version = 6 if ':' in text else 4
+    try:
+        return version, int.from_bytes(inet_pton(FAMILIES[version], text), 'big')
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+def format_address(version, address):
+    return inet_ntop(FAMILIES[version], address.to_bytes(ADDRESS_BYTES[version], 'big'))
+
+
+@lru_cache(maxsize=IP_CACHE_SIZE)
+def parse_ip(text):
+    """
+    Return (version, address as an integer, prefix length) of an ip address or
+    CIDR string, None if it is neither. Addresses have a /32 or /128 prefix length.
+    """
+    if not isinstance(text, str):
+        return None
+    address, slash, prefix = text.strip().partition('/')
+    parsed = parse_address(address)
+    if parsed is None:
+        return None
+    version, value = parsed
+    if not slash:
+        return version, value, ADDRESS_BITS[version]
+    if not prefix.isdigit() or int(prefix) > ADDRESS_BITS[version]:
+        return None
+    return version, value, int(prefix)
+
+
+def parse_ips(texts):
+    """
+    parse_ip over a list of strings.
+    """
+    return list(map(parse_ip, texts))
+
+
+def ip_version(text):
+    """
+    Return 4 or 6 for an ip address or CIDR string, None if it is neither.
+    """
+    parsed = parse_ip(text)
+    return parsed[0] if parsed is not None else None
+
+
+def is_address(text):
+    return parse_ip(text) is not None and '/' not in text
+
+
+def is_network(parsed):
+    """
+    Return True if parsed (see parse_ip) has no host bits set.
+    """
+    version, address, prefixlen = parsed
+    return address & ((1 << (ADDRESS_BITS[version] - prefixlen)) - 1) == 0
+
+
+def network_range(parsed):
+    """
+    Return the first and last addresses (integers) of the network of parsed (see
+    parse_ip), host bits ignored.
+    """
+    version, address, prefixlen = parsed
+    host_mask = (1 << (ADDRESS_BITS[version] - prefixlen)) - 1
+    return address & ~host_mask, address | host_mask
+
+
+def format_cidr(parsed):
+    version, address, prefixlen = parsed
+    return '%s/%d' % (format_address(version, address), prefixlen)
+
+
+def split_ip_set_addresses(texts, log=None):
+    """
+    Return the IPv4 and IPv6 IP set addresses of ip address and CIDR strings:
+    addresses get a /32 or /128 suffix, CIDRs are kept as they are. Other strings
+    are skipped (and logged if log is given).
+    """
+    addresses = {4: [], 6: []}
+    for text in texts:
+        parsed = parse_ip(text)
+        if parsed is None:
+            if log is not None:
+                log.error("Source ip %s is not IPV4 or IPV6.", str(text))
+            continue
+        text = text.strip()
+        addresses[parsed[0]].append(text if '/' in text else '%s/%d' % (text, parsed[2]))
+    return addresses[4], addresses[6]
@@ -13,6 +13,7 @@
 #!/bin/python
 
 import json
+from botocore.exceptions import ClientError
 from lib.boto3_util import create_client, create_resource
 
 class S3(object):
@@ -42,6 +43,57 @@ class S3(object):
             self.log.error(e)
             raise e
 
+    def get_object(self, bucket_name, key_name, byte_range=None):
+        try:
+            args = {'Bucket': bucket_name, 'Key': key_name}
+            if byte_range is not None:
+                args['Range'] = 'bytes=%d-%d' % byte_range
+            return self.s3_client.get_object(**args)
+        except Exception as e:
+            self.log.error("[s3_util: get_object] Error to get object %s from bucket %s."
+                           %(key_name, bucket_name))
+            self.log.error(e)
+            raise e
+
+    def get_object_if_changed(self, bucket_name, key_name, etag=None):
+        """
+        Conditional GET: return None if the object still has the given ETag.
+        """
+        try:
+            args = {'Bucket': bucket_name, 'Key': key_name}
+            if etag is not None:
+                args['IfNoneMatch'] = etag
+            return self.s3_client.get_object(**args)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ['304', 'NotModified']:
+                return None
+            self.log.error("[s3_util: get_object_if_changed] Error to get object %s from bucket %s."
+                           %(key_name, bucket_name))
+            self.log.error(e)
+            raise e
+
+    def put_object(self, bucket_name, key_name, body, content_type="application/json"):
+        try:
+            return self.s3_client.put_object(Bucket=bucket_name, Key=key_name, Body=body, ContentType=content_type)
+        except Exception as e:
+            self.log.error("[s3_util: put_object] Error to put object %s to bucket %s."
+                           %(key_name, bucket_name))
+            self.log.error(e)
+            raise e
+
+    def list_object_keys(self, bucket_name, prefix):
+        try:
+            keys = []
+            paginator = self.s3_client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+                keys.extend(obj['Key'] for obj in page.get('Contents', []))
+            return keys
+        except Exception as e:
+            self.log.error("[s3_util: list_object_keys] Error to list objects with prefix %s in bucket %s."
+                           %(prefix, bucket_name))
+            self.log.error(e)
+            raise e
+
     def upload_file_to_s3(self, file_path, bucket_name, key_name, 
                           extra_args={'ContentType': "application/json"}):
         try:
@@ -12,21 +12,83 @@
 ######################################################################################################################
 # import boto3
 # from botocore.config import Config
+import threading
+from os import getenv
+from time import monotonic
 from botocore.exceptions import ClientError
-from ipaddress import ip_address
+from lib.ip_util import format_cidr, parse_ip
 from backoff import on_exception, expo, full_jitter
 from lib.boto3_util import create_client
 
 API_CALL_NUM_RETRIES = 5
 MAX_TIME = 20
+DEFAULT_IP_SET_CACHE_TTL_SECONDS = 30
+OPTIMISTIC_LOCK_ERROR_CODES = ['WAFOptimisticLockException', 'OptimisticLockException']
 
 client = create_client('wafv2')
 
+
+def is_optimistic_lock_error(error):
+    return isinstance(error, ClientError) and error.response.get('Error', {}).get('Code') in OPTIMISTIC_LOCK_ERROR_CODES
+
+
+class IPSetSnapshotCache(object):
+    """
+    Last known GetIPSet response ({'IPSet': {...}, 'LockToken': ...}) of the IP sets, by (scope, ip set id).
+    Snapshots are refreshed from the GetIPSet and UpdateIPSet responses and dropped on
+    WAFOptimisticLockException, when someone else changed the IP set. Thread safe.
+    """
+
+    def __init__(self, clock=monotonic):
+        self.clock = clock
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def get(self, scope, ip_set_id, max_age=None):
+        """
+        Return a copy of the snapshot, None if there is none or it is older than max_age seconds.
+        """
+        with self.lock:
+            entry = self.snapshots.get((scope, ip_set_id))
+        if entry is None or (max_age is not None and self.clock() - entry[0] > max_age):
+            return None
+        snapshot = entry[1]
+        return {'IPSet': dict(snapshot['IPSet'], Addresses=list(snapshot['IPSet']['Addresses'])),
+                'LockToken': snapshot['LockToken']}
+
+    def refresh(self, scope, ip_set_id, ip_set, lock_token):
+        """
+        Store ip_set (an IPSet, or the fields of it that changed) with lock_token.
+        """
+        with self.lock:
+            previous = self.snapshots.get((scope, ip_set_id))
+            if previous is not None:
+                ip_set = dict(previous[1]['IPSet'], **ip_set)
+            ip_set['Addresses'] = list(ip_set.get('Addresses', []))
+            self.snapshots[(scope, ip_set_id)] = (self.clock(), {'IPSet': ip_set, 'LockToken': lock_token})
+
+    def invalidate(self, scope, ip_set_id):
+        with self.lock:
+            self.snapshots.pop((scope, ip_set_id), None)
+
+
+# Module level, so the WAFLIBv2 instances and warm invocations of a container share the snapshots
+ip_set_snapshots = IPSetSnapshotCache()
+
+
 class WAFLIBv2(object):
 
     def __init__(self):
+        # Per IP set name: {'applied': updates written, 'skipped': updates with nothing to change}
+        self.update_counters = {}
+        # Read-only callers accept IP set snapshots up to this age
+        self.ip_set_cache_ttl = float(getenv('IP_SET_CACHE_TTL_SECONDS', DEFAULT_IP_SET_CACHE_TTL_SECONDS))
         return
 
+    # Call a WAFv2 client operation, see lib.ip_set_updater for rate limited calls
+    def call_api(self, operation, **kwargs):
+        return getattr(client, operation)(**kwargs)
+
     # Parse arn into ip_set_id
     def arn_to_id(self, arn):
         if arn == None:
@@ -38,29 +100,25 @@ class WAFLIBv2(object):
     def which_ip_version(self, log, source_ip):
         if source_ip == None:
             return None
-        try:
-            source_ip = source_ip.strip()
-            ip_type = "IPV%s"%ip_address(source_ip).version
-            return ip_type
-        except Exception as e:
+        source_ip = source_ip.strip()
+        parsed = parse_ip(source_ip)
+        if parsed is None or '/' in source_ip:
             log.error("Source ip %s is not IPV4 or IPV6.", str(source_ip))
-            log.error(str(e))
             return None
+        return "IPV%s" % parsed[0]
     
     # Append correct cidr to source_ip
     def set_ip_cidr(self, log, source_ip):
         if source_ip == None:
             return None
-        try:
-            source_ip = source_ip.strip()
-            ip_type = "IPV%s"%ip_address(source_ip).version
-        except Exception as e:
+        source_ip = source_ip.strip()
+        parsed = parse_ip(source_ip)
+        if parsed is None or '/' in source_ip:
             log.error("Source ip %s is not IPV4 or IPV6.", str(source_ip))
-            log.error(str(e))
             return None
-        
-        ip_class = "32" if ip_type == "IPV4" else "128"
-        return str(source_ip)+"/"+str(ip_class)
+
+        # /32 or /128
+        return "%s/%d" % (source_ip, parsed[2])
 
     # Retrieve IPSet given an ip_set_id
     def get_ip_set_by_id(self, log, scope, name, ip_set_id):
@@ -71,6 +129,7 @@ class WAFLIBv2(object):
                 Name=name,
                 Id=ip_set_id
             )
+            ip_set_snapshots.refresh(scope, ip_set_id, response['IPSet'], response.get('LockToken'))
             log.debug("[waflib:get_ip_set_by_id] got ip set: \n{}.".format(response))
             log.debug("[waflib:get_ip_set_by_id] End")
             return response
@@ -90,6 +149,7 @@ class WAFLIBv2(object):
                 Name=name,
                 Id=ip_set_id
             )
+            ip_set_snapshots.refresh(scope, ip_set_id, response['IPSet'], response.get('LockToken'))
             log.info("[waflib:get_ip_set] End")
             return response
         except Exception as e:
@@ -97,11 +157,20 @@ class WAFLIBv2(object):
             log.error(str(e))
             return None
 
+    # Retrieve IPSet given an ip set arn, from the snapshot cache when it is at most ip_set_cache_ttl seconds
+    # old. Only for callers that read the IPSet, updates go through commit_ip_set
+    def get_ip_set_cached(self, log, scope, name, arn):
+        response = ip_set_snapshots.get(scope, self.arn_to_id(arn), self.ip_set_cache_ttl)
+        if response is not None:
+            log.info("[waflib:get_ip_set_cached] IPSet %s served from cache", str(name))
+            return response
+        return self.get_ip_set(log, scope, name, arn)
+
     # Get the count of ip addresses based on ip set arn
     @on_exception(expo, client.exceptions.WAFInternalErrorException, max_time=MAX_TIME)
     def get_ip_address_count(self, log, scope, name, arn):
         try:
-            response = self.get_ip_set(log, scope, name, arn)
+            response = self.get_ip_set_cached(log, scope, name, arn)
             log.info(response)
             ip_count = len(response['IPSet']['Addresses']) if response is not None else 0
             log.info("%s IP address count: %s" %(name, str(ip_count)))
@@ -116,11 +185,13 @@ class WAFLIBv2(object):
               max_time=MAX_TIME,
               jitter=full_jitter,
               max_tries=API_CALL_NUM_RETRIES)
-    def update_ip_set_by_id(self, log, scope, name, ip_set_id, addresses, lock_token, description):
+    def update_ip_set_by_id(self, log, scope, name, ip_set_id, addresses, lock_token, description, call=None):
         log.debug("[waflib:update_ip_set_by_id] Start")
+        call = call or self.call_api
 
         try:
-            response = client.update_ip_set(
+            response = call(
+                'update_ip_set',
                 Scope=scope,
                 Name=name,
                 Id=ip_set_id,
@@ -128,19 +199,22 @@ class WAFLIBv2(object):
                 LockToken=lock_token,
                 Description=description
             )
+            ip_set_snapshots.refresh(scope, ip_set_id, {'Name': name, 'Id': ip_set_id, 'Description': description,
+                                                        'Addresses': addresses}, response['NextLockToken'])
 
             log.debug("[waflib:update_ip_set_by_id] update ip set response: \n{}.".format(response))
             log.debug("[waflib:update_ip_set_by_id] End")
             return response
         # Get the latest ip set and retry updating api call when OptimisticLockException occurs
         except ClientError as ex:
-            exception_type = ex.response['Error']['Code']
-            if exception_type in ['OptimisticLockException']:
+            if is_optimistic_lock_error(ex):
                 log.info("[waflib:update_ip_set_by_id] OptimisticLockException detected. Get the latest ip set and retry updating ip set.")
-                ip_set = self.get_ip_set_by_id(log, scope, name, ip_set_id)
+                ip_set_snapshots.invalidate(scope, ip_set_id)
+                ip_set = self.fetch_ip_set(scope, name, ip_set_id, call)
                 lock_token = ip_set['LockToken']
 
-                response = client.update_ip_set(
+                response = call(
+                    'update_ip_set',
                     Scope=scope,
                     Name=name,
                     Id=ip_set_id,
@@ -148,6 +222,7 @@ class WAFLIBv2(object):
                     LockToken=lock_token,
                     Description=description
                 )
+                ip_set_snapshots.refresh(scope, ip_set_id, {'Addresses': addresses}, response['NextLockToken'])
                 log.debug("[waflib:update_ip_set_id] End")
                 return response
         except Exception as e:
@@ -156,47 +231,121 @@ class WAFLIBv2(object):
             return None
 
             
-    # Update addresses in an IPSet using ip set arn
-    @on_exception(expo, client.exceptions.WAFOptimisticLockException,
-            max_time=MAX_TIME,
-            jitter=full_jitter,
-            max_tries=API_CALL_NUM_RETRIES)
-    def update_ip_set(self, log, scope, name, ip_set_arn, addresses):
-        log.info("[waflib:update_ip_set] Start")
+    # CIDR in canonical form, to compare IP set contents
+    def normalize_address(self, address):
+        parsed = parse_ip(address)
+        return format_cidr(parsed) if parsed is not None else address
+
+    # Set of addresses, CIDRs in canonical form
+    def normalize_addresses(self, addresses):
+        return set(self.normalize_address(address) for address in addresses)
+
+    def count_update(self, name, outcome):
+        counters = self.update_counters.setdefault(name, {'applied': 0, 'skipped': 0})
+        counters[outcome] += 1
+
+    # GetIPSet through call, refreshing the snapshot cache
+    def fetch_ip_set(self, scope, name, ip_set_id, call):
+        response = call('get_ip_set', Scope=scope, Name=name, Id=ip_set_id)
+        ip_set_snapshots.refresh(scope, ip_set_id, response['IPSet'], response.get('LockToken'))
+        return response
+
+    # Replace the addresses of an IPSet using ip set arn (or add them to it and take removed out of it, merge),
+    # unless that changes nothing.
+    # Return (applied, response): applied is True if the IPSet was written; response is the IPSet after the update
+    # (read_back) or the update response when written, the current IPSet when not, None on failure.
+    # WAF API calls go through call (call_api by default).
+    def commit_ip_set(self, log, scope, name, ip_set_arn, addresses, read_back=False, call=None, merge=False,
+                      removed=()):
+        log.info("[waflib:commit_ip_set] Start")
         if (ip_set_arn is None or name is None):
             log.error("No IPSet found for: %s ", str(ip_set_arn))
-            return None
+            return False, None
 
         try:
-            # convert from arn to ip_set_id
-            ip_set_id = self.arn_to_id(ip_set_arn)
+            applied, response = self.write_ip_set(log, scope, name, self.arn_to_id(ip_set_arn), addresses,
+                                                  read_back, call or self.call_api, merge, removed)
+            log.info("[waflib:commit_ip_set] End")
+            return applied, response
+        except Exception as e:
+            log.error(e)
+            log.error("Failed to update IPSet: %s", str(ip_set_arn))
+            return False, None
 
-            # retrieve the ipset to get a locktoken
-            ip_set = self.get_ip_set(log, scope, name, ip_set_arn)
-            lock_token = ip_set['LockToken']
-            description = ip_set['IPSet']['Description']
-            log.info("Updating IPSet with description: %s, lock token: %s", str(description), str(lock_token))
+    # Write the IPSet with the lock token of its cached snapshot, without a GetIPSet first. A stale lock token
+    # fails with WAFOptimisticLockException: the snapshot is dropped and the write retried from a fresh one.
+    # The snapshot is also re-read before deciding there is nothing to write when it is older than
+    # ip_set_cache_ttl, as no write means no lock token check.
+    @on_exception(expo, ClientError,
+            max_time=MAX_TIME,
+            jitter=full_jitter,
+            max_tries=API_CALL_NUM_RETRIES,
+            giveup=lambda e: not is_optimistic_lock_error(e))
+    def write_ip_set(self, log, scope, name, ip_set_id, addresses, read_back, call, merge, removed=()):
+        ip_set = ip_set_snapshots.get(scope, ip_set_id)
+        fetched = ip_set is None
+        if fetched:
+            ip_set = self.fetch_ip_set(scope, name, ip_set_id, call)
+        new_addresses = self.ip_set_addresses(ip_set, addresses, merge, removed)
+        if new_addresses is None and not fetched and \
+                ip_set_snapshots.get(scope, ip_set_id, self.ip_set_cache_ttl) is None:
+            ip_set = self.fetch_ip_set(scope, name, ip_set_id, call)
+            new_addresses = self.ip_set_addresses(ip_set, addresses, merge, removed)
+        if new_addresses is None:
+            self.count_update(name, 'skipped')
+            log.info("[waflib:commit_ip_set] IPSet %s unchanged, %d addresses" % (
+                name, len(ip_set['IPSet']['Addresses'])))
+            return False, ip_set
+
+        lock_token = ip_set['LockToken']
+        description = ip_set['IPSet']['Description']
+        log.info("Updating IPSet with description: %s, lock token: %s", str(description), str(lock_token))
 
-            response = client.update_ip_set(
+        try:
+            response = call(
+                'update_ip_set',
                 Scope=scope,
                 Name=name,
                 Description=description,
                 Id=ip_set_id,
-                Addresses=addresses,
+                Addresses=new_addresses,
                 LockToken=lock_token
             )
+        except ClientError as e:
+            if is_optimistic_lock_error(e):
+                log.info("[waflib:commit_ip_set] IPSet %s changed since its snapshot, retrying" % name)
+                ip_set_snapshots.invalidate(scope, ip_set_id)
+            raise
+        ip_set_snapshots.refresh(scope, ip_set_id, {'Addresses': new_addresses}, response['NextLockToken'])
+        self.count_update(name, 'applied')
+        log.debug("[waflib:commit_ip_set] update ip set response:\n{}".format(response))
 
-            new_ip_set = self.get_ip_set(log, scope, name, ip_set_id)
+        if read_back:
+            response = ip_set_snapshots.get(scope, ip_set_id)
+        return True, response
 
-            log.debug("[waflib:update_ip_set] update ip set response:\n{}".format(response))
-            log.info("[waflib:update_ip_set] End")
-            return new_ip_set
-        except Exception as e:
-            log.error(e)
-            log.error("Failed to update IPSet: %s", str(ip_set_id))
+    # Addresses to write in ip_set for addresses (replacing its addresses, or merged with them minus removed),
+    # None if that changes nothing
+    def ip_set_addresses(self, ip_set, addresses, merge, removed=()):
+        current = self.normalize_addresses(ip_set['IPSet']['Addresses'])
+        wanted = self.normalize_addresses(addresses)
+        if not merge:
+            return None if wanted == current else list(addresses)
+        unwanted = self.normalize_addresses(removed) - wanted
+        if wanted <= current and not unwanted & current:
             return None
+        kept = [address for address in ip_set['IPSet']['Addresses']
+                if self.normalize_address(address) not in unwanted]
+        return kept + sorted(wanted - current)
+
+    # Update addresses in an IPSet using ip set arn, return the IPSet after the update
+    def update_ip_set(self, log, scope, name, ip_set_arn, addresses, read_back=True):
+        log.info("[waflib:update_ip_set] Start")
+        _, response = self.commit_ip_set(log, scope, name, ip_set_arn, addresses, read_back)
+        log.info("[waflib:update_ip_set] End")
+        return response
+
             
-    
     # Put Log Configuration for webacl
     @on_exception(expo, client.exceptions.WAFInternalErrorException, max_time=MAX_TIME)
     def put_logging_configuration(self, log, web_acl_arn, delivery_stream_arn):
@@ -255,6 +404,7 @@ class WAFLIBv2(object):
                     LockToken=lock_token,
                     Id=ip_set_id
                 )
+                ip_set_snapshots.invalidate(scope, self.arn_to_id(ip_set_id))
             return response
         except Exception as e:
             log.error("Failed to delete IPSet: %s", str(name))
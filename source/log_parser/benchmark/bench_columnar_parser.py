@@ -0,0 +1,56 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare the line by line parser with the pyarrow columnar engine
+(LOG_PARSER_ENGINE=pyarrow) on synthetic ALB and CloudFront logs, from the
+gzip file to the request counter, and check both count the same requests.
+
+    python -m benchmark.bench_columnar_parser --lines 500000
+"""
+
+import argparse
+import gzip
+import os
+import tempfile
+import time
+
+from benchmark.common import APP_LOG_CONFIG, make_lambda_log_parser
+from benchmark.generators import TrafficProfile, write_log
+
+
+def run(parser, file_path, log_type):
+    start = time.perf_counter()
+    with gzip.open(file_path, 'r') as content:
+        counter, _ = parser.read_log_lines(content, log_type, 0)
+    return time.perf_counter() - start, counter
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--lines', type=int, default=500000)
+    arg_parser.add_argument('--ips', type=int, default=5000)
+    arg_parser.add_argument('--log-types', default='alb,cloudfront')
+    args = arg_parser.parse_args()
+
+    config = dict(APP_LOG_CONFIG, uriList={'/login': {'errorThreshold': 10, 'blockPeriod': 240}})
+    print("%d lines, %d ips" % (args.lines, args.ips))
+    print("%-12s %-8s %10s %14s" % ('log type', 'engine', 'seconds', 'lines/s'))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for log_type in args.log_types.split(','):
+            file_path = os.path.join(tmp_dir, 'bench_%s.log.gz' % log_type)
+            write_log(file_path, log_type, args.lines, TrafficProfile(num_ips=args.ips))
+
+            counters = []
+            for engine in ['lines', 'pyarrow']:
+                parser = make_lambda_log_parser(config)
+                parser.log_parser_engine = engine
+                seconds, counter = run(parser, file_path, log_type)
+                counters.append(counter)
+                print("%-12s %-8s %10.2f %14.0f" % (log_type, engine, seconds, args.lines / seconds))
+            assert counters[0].general == counters[1].general
+            assert counters[0].uri_list == counters[1].uri_list
+
+
+if __name__ == '__main__':
+    main()
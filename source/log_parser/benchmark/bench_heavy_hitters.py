@@ -0,0 +1,82 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Accuracy and memory of the approximate HeavyHitterCounter against the exact
+RequestCounter during a flood with random source ips: a few attackers above
+the threshold hidden among many ips sending a handful of requests each.
+
+Recall is the share of the ips above the threshold that are reported; the
+approximate counter never reports an ip below it (its counts are lower bounds).
+Times are measured under tracemalloc, which slows both counters down.
+
+    python -m benchmark.bench_heavy_hitters --requests 1000000 --ips 500000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmark.common import random_ip
+
+
+def make_requests(num_requests, num_ips, num_attackers, threshold, seed=42):
+    rnd = random.Random(seed)
+    requests = []
+    for i in range(num_attackers):
+        # Spread around the threshold, so the ips close to it are the hard cases
+        requests += [random_ip(rnd)] * int(threshold * (0.5 + 2.0 * i / num_attackers))
+    ips = [random_ip(rnd) for _ in range(num_ips)]
+    requests += [rnd.choice(ips) for _ in range(num_requests - len(requests))]
+    rnd.shuffle(requests)
+    return requests
+
+
+def count(counter, requests):
+    tracemalloc.start()
+    start = time.perf_counter()
+    for ip in requests:
+        counter.add(0, ip, '/')
+    seconds = time.perf_counter() - start
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024.0 / 1024.0
+    tracemalloc.stop()
+    return seconds, memory_mb
+
+
+def main():
+    from heavy_hitters import HeavyHitterCounter
+    from request_counter import RequestCounter
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--requests', type=int, default=1000000, help='requests in the minute')
+    arg_parser.add_argument('--ips', type=int, default=500000, help='distinct background ips')
+    arg_parser.add_argument('--attackers', type=int, default=50)
+    arg_parser.add_argument('--threshold', type=int, default=2000)
+    arg_parser.add_argument('--capacities', default='1000,5000,20000,100000')
+    args = arg_parser.parse_args()
+
+    requests = make_requests(args.requests, args.ips, args.attackers, args.threshold)
+
+    exact = RequestCounter()
+    seconds, memory_mb = count(exact, requests)
+    expected = exact.get_general_max_counts(args.threshold)
+    print("%d requests, %d ips, %d ips above the threshold of %d" %
+          (len(requests), len(exact.general[0]), len(expected), args.threshold))
+    print("%-12s %10s %12s %8s %12s %12s" % ('capacity', 'seconds', 'memory MiB', 'recall', 'max error', 'mean error'))
+    print("%-12s %10.2f %12.1f %8.3f %12d %12.1f" % ('exact', seconds, memory_mb, 1.0, 0, 0.0))
+
+    for capacity in [int(value) for value in args.capacities.split(',')]:
+        counter = HeavyHitterCounter(capacity=capacity)
+        seconds, memory_mb = count(counter, requests)
+        reported = counter.get_general_max_counts(args.threshold)
+        assert all(num_reqs <= expected[ip_key] for ip_key, num_reqs in reported.items())
+        recall = len(reported) / float(len(expected)) if expected else 1.0
+        errors = [expected[ip_key] - num_reqs for ip_key, num_reqs in reported.items()]
+        mean_error = sum(errors) / float(len(errors)) if errors else 0.0
+        print("%-12d %10.2f %12.1f %8.3f %12d %12.1f" %
+              (capacity, seconds, memory_mb, recall, counter.get_max_error(), mean_error))
+
+
+if __name__ == '__main__':
+    main()
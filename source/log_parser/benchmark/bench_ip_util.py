@@ -0,0 +1,102 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare lib.ip_util with the ipaddress calls it replaces, over the same addresses:
+classifying and suffixing each address (which_ip_version + set_ip_cidr), and
+qualifying reputation list entries (process_url_list).
+
+    python -m benchmark.bench_ip_util --addresses 1000000
+"""
+
+import argparse
+import random
+import time
+from ipaddress import IPv4Network, IPv6Network, ip_address, ip_network
+
+from benchmark.common import random_ip
+
+
+def random_address(rng, ipv6_share):
+    if rng.random() < ipv6_share:
+        return '2001:db8:%x:%x::%x' % (rng.randrange(65536), rng.randrange(65536), rng.randrange(1, 65536))
+    return random_ip(rng)
+
+
+def legacy_build_ip_list(addresses):
+    addresses_v4 = []
+    addresses_v6 = []
+    for k in addresses:
+        # which_ip_version, then set_ip_cidr
+        ip_type = "IPV%s" % ip_address(k.strip()).version
+        source_ip = k.strip() + ("/32" if "IPV%s" % ip_address(k.strip()).version == "IPV4" else "/128")
+        if ip_type == "IPV4":
+            addresses_v4.append(source_ip)
+        else:
+            addresses_v6.append(source_ip)
+    return addresses_v4, addresses_v6
+
+
+def legacy_process_url_list(current_list):
+    process_list = []
+    for source_ip in current_list:
+        try:
+            if ip_address(source_ip).version == 4:
+                process_list.append(IPv4Network(source_ip).with_prefixlen)
+            else:
+                process_list.append(IPv6Network(source_ip).with_prefixlen)
+        except Exception:
+            try:
+                if ip_network(source_ip):
+                    process_list.append(source_ip)
+            except Exception:
+                pass
+    return process_list
+
+
+def process_url_list(current_list):
+    from lib.ip_util import format_cidr, is_network, parse_ips
+
+    return [source_ip if '/' in source_ip else format_cidr(parsed)
+            for source_ip, parsed in zip(current_list, parse_ips(current_list))
+            if parsed is not None and is_network(parsed)]
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    from lib.ip_util import parse_ip, split_ip_set_addresses
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--addresses', type=int, default=1000000)
+    arg_parser.add_argument('--distinct', type=int, default=0, help='distinct addresses (default: all distinct)')
+    arg_parser.add_argument('--ipv6-share', type=float, default=0.1)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(42)
+    distinct = [random_address(rng, args.ipv6_share) for _ in range(args.distinct or args.addresses)]
+    addresses = distinct if not args.distinct else [rng.choice(distinct) for _ in range(args.addresses)]
+    networks = ['%s/%d' % (ip.rsplit('.', 1)[0] + '.0', 24) if '.' in ip else ip for ip in addresses]
+
+    print("%d addresses, %d distinct" % (len(addresses), len(set(addresses))))
+    expected, legacy_seconds = timed(legacy_build_ip_list, addresses)
+    parse_ip.cache_clear()
+    result, seconds = timed(split_ip_set_addresses, addresses)
+    assert result == expected
+    print("%-26s ipaddress %7.3f s   ip_util %7.3f s (%.1fx)" % (
+        'build_ip_list_to_block', legacy_seconds, seconds, legacy_seconds / seconds))
+
+    expected, legacy_seconds = timed(legacy_process_url_list, networks)
+    parse_ip.cache_clear()
+    result, seconds = timed(process_url_list, networks)
+    assert result == expected
+    print("%-26s ipaddress %7.3f s   ip_util %7.3f s (%.1fx)" % (
+        'process_url_list', legacy_seconds, seconds, legacy_seconds / seconds))
+
+
+if __name__ == '__main__':
+    main()
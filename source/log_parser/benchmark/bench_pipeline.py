@@ -0,0 +1,196 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Run the log parser pipeline end to end on synthetic traffic (see
+benchmark.generators) and report the time, lines/s and peak RSS of each stage:
+
+    read_log_file (or parse_log_files with --files > 1)
+    get_outstanding_requesters
+    merge_outstanding_requesters   against a previous state file of --state-ips ips
+    build_ip_list_to_block         after merge_lists
+    update_ip_set                  against in-memory WAFv2 IP sets
+
+S3 and WAFv2 are local stand-ins, so it runs offline. Generated logs are kept in
+--data-dir and reused by later runs with the same parameters, which matters from
+10^7 lines on. Parser settings read from the environment by the Lambda
+(LOG_PARSER_ENGINE, HEAVY_HITTER_CAPACITY, ...) apply here too. Peak RSS is the
+process peak when each stage ends.
+
+    python -m benchmark.bench_pipeline --log-type alb --lines 1000000 --ips 100000
+    python -m benchmark.bench_pipeline --log-type waf --lines 10000000 --files 8 --data-dir /tmp/bench
+"""
+
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from benchmark.common import APP_LOG_CONFIG, WAF_LOG_CONFIG, LocalS3Client, make_lambda_log_parser, \
+    peak_rss_mb, use_local_wafv2_client
+from benchmark.generators import TrafficProfile, get_log_file, index_to_ip, parse_weights
+
+BUCKET_NAME = 'benchmark-bucket'
+OUTPUT_KEY_NAME = 'benchmark-output.json'
+FORMAT_DATE_TIME = "%Y-%m-%d %H:%M:%S %Z%z"
+
+os.environ.setdefault('MAX_AGE_TO_UPDATE', '30')
+os.environ.setdefault('LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION', '10000')
+os.environ.setdefault('SCOPE', 'REGIONAL')
+for name in ['IP_SET_NAME_HTTP_FLOODV4', 'IP_SET_NAME_HTTP_FLOODV6', 'IP_SET_ID_HTTP_FLOODV4',
+             'IP_SET_ID_HTTP_FLOODV6', 'IP_SET_NAME_SCANNERS_PROBESV4', 'IP_SET_NAME_SCANNERS_PROBESV6',
+             'IP_SET_ID_SCANNERS_PROBESV4', 'IP_SET_ID_SCANNERS_PROBESV6']:
+    os.environ.setdefault(name, 'arn:aws:wafv2:us-east-1:123456789012:regional/ipset/%s/%s' % (name, name))
+
+
+def get_config(log_type):
+    if log_type == 'waf':
+        return WAF_LOG_CONFIG
+    return dict(APP_LOG_CONFIG, uriList={'/login': {'errorThreshold': 20, 'blockPeriod': 100}})
+
+
+def make_previous_state(profile, config, log_type, state_ips):
+    """
+    Return a state file of state_ips ips above the thresholds: half of them still
+    blocked, half expired, plus the attackers of profile.
+    """
+    threshold = 'requestThreshold' if log_type == 'waf' else 'errorThreshold'
+    utc_now = datetime.datetime.now(datetime.timezone.utc)
+    block_period = config['general']['blockPeriod']
+    state = {'general': {}, 'uriList': {uri: {} for uri in config['uriList']}}
+
+    ips = profile.attacker_ips() + [index_to_ip(profile.num_ips + profile.attackers + i) for i in range(state_ips)]
+    for i, ip in enumerate(ips):
+        age = block_period // 2 if i % 2 == 0 else block_period * 2
+        entry = {
+            'max_counter_per_min': config['general'][threshold] + i % 100,
+            'updated_at': (utc_now - datetime.timedelta(minutes=age)).strftime(FORMAT_DATE_TIME)
+        }
+        state['general'][ip] = entry
+        for uri in state['uriList']:
+            if i % 10 == 0:
+                state['uriList'][uri][ip] = dict(entry)
+    return state
+
+
+class Pipeline(object):
+    def __init__(self, args):
+        self.args = args
+        self.profile = TrafficProfile(
+            num_ips=args.ips, attackers=args.attackers, attacker_share=args.attacker_share,
+            uri_skew=args.uri_skew, codes=parse_weights(args.codes), minutes=args.minutes)
+        self.config = get_config(args.log_type)
+        self.stages = []
+
+    def stage(self, name, function, *function_args):
+        start = time.perf_counter()
+        result = function(*function_args)
+        self.stages.append({'stage': name, 'seconds': time.perf_counter() - start, 'peak_rss_mb': peak_rss_mb()})
+        return result
+
+    def generate(self, data_dir):
+        args = self.args
+        start = time.perf_counter()
+        lines_per_file = [args.lines // args.files + (1 if i < args.lines % args.files else 0)
+                          for i in range(args.files)]
+        file_paths = [get_log_file(data_dir, args.log_type, num_lines, self.profile, args.seed + i)
+                      for i, num_lines in enumerate(lines_per_file)]
+        return file_paths, time.perf_counter() - start
+
+    def run(self, file_paths):
+        args = self.args
+        s3_client = LocalS3Client()
+        waf_client = use_local_wafv2_client()
+        parser = make_lambda_log_parser(self.config, s3_client)
+        parser.stream_log_files = args.stream
+        if args.engine:
+            parser.log_parser_engine = args.engine
+        if args.workers:
+            parser.log_parser_workers = args.workers
+        parser.compile_config()
+
+        key_names = []
+        for i, file_path in enumerate(file_paths):
+            key_names.append('AWSLogs/benchmark-%03d.log.gz' % i)
+            s3_client.add_file(BUCKET_NAME, key_names[-1], file_path)
+        previous_state = make_previous_state(self.profile, self.config, args.log_type, args.state_ips)
+        s3_client.add_object(BUCKET_NAME, OUTPUT_KEY_NAME, json.dumps(previous_state))
+
+        if len(file_paths) == 1 and not args.stream:
+            counter, outstanding_requesters = self.stage(
+                'read_log_file', parser.read_log_file, file_paths[0], args.log_type, 0)
+        else:
+            counter, _ = self.stage('parse_log_files', parser.parse_log_files, BUCKET_NAME, key_names, args.log_type)
+            outstanding_requesters = {'general': {}, 'uriList': {}}
+
+        outstanding_requesters = self.stage('get_outstanding_requesters', parser.get_outstanding_requesters,
+                                            args.log_type, counter, outstanding_requesters)
+        outstanding_requesters, need_update = self.stage(
+            'merge_outstanding_requesters', parser.merge_outstanding_requesters,
+            BUCKET_NAME, key_names[0], args.log_type, OUTPUT_KEY_NAME, outstanding_requesters)
+        addresses_v4, addresses_v6 = self.stage(
+            'build_ip_list_to_block',
+            lambda: parser.build_ip_list_to_block(parser.merge_lists(outstanding_requesters)))
+        self.stage('update_ip_set', parser.update_ip_set,
+                   parser.flood if args.log_type == 'waf' else parser.scanners, outstanding_requesters)
+
+        return {
+            'outstanding_requesters': len(outstanding_requesters['general']),
+            'need_update': need_update,
+            'addresses_v4': len(addresses_v4),
+            'addresses_v6': len(addresses_v6),
+            'waf_calls': waf_client.calls,
+            's3_calls': s3_client.calls
+        }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--log-type', default='alb', choices=['alb', 'cloudfront', 'waf'])
+    arg_parser.add_argument('--lines', type=int, default=100000)
+    arg_parser.add_argument('--files', type=int, default=1, help='split the lines over several log objects')
+    arg_parser.add_argument('--ips', type=int, default=5000, help='distinct legitimate client ips')
+    arg_parser.add_argument('--attackers', type=int, default=20)
+    arg_parser.add_argument('--attacker-share', type=float, default=0.1, help='share of requests from attackers')
+    arg_parser.add_argument('--uri-skew', type=float, default=1.1, help='Zipf exponent of uri popularity')
+    arg_parser.add_argument('--codes', default='200:85,301:5,403:3,404:5,500:2', help='status code mix')
+    arg_parser.add_argument('--minutes', type=int, default=5)
+    arg_parser.add_argument('--state-ips', type=int, default=1000, help='ips in the previous state file')
+    arg_parser.add_argument('--seed', type=int, default=42)
+    arg_parser.add_argument('--engine', choices=['lines', 'pyarrow'])
+    arg_parser.add_argument('--workers', type=int)
+    arg_parser.add_argument('--stream', action='store_true', help='stream log objects from S3')
+    arg_parser.add_argument('--data-dir', help='keep generated logs here (default: temporary directory)')
+    arg_parser.add_argument('--json', action='store_true', help='print the results as JSON')
+    args = arg_parser.parse_args()
+
+    pipeline = Pipeline(args)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        data_dir = args.data_dir or tmp_dir
+        os.makedirs(data_dir, exist_ok=True)
+        file_paths, generate_seconds = pipeline.generate(data_dir)
+        summary = pipeline.run(file_paths)
+
+    total_seconds = sum(stage['seconds'] for stage in pipeline.stages)
+    if args.json:
+        print(json.dumps({'args': vars(args), 'generate_seconds': generate_seconds, 'stages': pipeline.stages,
+                          'total_seconds': total_seconds, 'lines_per_second': args.lines / total_seconds,
+                          'summary': summary}))
+        return
+
+    print("%s log, %d lines in %d file(s), %d ips, %d attackers (%.1f%% of requests), generated in %.1f s" % (
+        args.log_type, args.lines, args.files, args.ips, args.attackers, args.attacker_share * 100,
+        generate_seconds))
+    print("%-30s %10s %14s %14s" % ('stage', 'seconds', 'lines/s', 'peak RSS MiB'))
+    for stage in pipeline.stages:
+        print("%-30s %10.3f %14.0f %14.1f" % (
+            stage['stage'], stage['seconds'], args.lines / max(stage['seconds'], 1e-9), stage['peak_rss_mb']))
+    print("%-30s %10.3f %14.0f" % ('total', total_seconds, args.lines / total_seconds))
+    print("outstanding requesters: %(outstanding_requesters)d, blocked ipv4: %(addresses_v4)d, "
+          "ipv6: %(addresses_v6)d, WAF calls: %(waf_calls)s" % summary)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare string keyed request counting ("<minute> <ip>" keys) with the integer
+keyed RequestCounter: counting time, threshold evaluation time and memory held
+by the counters.
+
+    python -m benchmark.bench_request_counter --lines 1000000 --ips 200000
+"""
+
+import argparse
+import random
+import time
+import tracemalloc
+
+from benchmark.common import random_ip
+
+MINUTE_STRINGS = ['2023-04-24T21:%02d' % m for m in range(60)]
+
+
+def legacy_count(requests, uri_list):
+    counter = {'general': {}, 'uriList': {}}
+    for minute, ip, uri in requests:
+        request_key = MINUTE_STRINGS[minute % 60] + ' ' + ip
+        counter['general'][request_key] = counter['general'][request_key] + 1 \
+            if request_key in counter['general'].keys() else 1
+        if uri in uri_list:
+            if uri not in counter['uriList'].keys():
+                counter['uriList'][uri] = {}
+            counter['uriList'][uri][request_key] = counter['uriList'][uri][request_key] + 1 \
+                if request_key in counter['uriList'][uri].keys() else 1
+    return counter
+
+
+def legacy_outstanding(counter, threshold):
+    outstanding = {}
+    for k, num_reqs in counter['general'].items():
+        k = k.split(' ')[-1]
+        if num_reqs >= threshold and num_reqs > outstanding.get(k, 0):
+            outstanding[k] = num_reqs
+    return outstanding
+
+
+def counter_count(requests, uri_list):
+    from request_counter import RequestCounter
+
+    counter = RequestCounter(uri_list)
+    for minute, ip, uri in requests:
+        counter.add(minute, ip, uri)
+    return counter
+
+
+def counter_outstanding(counter, threshold):
+    from request_counter import format_ip_key
+
+    return {format_ip_key(k): v for k, v in counter.get_general_max_counts(threshold).items()}
+
+
+def measure(count, outstanding, requests, uri_list, threshold):
+    tracemalloc.start()
+    start = time.perf_counter()
+    counter = count(requests, uri_list)
+    count_seconds = time.perf_counter() - start
+    memory_mb = tracemalloc.get_traced_memory()[0] / 1024.0 / 1024.0
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    result = outstanding(counter, threshold)
+    return count_seconds, time.perf_counter() - start, memory_mb, result
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--lines', type=int, default=1000000)
+    arg_parser.add_argument('--ips', type=int, default=200000)
+    arg_parser.add_argument('--minutes', type=int, default=5)
+    arg_parser.add_argument('--threshold', type=int, default=10)
+    args = arg_parser.parse_args()
+
+    rnd = random.Random(42)
+    ips = [random_ip(rnd) for _ in range(args.ips)]
+    uris = ['/', '/index.html', '/login', '/api/items']
+    requests = [((i * args.minutes) // args.lines, rnd.choice(ips), rnd.choice(uris)) for i in range(args.lines)]
+    uri_list = ['/login']
+
+    print("%d requests, %d ips, %d minutes" % (args.lines, args.ips, args.minutes))
+    print("%-16s %12s %14s %14s" % ('counter', 'count s', 'threshold s', 'memory MiB'))
+    results = []
+    for name, count, outstanding in [('string keys', legacy_count, legacy_outstanding),
+                                     ('RequestCounter', counter_count, counter_outstanding)]:
+        count_seconds, threshold_seconds, memory_mb, result = measure(
+            count, outstanding, requests, uri_list, args.threshold)
+        results.append(result)
+        print("%-16s %12.2f %14.3f %14.1f" % (name, count_seconds, threshold_seconds, memory_mb))
+    assert results[0] == results[1]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Measure reading, merging and writing back the outstanding requesters state file
+(merge_outstanding_requesters without S3), against the previous implementation
+that parsed every updated_at string with strptime and visited every remote entry.
+
+The state holds --state-ips ips in general and a tenth of them in each of two
+uriList entries, --expired-share of them past the block period. --changed ips of
+the state are also found by the current invocation.
+
+    python -m benchmark.bench_state_merge --state-ips 100000
+"""
+
+import argparse
+import datetime
+import json
+import time
+
+from benchmark.common import make_lambda_log_parser
+from benchmark.generators import index_to_ip
+
+FORMAT_DATE_TIME = "%Y-%m-%d %H:%M:%S %Z%z"
+CONFIG = {
+    'general': {'requestThreshold': 100, 'blockPeriod': 240},
+    'uriList': {'/login': {'requestThreshold': 20}, '/api/*': {'requestThreshold': 50}}
+}
+
+
+def make_state(state_ips, expired_share, utc_now):
+    """
+    Return the state (updated_at in epoch seconds, updated_at order) and the
+    outstanding requesters of the current invocation.
+    """
+    block_period = CONFIG['general']['blockPeriod']
+    expired = int(state_ips * expired_share)
+    state = {'general': {}, 'uriList': {uri: {} for uri in CONFIG['uriList']}}
+    for i in range(state_ips):
+        # The expired ips first, then one invocation every 5 minutes
+        age = block_period * 60 + (expired - i) * 3 if i < expired else (state_ips - i) * 300 // state_ips * 60
+        entry = {'max_counter_per_min': 100 + i % 100, 'updated_at': utc_now - age}
+        ip = index_to_ip(i)
+        state['general'][ip] = entry
+        if i % 10 == 0:
+            for uri in CONFIG['uriList']:
+                state['uriList'][uri][ip] = dict(entry)
+    return state
+
+
+def make_local(state_ips, changed, utc_now):
+    local = {'general': {}, 'uriList': {uri: {} for uri in CONFIG['uriList']}}
+    for i in range(0, state_ips, max(1, state_ips // changed))[:changed]:
+        entry = {'max_counter_per_min': 150, 'updated_at': utc_now}
+        local['general'][index_to_ip(i)] = entry
+        local['uriList']['/login'][index_to_ip(i)] = dict(entry)
+    return local
+
+
+def legacy_merge_group(remote, local, threshold, utc_now_timestamp, utc_now_timestamp_str):
+    for k, v in remote.items():
+        if k in local:
+            local[k]['updated_at'] = utc_now_timestamp_str
+            if v['max_counter_per_min'] > local[k]['max_counter_per_min']:
+                local[k]['max_counter_per_min'] = v['max_counter_per_min']
+            continue
+        utc_prev_updated_at = datetime.datetime.strptime(v['updated_at'], FORMAT_DATE_TIME).astimezone(
+            datetime.timezone.utc)
+        total_diff_min = ((utc_now_timestamp - utc_prev_updated_at).total_seconds()) / 60
+        if v['max_counter_per_min'] >= threshold and total_diff_min < CONFIG['general']['blockPeriod']:
+            local[k] = v
+    return local
+
+
+def legacy_merge(data, local):
+    """
+    Previous merge, every uriList entry merged (the previous code stopped after the
+    first ip of each).
+    """
+    utc_now_timestamp = datetime.datetime.now(datetime.timezone.utc)
+    utc_now_timestamp_str = utc_now_timestamp.strftime(FORMAT_DATE_TIME)
+    remote = json.loads(data)
+    legacy_merge_group(remote['general'], local['general'], CONFIG['general']['requestThreshold'],
+                       utc_now_timestamp, utc_now_timestamp_str)
+    for uri, requesters in remote['uriList'].items():
+        legacy_merge_group(requesters, local['uriList'].setdefault(uri, {}),
+                           CONFIG['uriList'][uri]['requestThreshold'], utc_now_timestamp, utc_now_timestamp_str)
+    return json.dumps(local).encode('utf8')
+
+
+def to_legacy_local(local):
+    utc_now_str = datetime.datetime.now(datetime.timezone.utc).strftime(FORMAT_DATE_TIME)
+    return {'general': {k: dict(v, updated_at=utc_now_str) for k, v in local['general'].items()},
+            'uriList': {uri: {k: dict(v, updated_at=utc_now_str) for k, v in requesters.items()}
+                        for uri, requesters in local['uriList'].items()}}
+
+
+def merge(parser, data, local, utc_now):
+    from requester_state import decode_state, encode_state
+
+    timings = {}
+    start = time.perf_counter()
+    remote = decode_state(data)
+    timings['decode'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    local, _ = parser.merge_general_outstanding_requesters('requestThreshold', remote, local, utc_now, False)
+    local, _ = parser.merge_urilist_outstanding_requesters('requestThreshold', remote, local, utc_now, False)
+    timings['merge'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    encode_state(local, parser.state_format)
+    timings['encode'] = time.perf_counter() - start
+    return timings, len(local['general'])
+
+
+def main():
+    from requester_state import encode_state
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--state-ips', type=int, default=100000)
+    arg_parser.add_argument('--expired-share', type=float, default=0.2)
+    arg_parser.add_argument('--changed', type=int, default=1000)
+    args = arg_parser.parse_args()
+
+    utc_now = int(time.time())
+    state = make_state(args.state_ips, args.expired_share, utc_now)
+    parser = make_lambda_log_parser(CONFIG)
+
+    print("%d ips in state, %.0f%% expired, %d changed" % (args.state_ips, args.expired_share * 100, args.changed))
+    print("%-22s %10s %10s %10s %10s %10s" % ('', 'KiB', 'decode s', 'merge s', 'encode s', 'total s'))
+
+    data = encode_state(state, 'json')
+    local = to_legacy_local(make_local(args.state_ips, args.changed, utc_now))
+    start = time.perf_counter()
+    legacy_merge(data, local)
+    print("%-22s %10d %10s %10s %10s %10.3f" % (
+        'legacy (json)', len(data) / 1024, '-', '-', '-', time.perf_counter() - start))
+
+    for state_format in ['json', 'compact']:
+        parser.state_format = state_format
+        data = encode_state(state, state_format)
+        timings, kept = merge(parser, data, make_local(args.state_ips, args.changed, utc_now), utc_now)
+        print("%-22s %10d %10.3f %10.3f %10.3f %10.3f" % (
+            'expiry index (%s)' % state_format, len(data) / 1024, timings['decode'], timings['merge'],
+            timings['encode'], sum(timings.values())))
+    print("kept in general: %d" % kept)
+
+
+if __name__ == '__main__':
+    main()
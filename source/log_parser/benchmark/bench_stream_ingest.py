@@ -0,0 +1,88 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Compare download-then-parse against streaming ingestion of a log object.
+
+Each mode runs in its own process so that peak RSS is measured independently.
+--workers sets the number of parser processes (LOG_PARSER_WORKERS); RSS is then
+the parent's only.
+
+    python -m benchmark.bench_stream_ingest --log-type alb --lines 1000000 --workers 4
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmark.common import APP_LOG_CONFIG, WAF_LOG_CONFIG, LOG_PARSER_DIR, LocalS3Client, \
+    make_lambda_log_parser, peak_rss_mb
+from benchmark.generators import write_log
+
+BUCKET_NAME = 'benchmark-bucket'
+KEY_NAME = 'AWSLogs/benchmark.log.gz'
+MODES = ['download', 'stream', 'stream-ranged']
+
+
+def run_mode(mode, log_type, file_path, concurrency, part_size_mb, workers):
+    s3_client = LocalS3Client()
+    s3_client.add_file(BUCKET_NAME, KEY_NAME, file_path)
+    parser = make_lambda_log_parser(WAF_LOG_CONFIG if log_type == 'waf' else APP_LOG_CONFIG, s3_client)
+    parser.stream_log_files = mode != 'download'
+    parser.range_get_concurrency = concurrency if mode == 'stream-ranged' else 1
+    parser.log_parser_workers = workers
+    parser.range_part_size = part_size_mb * 1024 * 1024
+
+    start = time.perf_counter()
+    counter, _ = parser.parse_log_file(BUCKET_NAME, KEY_NAME, log_type)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'seconds': elapsed,
+        'peak_rss_mb': peak_rss_mb(),
+        'requesters': len(set().union(*counter.general.values())),
+        's3_calls': s3_client.calls
+    }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--log-type', default='alb', choices=['alb', 'cloudfront', 'waf'])
+    arg_parser.add_argument('--lines', type=int, default=500000)
+    arg_parser.add_argument('--concurrency', type=int, default=4)
+    arg_parser.add_argument('--part-size-mb', type=int, default=1)
+    arg_parser.add_argument('--workers', type=int, default=1)
+    arg_parser.add_argument('--mode', choices=MODES, help=argparse.SUPPRESS)
+    arg_parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+
+    if args.mode:
+        result = run_mode(args.mode, args.log_type, args.file, args.concurrency, args.part_size_mb, args.workers)
+        print(json.dumps(result))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'benchmark.log.gz')
+        write_log(file_path, args.log_type, args.lines)
+        print("%s log, %d lines, %.1f MiB compressed" % (
+            args.log_type, args.lines, os.path.getsize(file_path) / 1024.0 / 1024.0))
+        print("%-14s %10s %14s %14s %10s" % ('mode', 'seconds', 'lines/s', 'peak RSS MiB', 'S3 calls'))
+        for mode in MODES:
+            output = subprocess.run(
+                [sys.executable, '-m', 'benchmark.bench_stream_ingest', '--mode', mode, '--file', file_path,
+                 '--log-type', args.log_type, '--concurrency', str(args.concurrency),
+                 '--part-size-mb', str(args.part_size_mb), '--workers', str(args.workers)],
+                cwd=LOG_PARSER_DIR, check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print("%-14s %10.2f %14.0f %14.1f %10d" % (
+                mode, result['seconds'], args.lines / result['seconds'], result['peak_rss_mb'],
+                sum(result['s3_calls'].values())))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Measure merging general and uriList and truncating the result to the WAF ip range
+limit (update_ip_set before build_ip_list_to_block), against the previous
+merge_lists + full sort (with its undefined counter fixed).
+
+    python -m benchmark.bench_truncate --candidates 1000000 --limit 10000
+"""
+
+import argparse
+import os
+import random
+import time
+
+from benchmark.common import APP_LOG_CONFIG, make_lambda_log_parser, peak_rss_mb
+from benchmark.generators import index_to_ip
+
+
+def make_outstanding_requesters(candidates, urilist_share, seed):
+    rng = random.Random(seed)
+    outstanding_requesters = {'general': {}, 'uriList': {'/login': {}, '/api/*': {}}}
+    for i in range(candidates):
+        entry = {'max_counter_per_min': int(rng.paretovariate(1.2) * 100), 'updated_at': 1682370000 + i % 3600}
+        ip = index_to_ip(i)
+        if rng.random() < urilist_share:
+            outstanding_requesters['uriList']['/login' if i % 2 else '/api/*'][ip] = entry
+        else:
+            outstanding_requesters['general'][ip] = entry
+    return outstanding_requesters
+
+
+def legacy_merge_and_truncate(outstanding_requesters, ip_range_limit):
+    unified_outstanding_requesters = dict(outstanding_requesters['general'])
+    for uri in outstanding_requesters['uriList'].keys():
+        for k in outstanding_requesters['uriList'][uri].keys():
+            if (k not in unified_outstanding_requesters.keys() or
+                    outstanding_requesters['uriList'][uri][k]['max_counter_per_min'] >
+                    unified_outstanding_requesters[k]['max_counter_per_min']):
+                unified_outstanding_requesters[k] = outstanding_requesters['uriList'][uri][k]
+
+    if len(unified_outstanding_requesters) > ip_range_limit:
+        ordered_unified_outstanding_requesters = sorted(
+            unified_outstanding_requesters.items(), key=lambda kv: kv[1]['max_counter_per_min'], reverse=True)
+        unified_outstanding_requesters = dict(ordered_unified_outstanding_requesters[:ip_range_limit])
+    return unified_outstanding_requesters
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--candidates', type=int, default=1000000)
+    arg_parser.add_argument('--limit', type=int, default=10000)
+    arg_parser.add_argument('--urilist-share', type=float, default=0.1)
+    arg_parser.add_argument('--seed', type=int, default=42)
+    args = arg_parser.parse_args()
+    os.environ['LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION'] = str(args.limit)
+
+    outstanding_requesters = make_outstanding_requesters(args.candidates, args.urilist_share, args.seed)
+    parser = make_lambda_log_parser(APP_LOG_CONFIG)
+    print("%d candidates, limit %d, peak RSS %.1f MiB after setup" % (args.candidates, args.limit, peak_rss_mb()))
+
+    start = time.perf_counter()
+    legacy = legacy_merge_and_truncate(outstanding_requesters, args.limit)
+    print("%-30s %8.3f s" % ('legacy merge_lists + sort', time.perf_counter() - start))
+
+    start = time.perf_counter()
+    selected = parser.truncate_list(parser.iter_unified_requesters(outstanding_requesters))
+    print("%-30s %8.3f s" % ('streaming top-k', time.perf_counter() - start))
+
+    # Same counts kept, the ips may differ on ties
+    assert sorted(v['max_counter_per_min'] for v in selected.values()) == \
+        sorted(v['max_counter_per_min'] for v in legacy.values())
+
+
+if __name__ == '__main__':
+    main()
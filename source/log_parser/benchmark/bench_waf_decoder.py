@@ -0,0 +1,72 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Measure WAF log line decoding throughput (lines/s) for each decoder, both for
+the projection alone and for the full read_waf_log_file step, against the
+previous full json.loads + urlparse implementation.
+
+    python -m benchmark.bench_waf_decoder --lines 200000
+"""
+
+import argparse
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from benchmark.common import WAF_LOG_CONFIG, make_lambda_log_parser, null_logger
+from benchmark.generators import write_log
+
+
+def legacy_read_waf_log_file(line):
+    line_data = json.loads(str(line.decode()))
+    request_key = datetime.datetime.fromtimestamp(int(line_data['timestamp']) / 1000.0).isoformat(
+        sep='T', timespec='minutes')
+    request_key += ' ' + line_data['httpRequest']['clientIp']
+    return request_key, urlparse(line_data['httpRequest']['uri']).path, line_data
+
+
+def time_lines(function, lines):
+    start = time.perf_counter()
+    for line in lines:
+        function(line)
+    return time.perf_counter() - start
+
+
+def main():
+    from waf_log_decoder import WAF_LOG_DECODERS, get_waf_log_decoder
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--lines', type=int, default=200000)
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'waf.log.gz')
+        write_log(file_path, 'waf', args.lines)
+        with gzip.open(file_path, 'r') as content:
+            lines = list(content)
+
+    parser = make_lambda_log_parser(WAF_LOG_CONFIG)
+    results = [('legacy read_waf_log_file', time_lines(legacy_read_waf_log_file, lines))]
+    for name in WAF_LOG_DECODERS:
+        decoder = get_waf_log_decoder(null_logger(), name)
+        if decoder.name != name:
+            print("%s decoder unavailable, skipped" % name)
+            continue
+        parser.waf_log_decoder = decoder
+        results.append(('%s decode' % name, time_lines(decoder.decode, lines)))
+        results.append(('%s read_waf_log_file' % name, time_lines(parser.read_waf_log_file, lines)))
+
+    baseline = results[0][1]
+    print("%d WAF log lines" % len(lines))
+    print("%-30s %10s %14s %8s" % ('step', 'seconds', 'lines/s', 'speedup'))
+    for name, elapsed in results:
+        print("%-30s %10.3f %14.0f %7.1fx" % (name, elapsed, len(lines) / elapsed, baseline / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Throughput of the window stores when the traffic of a minute is split across
+several log files: every file adds its partial counts and gets the per-minute
+totals back. Reports ip counters per second, the API calls made and checks
+that every backend returns the same totals (the sum over all the files).
+
+    python -m benchmark.bench_window_store --ips 100000 --files 4
+"""
+
+import argparse
+import random
+import time
+
+from benchmark.common import LocalDynamoDBTable, LocalS3Client, null_logger, random_ip
+
+BUCKET_NAME = 'bench_bucket'
+MINUTE = 28039500
+
+
+def make_counters(num_ips, num_files, requests_per_file, seed=42):
+    """
+    One RequestCounter per file, each with requests_per_file requests spread over
+    all the ips, so every file sees a share of each ip.
+    """
+    from request_counter import RequestCounter
+
+    rnd = random.Random(seed)
+    ips = set()
+    while len(ips) < num_ips:
+        ips.add(random_ip(rnd))
+    ips = list(ips)
+
+    counters = []
+    for _ in range(num_files):
+        counter = RequestCounter(['/login'])
+        for ip in ips:
+            counter.add(MINUTE, ip, '/')
+        for _ in range(requests_per_file - num_ips):
+            counter.add(MINUTE, rnd.choice(ips), rnd.choice(['/', '/login']))
+        counters.append(counter)
+    return counters
+
+
+def run(store, counters):
+    from window_store import aggregate_counter
+
+    start = time.perf_counter()
+    for i, counter in enumerate(counters):
+        totals = aggregate_counter(store, 'bench-namespace', ['AWSLogs/bench-%d.gz' % i], counter)
+    return time.perf_counter() - start, totals
+
+
+def main():
+    from lib.s3_util import S3
+    from window_store import MEMORY_WINDOWS, S3_PARTS_CACHE, DynamoDBWindowStore, MemoryWindowStore, \
+        S3WindowStore
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument('--ips', type=int, default=100000, help='distinct ips in the minute')
+    arg_parser.add_argument('--files', type=int, default=4, help='log files sharing the minute')
+    arg_parser.add_argument('--requests', type=int, default=150000, help='requests per file')
+    args = arg_parser.parse_args()
+
+    counters = make_counters(args.ips, args.files, max(args.requests, args.ips))
+    ip_counters = sum(len(counter.general[MINUTE]) + len(counter.uri_list[0].get(MINUTE, {}))
+                      for counter in counters)
+
+    s3_util = S3(null_logger())
+    s3_util.s3_client = LocalS3Client()
+    table = LocalDynamoDBTable()
+    stores = [('memory', MemoryWindowStore(), None),
+              ('s3', S3WindowStore(s3_util, BUCKET_NAME), s3_util.s3_client),
+              ('dynamodb', DynamoDBWindowStore(table), table)]
+
+    print("%d ips per minute, %d files, %d ip counters added" % (args.ips, args.files, ip_counters))
+    print("%-10s %10s %16s  %s" % ('store', 'seconds', 'counters/s', 'api calls'))
+    results = []
+    for name, store, client in stores:
+        MEMORY_WINDOWS.clear()
+        S3_PARTS_CACHE.clear()
+        seconds, totals = run(store, counters)
+        results.append((totals.general, totals.uri_list))
+        calls = ', '.join('%s=%d' % item for item in sorted(client.calls.items())) if client else '-'
+        print("%-10s %10.2f %16.0f  %s" % (name, seconds, ip_counters / seconds, calls))
+
+    assert all(result == results[0] for result in results)
+
+
+if __name__ == '__main__':
+    main()
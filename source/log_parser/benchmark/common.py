@@ -0,0 +1,268 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Shared helpers for the log parser benchmarks.
+
+Benchmarks run offline: S3 is replaced by a client that serves objects from
+local files (and keeps the objects put in memory), DynamoDB by an in-memory
+table and WAFv2 by in-memory IP sets, so the numbers only reflect the parser
+itself. Synthetic logs come from benchmark.generators.
+Run them from source/log_parser, e.g. python -m benchmark.bench_stream_ingest
+"""
+
+import datetime
+import io
+import logging
+import os
+import resource
+import shutil
+import sys
+import threading
+
+from botocore.exceptions import ClientError
+
+LOG_PARSER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_DIR = os.path.dirname(LOG_PARSER_DIR)
+for path in (SOURCE_DIR, LOG_PARSER_DIR):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+APP_LOG_CONFIG = {
+    'general': {
+        'errorThreshold': 50,
+        'blockPeriod': 240,
+        'errorCodes': ['400', '401', '403', '404', '405']
+    },
+    'uriList': {}
+}
+
+WAF_LOG_CONFIG = {
+    'general': {
+        'requestThreshold': 100,
+        'blockPeriod': 240,
+        'ignoredSufixes': ['.css', '.js', '.jpeg']
+    },
+    'uriList': {
+        '/login': {
+            'requestThreshold': 20,
+            'blockPeriod': 100
+        }
+    }
+}
+
+
+class LocalStreamingBody(object):
+    def __init__(self, file_path, start, end):
+        self.file = open(file_path, 'rb')
+        self.file.seek(start)
+        self.remaining = end - start + 1
+
+    def read(self, size=None):
+        size = self.remaining if size is None else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def iter_chunks(self, chunk_size=1024):
+        while True:
+            data = self.read(chunk_size)
+            if not data:
+                break
+            yield data
+
+    def close(self):
+        self.file.close()
+
+
+class LocalS3Client(object):
+    """
+    Minimal stand-in for the boto3 S3 client backed by local files.
+    """
+
+    def __init__(self):
+        self.objects = {}
+        self.last_modified = {}
+        self.calls = {}
+
+    def _count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def add_file(self, bucket_name, key_name, file_path):
+        self.objects[(bucket_name, key_name)] = file_path
+        self.last_modified[(bucket_name, key_name)] = datetime.datetime.now(datetime.timezone.utc)
+
+    def add_object(self, bucket_name, key_name, body, last_modified=None):
+        self.objects[(bucket_name, key_name)] = body.encode() if isinstance(body, str) else body
+        self.last_modified[(bucket_name, key_name)] = last_modified or datetime.datetime.now(datetime.timezone.utc)
+
+    def get_object(self, Bucket, Key, Range=None):
+        self._count('get_object')
+        file_path = self.objects[(Bucket, Key)]
+        if isinstance(file_path, bytes):
+            return {'ContentLength': len(file_path), 'Body': io.BytesIO(file_path)}
+        size = os.path.getsize(file_path)
+        start, end = 0, size - 1
+        response = {}
+        if Range is not None:
+            start, end = [int(v) for v in Range.split('=')[1].split('-')]
+            end = min(end, size - 1)
+            response['ContentRange'] = 'bytes %d-%d/%d' % (start, end, size)
+        response['ContentLength'] = end - start + 1
+        response['Body'] = LocalStreamingBody(file_path, start, end)
+        return response
+
+    def download_file(self, bucket_name, key_name, local_file_path):
+        self._count('download_file')
+        source = self.objects[(bucket_name, key_name)]
+        if isinstance(source, bytes):
+            with open(local_file_path, 'wb') as out:
+                out.write(source)
+        else:
+            shutil.copyfile(source, local_file_path)
+
+    def head_object(self, Bucket, Key):
+        self._count('head_object')
+        if (Bucket, Key) not in self.objects:
+            raise KeyError('%s/%s not found' % (Bucket, Key))
+        source = self.objects[(Bucket, Key)]
+        return {
+            'ContentLength': len(source) if isinstance(source, bytes) else os.path.getsize(source),
+            'LastModified': self.last_modified[(Bucket, Key)]
+        }
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self._count('put_object')
+        self.add_object(Bucket, Key, Body)
+        return {}
+
+    def upload_file(self, file_path, bucket_name, key_name, ExtraArgs=None):
+        self._count('upload_file')
+        with open(file_path, 'rb') as content:
+            self.add_object(bucket_name, key_name, content.read())
+
+    def get_paginator(self, operation):
+        return LocalListObjectsPaginator(self)
+
+
+class LocalListObjectsPaginator(object):
+    def __init__(self, s3_client, page_size=1000):
+        self.s3_client = s3_client
+        self.page_size = page_size
+
+    def paginate(self, Bucket, Prefix=''):
+        keys = sorted(key for bucket, key in self.s3_client.objects if bucket == Bucket and key.startswith(Prefix))
+        for i in range(0, max(len(keys), 1), self.page_size):
+            self.s3_client._count('list_objects_v2')
+            yield {'Contents': [{'Key': key} for key in keys[i:i + self.page_size]]}
+
+
+class LocalDynamoDBTable(object):
+    """
+    Minimal stand-in for a boto3 DynamoDB Table resource. Only supports the
+    'SET #n = :v ADD #n :v, ...' update expressions, guarded by
+    'NOT contains(#n, :v)', and the get_item reads used by the window store.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.calls = {}
+        self.lock = threading.Lock()
+
+    def update_item(self, Key, UpdateExpression, ExpressionAttributeNames, ExpressionAttributeValues,
+                    ReturnValues='NONE', ConditionExpression=None):
+        set_part, add_part = UpdateExpression.split(' ADD ')
+        updated = {}
+        with self.lock:
+            self.calls['update_item'] = self.calls.get('update_item', 0) + 1
+            item = self.items.setdefault(Key['pk'], dict(Key))
+            if ConditionExpression is not None:
+                name, value = ConditionExpression[len('NOT contains('):-1].split(', ')
+                if ExpressionAttributeValues[value] in item.get(ExpressionAttributeNames[name], ()):
+                    raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                                 'Message': 'The conditional request failed'}}, 'UpdateItem')
+            for action, parts in (('SET', set_part[len('SET '):]), ('ADD', add_part)):
+                for part in parts.split(', '):
+                    name, value = [token.strip() for token in part.replace('=', ' ').split()]
+                    name = ExpressionAttributeNames[name]
+                    value = ExpressionAttributeValues[value]
+                    if action == 'SET':
+                        item[name] = value
+                    elif isinstance(value, set):
+                        item[name] = item.get(name, set()) | value
+                    else:
+                        item[name] = item.get(name, 0) + value
+                    updated[name] = item[name]
+        return {'Attributes': updated} if ReturnValues == 'UPDATED_NEW' else {}
+
+    def get_item(self, Key, ProjectionExpression, ExpressionAttributeNames, ConsistentRead=False):
+        with self.lock:
+            self.calls['get_item'] = self.calls.get('get_item', 0) + 1
+            item = self.items.get(Key['pk'])
+            if item is None:
+                return {}
+            names = [ExpressionAttributeNames[name] for name in ProjectionExpression.split(', ')]
+            return {'Item': {name: item[name] for name in names if name in item}}
+
+
+class LocalWAFv2Client(object):
+    """
+    Minimal stand-in for the boto3 WAFv2 client: IP sets kept in memory, with a
+    new lock token on each update.
+    """
+
+    def __init__(self):
+        self.ip_sets = {}
+        self.calls = {}
+
+    def _count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+
+    def get_ip_set(self, Scope, Name, Id):
+        self._count('get_ip_set')
+        ip_set = self.ip_sets.setdefault(Id, {'Name': Name, 'Id': Id, 'Description': Name, 'Addresses': []})
+        return {'IPSet': dict(ip_set), 'LockToken': 'token-%d' % self.calls.get('update_ip_set', 0)}
+
+    def update_ip_set(self, Scope, Name, Id, Addresses, LockToken, Description=None):
+        self._count('update_ip_set')
+        self.ip_sets[Id] = {'Name': Name, 'Id': Id, 'Description': Description, 'Addresses': list(Addresses)}
+        return {'NextLockToken': 'token-%d' % self.calls['update_ip_set']}
+
+
+def use_local_wafv2_client():
+    """
+    Point lib.waflibv2 at a LocalWAFv2Client and return it.
+    """
+    import lib.waflibv2
+
+    lib.waflibv2.client = LocalWAFv2Client()
+    return lib.waflibv2.client
+
+
+def null_logger():
+    log = logging.getLogger('log_parser_benchmark')
+    log.setLevel(logging.CRITICAL)
+    return log
+
+
+def make_lambda_log_parser(config, s3_client=None):
+    from lambda_log_parser import LambdaLogParser
+
+    parser = LambdaLogParser(null_logger())
+    parser.config = config
+    if s3_client is not None:
+        parser.s3_util.s3_client = s3_client
+    return parser
+
+
+def peak_rss_mb():
+    # ru_maxrss is reported in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def random_ip(rnd):
+    return '%d.%d.%d.%d' % (rnd.randint(1, 223), rnd.randint(0, 255), rnd.randint(0, 255), rnd.randint(1, 254))
@@ -0,0 +1,197 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+"""
+Seeded synthetic traffic for the log parser benchmarks: WAF (JSON lines), ALB
+and CloudFront access logs, streamed to gzip files so 10^8 lines fit on disk
+without being held in memory.
+
+A TrafficProfile describes the traffic: how many distinct client ips, the share
+of requests sent by a small set of attackers (who probe a few uris and mostly
+get error codes), how skewed the uri distribution is (Zipf) and the status code
+mix. The same profile, seed and number of lines always produce the same file.
+"""
+
+import datetime
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import random
+
+BATCH_SIZE = 10000                  # lines drawn and written at a time
+START_TIMESTAMP = 1682370000        # 2023-04-24 21:00:00 UTC
+
+# Bijective spreading of ip indexes over the address space
+IP_MULTIPLIER = 2654435761
+IP_MASK = 0xFFFFFF
+
+
+def parse_weights(text):
+    """
+    Parse a weight mix such as '200:85,404:10,403:5' into {'200': 85.0, ...}.
+    """
+    weights = {}
+    for part in text.split(','):
+        value, weight = part.split(':')
+        weights[value.strip()] = float(weight)
+    return weights
+
+
+class TrafficProfile(object):
+    """
+    num_ips:        distinct legitimate client ips, requests spread uniformly over them
+    attackers:      distinct attacker ips
+    attacker_share: fraction of all requests sent by the attackers
+    uris:           paths requested by legitimate clients, most popular first
+    uri_skew:       Zipf exponent of the uri popularity (0 for uniform)
+    codes:          {status code: weight} of legitimate requests
+    attack_uris:    paths probed by the attackers, picked uniformly
+    attack_codes:   {status code: weight} of attacker requests
+    minutes:        minutes covered by a log file
+    """
+
+    def __init__(self, num_ips=5000, attackers=20, attacker_share=0.1,
+                 uris=('/', '/index.html', '/api/items', '/static/app.js', '/static/site.css', '/login',
+                       '/api/cart', '/images/logo.jpeg', '/search', '/account'),
+                 uri_skew=1.1, codes=None, attack_uris=('/login', '/wp-login.php', '/admin', '/.env'),
+                 attack_codes=None, minutes=5):
+        self.num_ips = num_ips
+        self.attackers = attackers
+        self.attacker_share = attacker_share if attackers > 0 else 0.0
+        self.uris = list(uris)
+        self.uri_skew = uri_skew
+        self.codes = codes or {'200': 85, '301': 5, '403': 3, '404': 5, '500': 2}
+        self.attack_uris = list(attack_uris)
+        self.attack_codes = attack_codes or {'403': 40, '404': 50, '200': 10}
+        self.minutes = minutes
+
+    def to_dict(self):
+        return dict(self.__dict__)
+
+    def digest(self):
+        return hashlib.sha1(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()[:10]
+
+    def uri_weights(self):
+        return [1.0 / (rank ** self.uri_skew) for rank in range(1, len(self.uris) + 1)]
+
+    def attacker_ips(self):
+        # Indexes after the legitimate ones, so attackers never share an ip with them
+        return [index_to_ip(self.num_ips + i) for i in range(self.attackers)]
+
+
+def index_to_ip(index):
+    """
+    Return a distinct public looking IPv4 address for each index below 223 * 2^24.
+    """
+    low = (index * IP_MULTIPLIER) & IP_MASK
+    return '%d.%d.%d.%d' % (1 + (index >> 24) % 223, low >> 16, (low >> 8) & 0xFF, low & 0xFF)
+
+
+def format_alb(timestamp, ip, uri, code, i):
+    minute = '%s:%02d' % (timestamp[:16], i % 60)
+    return ('http %s.047920Z app/bench/0123456789abcdef %s:50337 10.0.0.1:80 0.001 0.113 0.000 %s %s 152 13911 '
+            '"GET http://bench.example.com:80%s HTTP/1.1" "Mozilla/5.0" - - '
+            'arn:aws:elasticloadbalancing:us-east-1:123456789012:targetgroup/bench/0 '
+            '"Root=1-00000000-000000000000000000000000" "-" "-" 0 %s.933000Z "forward" "-" "-"\n'
+            % (minute, ip, code, code, uri, minute))
+
+
+def format_cloudfront(timestamp, ip, uri, code, i):
+    return ('%s\t%s:%02d\tFRA6\t919468\t%s\tGET\tbench.example.com\t%s\t%s\t-\tMozilla/5.0\t-\t-\tMiss\t'
+            'IQU6LXAGK43V5RF9B3VUMLBQWG3NDXFTOOZU6YMHDF309D82CUEV35==\tbench.example.com\thttps\t394330\t0.002\n'
+            % (timestamp[:10], timestamp[11:16], i % 60, ip, uri, code))
+
+
+def format_waf(timestamp, ip, uri, code, i):
+    return ('{"timestamp":%d,"formatVersion":1,"webaclId":"arn:aws:wafv2:us-east-1:123456789012:global/webacl/Bench/0",'
+            '"terminatingRuleId":"Default_Action","terminatingRuleType":"REGULAR","action":"ALLOW",'
+            '"terminatingRuleMatchDetails":[],"httpSourceName":"CF","httpSourceId":"X","ruleGroupList":[],'
+            '"rateBasedRuleList":[],"nonTerminatingMatchingRules":[],"requestHeadersInserted":null,'
+            '"responseCodeSent":null,"httpRequest":{"clientIp":"%s","country":"US","headers":'
+            '[{"name":"Host","value":"bench.example.com"},{"name":"User-Agent","value":"Mozilla/5.0"}],'
+            '"uri":"%s","args":"","httpVersion":"HTTP/1.1","httpMethod":"GET","requestId":"%d"}}\n'
+            % (timestamp, ip, uri, i))
+
+
+LINE_FORMATTERS = {
+    'alb': format_alb,
+    'cloudfront': format_cloudfront,
+    'waf': format_waf
+}
+
+
+def minute_timestamps(log_type, minutes):
+    # Per minute value handed to the formatters: epoch milliseconds for WAF, ISO 8601 otherwise
+    timestamps = []
+    for minute in range(minutes):
+        epoch = START_TIMESTAMP + minute * 60
+        if log_type == 'waf':
+            timestamps.append(epoch * 1000)
+        else:
+            timestamps.append(datetime.datetime.fromtimestamp(epoch, datetime.timezone.utc).strftime(
+                '%Y-%m-%dT%H:%M:%S'))
+    return timestamps
+
+
+def generate_lines(log_type, num_lines, profile=None, seed=42):
+    """
+    Yield num_lines log lines (strings) of log_type for profile, in lists of
+    BATCH_SIZE lines.
+    """
+    profile = profile or TrafficProfile()
+    rnd = random.Random(seed)
+    format_line = LINE_FORMATTERS[log_type]
+    timestamps = minute_timestamps(log_type, profile.minutes)
+    attacker_ips = profile.attacker_ips()
+    uri_cum_weights = list(itertools.accumulate(profile.uri_weights()))
+    codes, code_cum_weights = list(profile.codes), list(itertools.accumulate(profile.codes.values()))
+    attack_codes = list(profile.attack_codes)
+    attack_code_cum_weights = list(itertools.accumulate(profile.attack_codes.values()))
+
+    for batch_start in range(0, num_lines, BATCH_SIZE):
+        size = min(BATCH_SIZE, num_lines - batch_start)
+        num_attacks = sum(1 for r in (rnd.random() for _ in range(size)) if r < profile.attacker_share)
+        uris = rnd.choices(profile.uris, cum_weights=uri_cum_weights, k=size - num_attacks) + \
+            [rnd.choice(profile.attack_uris) for _ in range(num_attacks)]
+        codes_batch = rnd.choices(codes, cum_weights=code_cum_weights, k=size - num_attacks) + \
+            rnd.choices(attack_codes, cum_weights=attack_code_cum_weights, k=num_attacks)
+        ips = [index_to_ip(rnd.randrange(profile.num_ips)) for _ in range(size - num_attacks)] + \
+            [rnd.choice(attacker_ips) for _ in range(num_attacks)]
+        # Interleave attackers with the legitimate traffic
+        order = list(range(size))
+        rnd.shuffle(order)
+
+        lines = []
+        for offset, j in enumerate(order):
+            i = batch_start + offset
+            timestamp = timestamps[(i * profile.minutes) // num_lines]
+            lines.append(format_line(timestamp, ips[j], uris[j], codes_batch[j], i))
+        yield lines
+
+
+def write_log(file_path, log_type, num_lines, profile=None, seed=42, compresslevel=1):
+    """
+    Write a gzip log file of num_lines synthetic log_type lines.
+    """
+    with gzip.open(file_path, 'wt', compresslevel=compresslevel) as out:
+        if log_type == 'cloudfront':
+            out.write('#Version: 1.0\n#Fields: date time x-edge-location ...\n')
+        for lines in generate_lines(log_type, num_lines, profile, seed):
+            out.write(''.join(lines))
+    return file_path
+
+
+def get_log_file(data_dir, log_type, num_lines, profile=None, seed=42):
+    """
+    Return the path of a synthetic log file in data_dir, generating it only if the
+    same log type, number of lines, profile and seed wasn't generated before.
+    """
+    profile = profile or TrafficProfile()
+    file_path = os.path.join(data_dir, '%s_%d_%d_%s.log.gz' % (log_type, num_lines, seed, profile.digest()))
+    if not os.path.exists(file_path):
+        tmp_file_path = file_path + '.tmp'
+        write_log(tmp_file_path, log_type, num_lines, profile, seed)
+        os.replace(tmp_file_path, file_path)
+    return file_path
@@ -0,0 +1,114 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from bisect import bisect_right
+
+from lib.ip_util import format_address, network_range, parse_address, parse_ip
+
+DEFAULT_DENSITY = 16
+DEFAULT_PREFIX_V4 = 24
+DEFAULT_PREFIX_V6 = 64
+PREFIXES_V6 = [48, 64]
+
+
+class IntervalSet(object):
+    """
+    Disjoint [start, end] integer intervals, sorted, for ip ranges as integers.
+    """
+
+    def __init__(self, intervals=()):
+        self.starts = []
+        self.ends = []
+        for start, end in sorted(intervals):
+            if self.ends and start <= self.ends[-1] + 1:
+                self.ends[-1] = max(self.ends[-1], end)
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def overlaps(self, start, end):
+        """
+        Return True if any address of [start, end] is in the set.
+        """
+        i = bisect_right(self.starts, end) - 1
+        return i >= 0 and self.ends[i] >= start
+
+
+def cidr_to_interval(cidr):
+    """
+    Return (version, first address, last address) of an ip or CIDR, addresses as integers.
+    """
+    parsed = parse_ip(cidr)
+    if parsed is None:
+        raise ValueError("%s is not an ip address or CIDR" % cidr)
+    return (parsed[0],) + network_range(parsed)
+
+
+class CidrAggregator(object):
+    """
+    Replace the offenders of a prefix (/24 for IPv4, /64 or /48 for IPv6 by default)
+    by the prefix itself when there are at least density of them, so more offenders
+    fit in the WAF IP sets. Prefixes overlapping the allowlist are never emitted,
+    their offenders stay individual addresses.
+    """
+
+    def __init__(self, density=DEFAULT_DENSITY, prefix_v4=DEFAULT_PREFIX_V4, prefix_v6=DEFAULT_PREFIX_V6,
+                 allowlist=()):
+        self.density = density
+        self.shifts = {4: 32 - prefix_v4, 6: 128 - prefix_v6}
+        self.prefixes = {4: prefix_v4, 6: prefix_v6}
+        intervals = {4: [], 6: []}
+        for cidr in allowlist:
+            version, start, end = cidr_to_interval(cidr)
+            intervals[version].append((start, end))
+        self.allowlist = {version: IntervalSet(ranges) for version, ranges in intervals.items()}
+
+    def aggregate(self, requesters):
+        """
+        Return the (ip, requester) pairs of requesters with the dense prefixes folded
+        into ('<prefix>/<length>', requester) pairs, then {prefix CIDR: offenders
+        it stands for}. A prefix requester has the highest max_counter_per_min and
+        updated_at of its offenders and their number in 'addresses'.
+        """
+        prefixes = {}           # (version, network) -> [(ip, requester)]
+        aggregated = []
+        for ip, v in requesters:
+            parsed = parse_address(ip)
+            if parsed is None:
+                # Not an ip address, left to build_ip_list_to_block
+                aggregated.append((ip, v))
+                continue
+            version, address = parsed
+            prefixes.setdefault((version, address >> self.shifts[version]), []).append((ip, v))
+
+        report = {}
+        for (version, network), members in prefixes.items():
+            shift = self.shifts[version]
+            start = network << shift
+            if len(members) < self.density or self.allowlist[version].overlaps(start, start + (1 << shift) - 1):
+                aggregated.extend(members)
+                continue
+
+            cidr = '%s/%d' % (format_address(version, start), self.prefixes[version])
+            aggregated.append((cidr, {
+                'max_counter_per_min': max(v['max_counter_per_min'] for _, v in members),
+                'updated_at': max(v['updated_at'] for _, v in members),
+                'addresses': len(members)
+            }))
+            report[cidr] = len(members)
+
+        return aggregated, report
+
+
+def get_cidr_aggregator(log, density=DEFAULT_DENSITY, prefix_v6=DEFAULT_PREFIX_V6, allowlist=()):
+    """
+    Return a CidrAggregator folding /24 (IPv4) and /prefix_v6 (48 or 64) prefixes.
+    """
+    if prefix_v6 not in PREFIXES_V6:
+        log.warning("[cidr_aggregator: get_cidr_aggregator] Unsupported IPv6 prefix /%s. Using /%d."
+                    % (prefix_v6, DEFAULT_PREFIX_V6))
+        prefix_v6 = DEFAULT_PREFIX_V6
+    return CidrAggregator(max(int(density), 1), DEFAULT_PREFIX_V4, prefix_v6, allowlist)
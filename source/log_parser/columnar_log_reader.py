@@ -0,0 +1,175 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import re
+
+from parallel_log_reader import iter_line_blocks
+from log_formats import LOG_FORMATS, get_request_url, get_url_path
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.csv
+except ImportError:  # optional dependency
+    pyarrow = None
+
+COLUMNAR_BLOCK_SIZE = 50000                 # lines parsed at a time, for iterators of lines
+COLUMNAR_BLOCK_BYTES = 16 * 1024 * 1024     # bytes parsed at a time, for file objects
+COMMENT_LINES = re.compile(rb'^#[^\n]*', re.MULTILINE)
+
+
+def get_log_parser_engine(log, name='lines'):
+    """
+    Return the engine parsing access logs (see log_formats): lines (one line at a
+    time) or pyarrow (blocks of lines into columns).
+    """
+    name = (name or 'lines').lower()
+    if name == 'pyarrow' and pyarrow is None:
+        log.warning("[columnar_log_reader: get_log_parser_engine] pyarrow is not installed. Using lines engine.")
+        name = 'lines'
+    if name not in ['lines', 'pyarrow']:
+        log.warning("[columnar_log_reader: get_log_parser_engine] Unknown engine %s. Using lines engine." % name)
+        name = 'lines'
+    return name
+
+
+class ColumnarLogReader(object):
+    """
+    Parse access logs (see log_formats) a block at a time with the pyarrow CSV reader,
+    keeping only the columns the thresholds need, and return a single RequestCounter
+    (or HeavyHitterCounter) with the same counts as the line by line parser.
+
+    Filters run over whole columns. Values that need Python (uri paths, ignored
+    suffixes, epoch minutes) are computed once per distinct value of the block,
+    then requests are counted per (minute, ip, uriList patterns matched) with a
+    group by.
+    """
+
+    def __init__(self, parser, log_type, max_errors,
+                 block_size=COLUMNAR_BLOCK_SIZE, block_bytes=COLUMNAR_BLOCK_BYTES):
+        self.parser = parser
+        self.log = parser.log
+        self.log_type = log_type
+        self.max_errors = max_errors
+        self.block_size = block_size
+        self.block_bytes = block_bytes
+        self.error_count = 0
+        log_format = LOG_FORMATS[log_type]
+        # Fields in quotes are a single column here too
+        self.columns = {name: 'f%d' % index for name, index in log_format['fields'].items()}
+        self.read_options = pyarrow.csv.ReadOptions(autogenerate_column_names=True)
+        self.parse_options = pyarrow.csv.ParseOptions(
+            delimiter=log_format['delimiter'], quote_char=log_format.get('quote_char') or False,
+            escape_char=log_format.get('escape_char') or False, invalid_row_handler=self.handle_invalid_row)
+        self.convert_options = pyarrow.csv.ConvertOptions(
+            include_columns=list(self.columns.values()),
+            column_types={column: pyarrow.string() for column in self.columns.values()})
+
+    def handle_invalid_row(self, row):
+        self.error_count += 1
+        self.log.error("[lambda_log_parser: get_outstanding_requesters] Error to process line: %s" % row.text)
+        self.log.error("Expected %d columns, got %d" % (row.expected_columns, row.actual_columns))
+        return 'error' if self.error_count == self.max_errors else 'skip'
+
+    def count_row_errors(self, num_rows, e):
+        for _ in range(num_rows):
+            self.error_count += 1
+            self.log.error("[lambda_log_parser: get_outstanding_requesters] Error to process line: %s" % e)
+            if self.error_count == self.max_errors:
+                raise e
+
+    def get_minutes(self, table):
+        # Same minute strings as compile_log_format
+        if 'timestamp' in self.columns:
+            minute_strs = pyarrow.compute.utf8_slice_codeunits(table[self.columns['timestamp']], 0, 16)
+        else:
+            minute_strs = pyarrow.compute.binary_join_element_wise(
+                table[self.columns['date']],
+                pyarrow.compute.utf8_slice_codeunits(table[self.columns['time']], 0, 5), ' ')
+
+        minute_strs = minute_strs.combine_chunks().dictionary_encode()
+        minutes = []
+        for minute_str in minute_strs.dictionary.to_pylist():
+            try:
+                minutes.append(self.parser.get_minute(minute_str))
+            except Exception as e:
+                rows = pyarrow.compute.sum(pyarrow.compute.equal(
+                    minute_strs.indices, len(minutes))).as_py()
+                minutes.append(None)
+                self.count_row_errors(rows, e)
+        return pyarrow.compute.take(pyarrow.array(minutes, pyarrow.int64()), minute_strs.indices)
+
+    def get_source_ips(self, table):
+        if 'source_ip_port' in self.columns:
+            return pyarrow.compute.replace_substring_regex(table[self.columns['source_ip_port']], ':[^:]*$', '')
+        return table[self.columns['source_ip']]
+
+    def get_uris(self, table, counter):
+        """
+        Return (mask of the rows whose uri isn't ignored, uri class of each row, a uri
+        of each class). Uris of the same class match the same uriList patterns.
+        """
+        compiled_config = self.parser.compiled_config
+        is_request = 'request' in self.columns
+        values = table[self.columns['request' if is_request else 'uri']].combine_chunks().dictionary_encode()
+
+        kept = []
+        uri_classes = []
+        class_ids = {}              # pattern ids -> uri class
+        class_uris = []
+        for value in values.dictionary.to_pylist():
+            uri = get_url_path(get_request_url(value) if is_request else value)
+            kept.append(not uri.endswith(compiled_config.ignored_suffixes))
+            pattern_ids = counter.uri_matcher.match(uri)
+            if pattern_ids not in class_ids:
+                class_ids[pattern_ids] = len(class_uris)
+                class_uris.append(uri)
+            uri_classes.append(class_ids[pattern_ids])
+        return pyarrow.compute.take(pyarrow.array(kept, pyarrow.bool_()), values.indices), \
+            pyarrow.compute.take(pyarrow.array(uri_classes, pyarrow.int32()), values.indices), class_uris
+
+    def read_block(self, data, counter):
+        table = pyarrow.csv.read_csv(pyarrow.py_buffer(data), read_options=self.read_options,
+                                     parse_options=self.parse_options, convert_options=self.convert_options)
+        if 'code' in self.columns:
+            error_codes = pyarrow.array(sorted(self.parser.compiled_config.error_codes), pyarrow.string())
+            table = table.filter(pyarrow.compute.is_in(table[self.columns['code']], value_set=error_codes))
+        if table.num_rows == 0:
+            return
+
+        kept, uri_classes, class_uris = self.get_uris(table, counter)
+        requests = pyarrow.table({
+            'minute': self.get_minutes(table),
+            'source_ip': self.get_source_ips(table),
+            'uri_class': uri_classes
+        })
+        requests = requests.filter(pyarrow.compute.and_(kept, pyarrow.compute.is_valid(requests['minute'])))
+        grouped = requests.group_by(['minute', 'source_ip', 'uri_class']).aggregate([([], 'count_all')])
+
+        for minute, source_ip, uri_class, num_reqs in zip(grouped['minute'].to_pylist(),
+                                                          grouped['source_ip'].to_pylist(),
+                                                          grouped['uri_class'].to_pylist(),
+                                                          grouped['count_all'].to_pylist()):
+            counter.add_requests(minute, source_ip, class_uris[uri_class], num_reqs)
+
+    def iter_blocks(self, lines):
+        if hasattr(lines, 'read'):
+            # File object: whole decompressed blocks, completed up to the end of their last line
+            while True:
+                data = lines.read(self.block_bytes)
+                if not data:
+                    return
+                yield data + lines.readline()
+        else:
+            for block in iter_line_blocks(lines, self.block_size):
+                # Lines may or may not keep their new line character, empty lines are ignored
+                yield b'\n'.join(block)
+
+    def read(self, lines, error_count):
+        self.error_count = error_count
+        counter = self.parser.new_request_counter()
+        for data in self.iter_blocks(lines):
+            if data[:1] == b'#' or b'\n#' in data:
+                data = COMMENT_LINES.sub(b'', data)
+            self.read_block(data, counter)
+        return counter
@@ -0,0 +1,43 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+
+from uri_matcher import UriMatcher
+
+# (bucket name, key name) -> CompiledConfig. Module level, so it survives warm invocations.
+CONFIG_CACHE = {}
+
+
+class CompiledConfig(object):
+    """
+    A lambda log parser config file (-app_log_conf.json or -waf_log_conf.json) with
+    the values checked for every log line turned into structures made for it.
+    """
+
+    def __init__(self, config, etag=None):
+        self.config = config
+        self.etag = etag
+        general = config.get('general', {})
+        self.error_codes = frozenset(str(code) for code in general.get('errorCodes', []))
+        # str.endswith accepts a tuple of suffixes and checks them all in C
+        self.ignored_suffixes = tuple(general.get('ignoredSufixes', []))
+        # Exact paths, prefixes or globs, interned to ids by RequestCounter
+        self.uri_list = tuple(config.get('uriList', {}).keys())
+        self.uri_matcher = UriMatcher(self.uri_list)
+
+
+def get_compiled_config(s3_util, log, bucket_name, key_name):
+    """
+    Return the CompiledConfig of a config file, reusing the cached one when S3
+    answers a conditional GET on its ETag with 304 Not Modified.
+    """
+    cached = CONFIG_CACHE.get((bucket_name, key_name))
+    response = s3_util.get_object_if_changed(bucket_name, key_name, cached.etag if cached else None)
+    if response is None:
+        log.debug("[config_cache: get_compiled_config] %s not modified, using cached config." % key_name)
+        return cached
+
+    compiled_config = CompiledConfig(json.loads(response['Body'].read()), response.get('ETag'))
+    CONFIG_CACHE[(bucket_name, key_name)] = compiled_config
+    return compiled_config
@@ -0,0 +1,178 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from heapq import heapify, heappush, heapreplace, nlargest
+
+from request_counter import INVALID_IP_KEY, RequestCounter, parse_ip_key
+
+HEAVY_HITTER_CAPACITY = 10000   # ips tracked per minute and scope
+
+
+class SpaceSavingCounts(dict):
+    """
+    Space-Saving summary of the requests of one minute: at most capacity ips are
+    tracked. When a new ip arrives and the summary is full, the ip with the lowest
+    estimate is evicted and the new ip inherits that estimate as its error.
+
+    Values are guaranteed counts (estimate - error), never above the true number of
+    requests, so thresholds applied on them can't block an ip that didn't reach
+    them. The error of any estimate is at most get_max_error(), itself at most
+    (requests in the minute) / capacity, and every ip with more requests than that
+    is tracked.
+    """
+
+    def __init__(self, capacity=HEAVY_HITTER_CAPACITY):
+        super().__init__()
+        self.capacity = capacity
+        self.errors = {}        # ip_key -> error, for ips added after an eviction
+        self.heap = []          # (estimate, ip_key), entries may be stale (too low)
+
+    def get_estimate(self, ip_key):
+        return self[ip_key] + self.errors.get(ip_key, 0)
+
+    def get_max_error(self):
+        if len(self) < self.capacity:
+            return 0
+        self.repair_heap()
+        return self.heap[0][0]
+
+    def repair_heap(self):
+        # Estimates only grow, so a stale entry is below the real minimum: refresh
+        # entries until the smallest one is current
+        heap = self.heap
+        while True:
+            estimate, ip_key = heap[0]
+            current = self[ip_key] + self.errors.get(ip_key, 0)
+            if current == estimate:
+                return
+            heapreplace(heap, (current, ip_key))
+
+    def increment(self, ip_key, num_reqs=1):
+        count = self.get(ip_key)
+        if count is not None:
+            self[ip_key] = count + num_reqs
+        elif len(self) < self.capacity:
+            self[ip_key] = num_reqs
+            heappush(self.heap, (num_reqs, ip_key))
+        else:
+            self.repair_heap()
+            min_estimate, evicted = self.heap[0]
+            heapreplace(self.heap, (min_estimate + num_reqs, ip_key))
+            del self[evicted]
+            self.errors.pop(evicted, None)
+            self[ip_key] = num_reqs
+            self.errors[ip_key] = min_estimate
+
+    def merge(self, other):
+        """
+        Add the summary of another part of the same minute, keeping the capacity
+        ips with the highest estimates (mergeable summaries, Agarwal et al. 2012).
+        """
+        own_missing = self.get_max_error()
+        other_missing = other.get_max_error()
+        estimates = {}
+        counts = {}
+        for ip_key in set(self).union(other):
+            own_count = self.get(ip_key)
+            other_count = other.get(ip_key)
+            estimates[ip_key] = \
+                (own_missing if own_count is None else self.get_estimate(ip_key)) + \
+                (other_missing if other_count is None else other.get_estimate(ip_key))
+            counts[ip_key] = (own_count or 0) + (other_count or 0)
+
+        self.clear()
+        self.errors = {}
+        self.heap = []
+        for ip_key in nlargest(self.capacity, estimates, key=estimates.get):
+            self[ip_key] = counts[ip_key]
+            if estimates[ip_key] != counts[ip_key]:
+                self.errors[ip_key] = estimates[ip_key] - counts[ip_key]
+            self.heap.append((estimates[ip_key], ip_key))
+        heapify(self.heap)
+
+
+class HeavyHitterCounter(RequestCounter):
+    """
+    RequestCounter with bounded memory: each minute of general and of every
+    monitored uri is a SpaceSavingCounts of at most capacity ips, so a flood of
+    random source ips can't exhaust the Lambda memory. Thresholds are evaluated
+    on guaranteed counts, see SpaceSavingCounts.
+
+    Ip keys are not cached, as the cache would grow with the number of ips.
+    """
+
+    def __init__(self, uri_list=(), capacity=HEAVY_HITTER_CAPACITY, uri_matcher=None):
+        super().__init__(uri_list, uri_matcher)
+        self.capacity = capacity
+
+    def new_counts(self):
+        return SpaceSavingCounts(self.capacity)
+
+    def add(self, minute, ip, uri):
+        ip_key = parse_ip_key(ip)
+        if ip_key == INVALID_IP_KEY:
+            self.invalid_ips += 1
+            return
+
+        if minute == self.current_minute:
+            counts = self.current_counts
+        else:
+            counts = self.general.get(minute)
+            if counts is None:
+                counts = self.general[minute] = self.new_counts()
+            self.current_minute = minute
+            self.current_counts = counts
+        counts.increment(ip_key)
+
+        for uri_id in self.uri_matcher.match(uri):
+            minute_counts = self.uri_list[uri_id]
+            counts = minute_counts.get(minute)
+            if counts is None:
+                counts = minute_counts[minute] = self.new_counts()
+            counts.increment(ip_key)
+
+    def add_requests(self, minute, ip, uri, num_reqs):
+        ip_key = parse_ip_key(ip)
+        if ip_key == INVALID_IP_KEY:
+            self.invalid_ips += num_reqs
+            return
+
+        counts = self.general.get(minute)
+        if counts is None:
+            counts = self.general[minute] = self.new_counts()
+        counts.increment(ip_key, num_reqs)
+        for uri_id in self.uri_matcher.match(uri):
+            minute_counts = self.uri_list[uri_id]
+            counts = minute_counts.get(minute)
+            if counts is None:
+                counts = minute_counts[minute] = self.new_counts()
+            counts.increment(ip_key, num_reqs)
+
+    def merge(self, other):
+        """
+        Add the counts of another HeavyHitterCounter built with the same uri list.
+        """
+        merge_heavy_hitter_counts(self.general, other.general, self.new_counts)
+        for minute_counts, other_minute_counts in zip(self.uri_list, other.uri_list):
+            merge_heavy_hitter_counts(minute_counts, other_minute_counts, self.new_counts)
+        self.invalid_ips += other.invalid_ips
+        self.current_minute = None
+        self.current_counts = None
+
+    def get_max_error(self):
+        """
+        Return the highest error bound over all minutes and scopes, 0 if all counts are exact.
+        """
+        max_error = 0
+        for minute_counts in [self.general] + self.uri_list:
+            for counts in minute_counts.values():
+                max_error = max(max_error, counts.get_max_error())
+        return max_error
+
+
+def merge_heavy_hitter_counts(minute_counts, other_minute_counts, new_counts):
+    for minute, other_counts in other_minute_counts.items():
+        counts = minute_counts.get(minute)
+        if counts is None:
+            counts = minute_counts[minute] = new_counts()
+        counts.merge(other_counts)
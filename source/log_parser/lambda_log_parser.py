@@ -12,17 +12,35 @@
 ######################################################################################################################
 
 import gzip
-import json
 import datetime
+import heapq
 import os
 from os import remove
-from time import sleep
-from urllib.parse import urlparse
+from time import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
 from lib.waflibv2 import WAFLIBv2
 from lib.s3_util import S3
+from lib.ip_util import split_ip_set_addresses
+from lib.ip_set_updater import get_ip_set_updater
+from lib.ip_set_mutations import REPLACE, get_ip_set_mutation_queue, make_intents
+from s3_log_stream import RANGE_PART_SIZE, iter_log_lines
+from waf_log_decoder import get_waf_log_decoder, get_uri_path
+from request_counter import RequestCounter, format_ip_key
+from heavy_hitters import HeavyHitterCounter
+from parallel_log_reader import ParallelLogReader, get_worker_count
+from columnar_log_reader import ColumnarLogReader, get_log_parser_engine
+from log_formats import LOG_FORMATS, compile_log_format
+from config_cache import CompiledConfig, get_compiled_config
+from window_store import WINDOW_TTL_MINUTES, aggregate_counter, get_window_store
+from stage_metrics import STAGE_METRICS_NAMESPACE, get_stage_metrics
+from requester_state import decode_state, encode_state, get_state_format
+from cidr_aggregator import DEFAULT_DENSITY, DEFAULT_PREFIX_V6, get_cidr_aggregator
 
 TMP_DIR = '/tmp/' #NOSONAR tmp use for an insensitive workspace
-FORMAT_DATE_TIME = "%Y-%m-%d %H:%M:%S %Z%z"
+MAX_LINE_ERRORS = 5
+# Addresses per WAF IP set, when LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION is not set
+DEFAULT_IP_RANGE_LIMIT = 10000
 
 class LambdaLogParser(object):
     """
@@ -32,206 +50,235 @@ class LambdaLogParser(object):
     def __init__(self, log):
         self.log = log
         self.config = {}
-        self.delay_between_updates = 5
+        self.compiled_config = CompiledConfig(self.config)
         self.scope = os.getenv('SCOPE')
         self.scanners = 1
         self.flood = 2
         self.s3_util = S3(log)
         self.waflib = WAFLIBv2()
-
-        # CloudFront Access Logs
-        # http://docs.aws.amazon.com/AmazonCloudFront/latest/DeveloperGuide/AccessLogs.html#BasicDistributionFileFormat
-        self.line_format_cloud_front = {
-            'delimiter': '\t',
-            'date': 0,
-            'time': 1,
-            'source_ip': 4,
-            'uri': 7,
-            'code': 8
-        }
-
-        # ALB Access Logs
-        # http://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html
-        self.line_format_alb = {
-            'delimiter': ' ',
-            'timestamp': 1,
-            'source_ip': 3,
-            'code': 9,  # GitHub issue #44. Changed from elb_status_code to target_status_code.
-            'uri': 13
-        }
+        # Stream log objects from S3 instead of staging them in /tmp
+        self.stream_log_files = os.getenv('STREAM_LOG_FILES', 'no').lower() == 'yes'
+        self.range_get_concurrency = int(os.getenv('RANGE_GET_CONCURRENCY', '4'))
+        self.range_part_size = RANGE_PART_SIZE
+        # Decoder for WAF log lines: auto, json, orjson or scan
+        self.waf_log_decoder = get_waf_log_decoder(log, os.getenv('WAF_LOG_DECODER', 'auto'))
+        # Epoch minute per ALB/CloudFront timestamp truncated to the minute
+        self.minutes = {}
+        # Number of processes parsing log lines: a number or auto (one per CPU)
+        self.log_parser_workers = get_worker_count(os.getenv('LOG_PARSER_WORKERS', '1'))
+        # Engine parsing ALB and CloudFront logs: lines or pyarrow (columnar, blocks of lines)
+        self.log_parser_engine = get_log_parser_engine(log, os.getenv('LOG_PARSER_ENGINE', 'lines'))
+        # Number of log files read at the same time when processing records in batch
+        self.batch_concurrency = int(os.getenv('BATCH_CONCURRENCY', '4'))
+        # Per-minute counts shared across log files: none, memory, s3 or dynamodb
+        self.window_store = os.getenv('WINDOW_STORE', 'none')
+        # Ips tracked per minute by the approximate (bounded memory) counter, 0 for exact counts
+        self.heavy_hitter_capacity = int(os.getenv('HEAVY_HITTER_CAPACITY', '0'))
+        # Format of the outstanding requesters state file written to S3: json or compact (both are read)
+        self.state_format = get_state_format(log, os.getenv('STATE_FORMAT', 'json'))
+        # Duration and volume of each stage as CloudWatch Embedded Metric Format records: yes or no
+        self.metrics = get_stage_metrics(log, os.getenv('STAGE_METRICS', 'no'),
+                                         os.getenv('STAGE_METRICS_NAMESPACE', STAGE_METRICS_NAMESPACE))
+        # Block the prefixes (/24, /64 or /48) holding at least CIDR_AGGREGATION_DENSITY offenders: yes or no
+        self.cidr_aggregation = os.getenv('CIDR_AGGREGATION', 'no').lower() == 'yes'
+
+        # Line readers compiled from the access log format descriptors, by log type
+        self.line_readers = {log_type: compile_log_format(log_format)
+                             for log_type, log_format in LOG_FORMATS.items()}
+
+
+    def get_minute(self, minute_str):
+        minute = self.minutes.get(minute_str)
+        if minute is None:
+            minute = int(datetime.datetime.fromisoformat(minute_str).replace(
+                tzinfo=datetime.timezone.utc).timestamp()) // 60
+            self.minutes[minute_str] = minute
+        return minute
 
 
     def read_waf_log_file(self, line): 
-        line = line.decode()  # Remove the b in front of each field
-        line_data = json.loads(str(line))
+        timestamp, source_ip, uri = self.waf_log_decoder.decode(line)
+        return  timestamp // 60000, source_ip, get_uri_path(uri), None
+    
 
-        request_key = datetime.datetime.fromtimestamp(int(line_data['timestamp']) / 1000.0).isoformat(
-            sep='T', timespec='minutes')
-        request_key += ' ' + line_data['httpRequest']['clientIp']
-        uri = urlparse(line_data['httpRequest']['uri']).path
+    def read_app_log_line(self, log_type, line):
+        minute_str, source_ip, uri, code = self.line_readers[log_type](line)
+        return self.get_minute(minute_str), source_ip, uri, code
 
-        return  request_key, uri, line_data
-    
 
     def read_alb_log_file(self, line): 
-        line_data = line.split(self.line_format_alb['delimiter'])
-        request_key = line_data[self.line_format_alb['timestamp']].rsplit(':', 1)[0]
-        request_key += ' ' + line_data[self.line_format_alb['source_ip']].rsplit(':', 1)[0]
-        return_code_index = self.line_format_alb['code']
-        uri = urlparse(line_data[self.line_format_alb['uri']]).path
-
-        return  request_key, uri, return_code_index, line_data
+        return self.read_app_log_line('alb', line)
 
 
     def read_cloudfront_log_file(self, line): 
-        line_data = line.split(self.line_format_cloud_front['delimiter'])
-        request_key = line_data[self.line_format_cloud_front['date']]
-        request_key += ' ' + line_data[self.line_format_cloud_front['time']][:-3]
-        request_key += ' ' + line_data[self.line_format_cloud_front['source_ip']]
-        return_code_index = self.line_format_cloud_front['code']
-        uri = urlparse(line_data[self.line_format_cloud_front['uri']]).path
+        return self.read_app_log_line('cloudfront', line)
 
-        return  request_key, uri, return_code_index, line_data
 
+    def new_request_counter(self):
+        compiled_config = self.compile_config()
+        if self.heavy_hitter_capacity > 0:
+            return HeavyHitterCounter(compiled_config.uri_list, self.heavy_hitter_capacity,
+                                      compiled_config.uri_matcher)
+        return RequestCounter(compiled_config.uri_list, compiled_config.uri_matcher)
 
-    def update_threshold_counter(self, request_key, uri, return_code_index, line_data, counter): 
-        if return_code_index == None or line_data[return_code_index] in self.config['general']['errorCodes']:
-            counter['general'][request_key] = counter['general'][request_key] + 1 \
-                if request_key in counter['general'].keys() else 1
 
-            if 'uriList' in self.config and uri in self.config['uriList'].keys():
-                if uri not in counter['uriList'].keys():
-                    counter['uriList'][uri] = {}
-
-                counter['uriList'][uri][request_key] = counter['uriList'][uri][request_key] + 1 \
-                    if request_key in counter['uriList'][uri].keys() else 1
+    def update_threshold_counter(self, minute, source_ip, uri, code, counter): 
+        if code is None or code in self.compiled_config.error_codes:
+            counter.add(minute, source_ip, uri)
 
         return counter
 
 
     def read_log_file(self, local_file_path, log_type, error_count): 
-        counter = {
-            'general': {},
-            'uriList': {}
-        }
+        with gzip.open(local_file_path, 'r') as content:
+            lines = self.metrics.count_lines(content)
+            result = self.read_log_lines(lines, log_type, error_count)
+            self.metrics.add_line_counts(lines)
+        remove(local_file_path)
+        return result
+
+
+    def read_log_lines(self, lines, log_type, error_count):
+        counter = self.new_request_counter()
         outstanding_requesters = {
             'general': {},
             'uriList': {}
         }
 
-        with gzip.open(local_file_path, 'r') as content:
-            for line in content:
-                try:  
-                    oreq = self.read_contents(line, log_type, outstanding_requesters, counter)
-                    if oreq: 
-                        return oreq
-
-                except Exception as e:
-                    error_count += 1
-                    self.log.error("[lambda_log_parser: get_outstanding_requesters] Error to process line: %s" % line)
-                    self.log.error(str(e))
-                    if error_count == 5:  #Allow 5 errors before stopping the function execution
-                        raise
-        remove(local_file_path)
+        if self.log_parser_engine == 'pyarrow' and log_type in LOG_FORMATS:
+            reader = ColumnarLogReader(self, log_type, MAX_LINE_ERRORS)
+            return reader.read(lines, error_count), outstanding_requesters
+
+        if self.log_parser_workers > 1 and (log_type == 'waf' or log_type in LOG_FORMATS):
+            reader = ParallelLogReader(self, log_type, self.log_parser_workers, MAX_LINE_ERRORS)
+            return reader.read(lines, error_count), outstanding_requesters
+
+        for line in lines:
+            try:  
+                oreq = self.read_contents(line, log_type, outstanding_requesters, counter)
+                if oreq: 
+                    return oreq
+
+            except Exception as e:
+                error_count += 1
+                self.log.error("[lambda_log_parser: get_outstanding_requesters] Error to process line: %s" % line)
+                self.log.error(str(e))
+                if error_count == MAX_LINE_ERRORS:  #Allow 5 errors before stopping the function execution
+                    raise
         return counter, outstanding_requesters
 
 
     def read_contents(self, line, log_type, outstanding_requesters, counter):
-        request_key = ""
-        uri = ""
-        return_code_index = None
-
         if log_type == 'waf':
-            request_key, uri, line_data = self.read_waf_log_file(line)
-        elif log_type == 'alb':
-            line = line.decode('utf8')
-            if line.startswith('#'):
+            minute, source_ip, uri, code = self.read_waf_log_file(line)
+        elif log_type in self.line_readers:
+            # Header lines are skipped before decoding
+            if line[:1] == b'#':
                 return
-            request_key, uri, return_code_index, line_data = \
-                self.read_alb_log_file(line)
-        elif log_type == 'cloudfront':
-            line = line.decode('utf8')
-            if line.startswith('#'):
-                return
-            request_key, uri, return_code_index, line_data = \
-                self.read_cloudfront_log_file(line)
+            minute, source_ip, uri, code = self.read_app_log_line(log_type, line.decode('utf8'))
         else:
             return outstanding_requesters
         
-        if 'ignoredSufixes' in self.config['general'] and uri.endswith(
-                tuple(self.config['general']['ignoredSufixes'])):
+        if uri.endswith(self.compiled_config.ignored_suffixes):
             self.log.debug(
-                "[lambda_log_parser: get_outstanding_requesters] Skipping line %s. Included in ignoredSufixes." % line)
+                "[lambda_log_parser: get_outstanding_requesters] Skipping line %s. Included in ignoredSufixes.", line)
             return
 
-        counter = self.update_threshold_counter(request_key, uri, return_code_index, line_data, counter)
+        counter = self.update_threshold_counter(minute, source_ip, uri, code, counter)
     
 
-    def parse_log_file(self, bucket_name, key_name, log_type):
+    def load_config(self, bucket_name, conf_filename):
+        self.compiled_config = get_compiled_config(self.s3_util, self.log, bucket_name, conf_filename)
+        self.config = self.compiled_config.config
+
+
+    def compile_config(self):
+        # self.config may also be set directly
+        if self.compiled_config.config is not self.config:
+            self.compiled_config = CompiledConfig(self.config)
+        return self.compiled_config
+
+
+    def parse_log_file(self, bucket_name, key_name, log_type, object_size=None):
         self.log.debug("[lambda_log_parser: parse_log_file] Start")
 
+        error_count = 0
+        if self.stream_log_files:
+            # ----------------------------------------------------------------------------------------------------------
+            self.log.info("[lambda_log_parser: parse_log_file] Stream file content from S3")
+            # ----------------------------------------------------------------------------------------------------------
+            lines = self.metrics.count_lines(
+                iter_log_lines(self.s3_util, bucket_name, key_name, self.range_get_concurrency,
+                               self.range_part_size, object_size))
+            # Download and parse overlap when streaming
+            with self.metrics.stage('Parse'):
+                result = self.read_log_lines(lines, log_type, error_count)
+            self.metrics.add_line_counts(lines)
+            return result
+
         # --------------------------------------------------------------------------------------------------------------
         self.log.info("[lambda_log_parser: parse_log_file] Download file from S3")
         # --------------------------------------------------------------------------------------------------------------
         local_file_path = TMP_DIR + key_name.split('/')[-1]
-        self.s3_util.download_file_from_s3(bucket_name, key_name, local_file_path)
+        with self.metrics.stage('Download'):
+            self.s3_util.download_file_from_s3(bucket_name, key_name, local_file_path)
+        self.metrics.add('S3Calls', 1)
+        if self.metrics.enabled:
+            self.metrics.add('DownloadBytes', os.path.getsize(local_file_path), 'Bytes')
 
         # --------------------------------------------------------------------------------------------------------------
         self.log.info("[lambda_log_parser: parse_log_file] Read file content")
         # --------------------------------------------------------------------------------------------------------------
-        error_count = 0
-        counter, outstanding_requesters = self.read_log_file(local_file_path, log_type, error_count)
+        with self.metrics.stage('Parse'):
+            counter, outstanding_requesters = self.read_log_file(local_file_path, log_type, error_count)
 
         return counter, outstanding_requesters
 
 
-    def get_general_outstanding_requesters(self, counter, outstanding_requesters,
-                                           threshold, utc_now_timestamp_str):
-        for k, num_reqs in counter['general'].items():
+    def get_general_outstanding_requesters(self, counter, outstanding_requesters, threshold, updated_at):
+        max_counts = counter.get_general_max_counts(self.config['general'][threshold])
+        for ip_key, num_reqs in max_counts.items():
             try:
-                k = k.split(' ')[-1]
-                if num_reqs >= self.config['general'][threshold]:
-                    if k not in outstanding_requesters['general'].keys() or num_reqs > \
-                            outstanding_requesters['general'][k]['max_counter_per_min']:
-                        outstanding_requesters['general'][k] = {
-                            'max_counter_per_min': num_reqs,
-                            'updated_at': utc_now_timestamp_str
-                        }
+                k = format_ip_key(ip_key)
+                if k not in outstanding_requesters['general'].keys() or num_reqs > \
+                        outstanding_requesters['general'][k]['max_counter_per_min']:
+                    outstanding_requesters['general'][k] = {
+                        'max_counter_per_min': num_reqs,
+                        'updated_at': updated_at
+                    }
             except Exception:
                 self.log.error(
                     "[lambda_log_parser: get_general_outstanding_requesters] \
-                    Error to process general outstanding requester: %s" % k)
+                    Error to process general outstanding requester: %s" % ip_key)
 
         return outstanding_requesters
 
 
-    def get_urilist_outstanding_requesters(self, counter, outstanding_requesters,
-                                           threshold, utc_now_timestamp_str):
-        for uri in counter['uriList'].keys():
-            for k, num_reqs in counter['uriList'][uri].items():
+    def get_urilist_outstanding_requesters(self, counter, outstanding_requesters, threshold, updated_at):
+        for uri in counter.uris:
+            max_counts = counter.get_urilist_max_counts(uri, self.config['uriList'][uri][threshold])
+            for ip_key, num_reqs in max_counts.items():
                 try:
                     self.populate_urilist_outstanding_requesters(
-                        k, num_reqs, uri, threshold, outstanding_requesters, utc_now_timestamp_str)
+                        format_ip_key(ip_key), num_reqs, uri, outstanding_requesters, updated_at)
                 except Exception:
                     self.log.error(
                         "[lambda_log_parser: get_urilist_outstanding_requesters] \
-                        Error to process outstanding requester:(%s) %s" % (uri, k))
+                        Error to process outstanding requester:(%s) %s" % (uri, ip_key))
 
         return outstanding_requesters
     
 
-    def populate_urilist_outstanding_requesters(self, k, num_reqs, uri, threshold, outstanding_requesters, utc_now_timestamp_str):
-        k = k.split(' ')[-1]
-        if num_reqs >= self.config['uriList'][uri][threshold]:
-            if uri not in outstanding_requesters['uriList'].keys():
-                outstanding_requesters['uriList'][uri] = {}
-
-            if k not in outstanding_requesters['uriList'][uri].keys() or num_reqs > \
-                    outstanding_requesters['uriList'][uri][k]['max_counter_per_min']:
-                outstanding_requesters['uriList'][uri][k] = {
-                    'max_counter_per_min': num_reqs,
-                    'updated_at': utc_now_timestamp_str
-                }
+    def populate_urilist_outstanding_requesters(self, k, num_reqs, uri, outstanding_requesters, updated_at):
+        if uri not in outstanding_requesters['uriList'].keys():
+            outstanding_requesters['uriList'][uri] = {}
+
+        if k not in outstanding_requesters['uriList'][uri].keys() or num_reqs > \
+                outstanding_requesters['uriList'][uri][k]['max_counter_per_min']:
+            outstanding_requesters['uriList'][uri][k] = {
+                'max_counter_per_min': num_reqs,
+                'updated_at': updated_at
+            }
  
 
     def get_outstanding_requesters(self, log_type, counter, outstanding_requesters):
@@ -241,11 +288,15 @@ class LambdaLogParser(object):
         self.log.info("[lambda_log_parser: get_outstanding_requesters] Keep only outstanding requesters")
         # --------------------------------------------------------------------------------------------------------------
         threshold = 'requestThreshold' if log_type == 'waf' else "errorThreshold"
-        utc_now_timestamp_str = datetime.datetime.now(datetime.timezone.utc).strftime(FORMAT_DATE_TIME)
+        if isinstance(counter, HeavyHitterCounter):
+            self.log.info("[lambda_log_parser: get_outstanding_requesters] Approximate counts, "
+                          "max error per minute: %d" % counter.get_max_error())
+        # Epoch seconds, see requester_state
+        updated_at = int(time())
         outstanding_requesters = self.get_general_outstanding_requesters(
-            counter, outstanding_requesters,threshold, utc_now_timestamp_str)
+            counter, outstanding_requesters, threshold, updated_at)
         outstanding_requesters = self.get_urilist_outstanding_requesters(
-            counter, outstanding_requesters, threshold, utc_now_timestamp_str)
+            counter, outstanding_requesters, threshold, updated_at)
 
         self.log.debug("[lambda_log_parser: get_outstanding_requesters] End")
         return outstanding_requesters
@@ -254,164 +305,71 @@ class LambdaLogParser(object):
     def calculate_last_update_age(self, response):
         utc_last_modified = response['LastModified'].astimezone(datetime.timezone.utc)
         utc_now_timestamp = datetime.datetime.now(datetime.timezone.utc)
-        utc_now_timestamp_str = utc_now_timestamp.strftime(FORMAT_DATE_TIME)
         last_update_age = int(((utc_now_timestamp - utc_last_modified).total_seconds()) / 60)
 
-        return utc_now_timestamp, utc_now_timestamp_str, last_update_age
+        return int(utc_now_timestamp.timestamp()), last_update_age
 
 
     def get_current_blocked_ips(self, bucket_name, key_name, output_key_name):
-        local_file_path = TMP_DIR + key_name.split('/')[-1] + '_REMOTE.json'
-        self.s3_util.download_file_from_s3(bucket_name, output_key_name, local_file_path)
-
-        remote_outstanding_requesters = {
-            'general': {},
-            'uriList': {}
-        }
-
-        with open(local_file_path, 'r') as file_content:
-            remote_outstanding_requesters = json.loads(file_content.read())
-        remove(local_file_path)
-
-        return remote_outstanding_requesters
-
-
-    def iterate_general_list_for_existing_ip(self, k, v, outstanding_requesters, utc_now_timestamp_str):
-        self.log.info(
-            "[lambda_log_parser: iterate_general_list_for_existing_ip] \
-            Updating general data of BLOCK %s rule" % k)
- 
-        outstanding_requesters['general'][k]['updated_at'] = utc_now_timestamp_str
-        if v['max_counter_per_min'] > outstanding_requesters['general'][k]['max_counter_per_min']:
-            outstanding_requesters['general'][k]['max_counter_per_min'] = v['max_counter_per_min']
-
-        return outstanding_requesters    
-
-
-    def iterate_general_list_for_new_ip(self, k, v, threshold, outstanding_requesters,
-                                        utc_now_timestamp, force_update):
-        utc_prev_updated_at = datetime.datetime.strptime(v['updated_at'],
-            FORMAT_DATE_TIME).astimezone(datetime.timezone.utc)
-        total_diff_min = ((utc_now_timestamp - utc_prev_updated_at).total_seconds()) / 60
-
-        if v['max_counter_per_min'] < self.config['general'][threshold]:
-            force_update = True
-            self.log.info(
-                "[lambda_log_parser: merge_general_outstanding_requesters] \
-                %s is bellow the current general threshold" % k)
-
-        elif total_diff_min < self.config['general']['blockPeriod']:
-            self.log.debug("[merge_general_outstanding_requesters] Keeping %s in general" % k)
-            outstanding_requesters['general'][k] = v
-
-        else:
-            force_update = True
-            self.log.info("[lambda_log_parser: merge_general_outstanding_requesters] \
-                          %s expired in general" % k)
-
-        return outstanding_requesters, force_update 
+        # Legacy JSON or compact state, read in memory
+        response = self.s3_util.get_object(bucket_name, output_key_name)
+        return decode_state(response['Body'].read())
+
+
+    def merge_requester_group(self, group, requesters, threshold, utc_now_timestamp, group_name):
+        """
+        Fold the requesters found by this invocation into a RequesterGroup of the
+        remote state, then drop the remote requesters below threshold or older than
+        the block period. Only refreshed and dropped requesters are visited (unless
+        the threshold was raised). Return True if any requester was dropped.
+        """
+        for k, v in requesters.items():
+            group.refresh(k, v['max_counter_per_min'], utc_now_timestamp)
+
+        below = group.pop_below(threshold)
+        if below:
+            self.log.info("[lambda_log_parser: merge_requester_group] %d requesters are bellow the current %s "
+                          "threshold" % (len(below), group_name))
+        expired = group.pop_expired(utc_now_timestamp - self.config['general']['blockPeriod'] * 60)
+        if expired:
+            self.log.info("[lambda_log_parser: merge_requester_group] %d requesters expired in %s"
+                          % (len(expired), group_name))
+        self.log.debug("[lambda_log_parser: merge_requester_group] Dropped from %s: %s" % (group_name, below + expired))
+
+        return len(below) + len(expired) > 0
 
 
     def merge_general_outstanding_requesters(self, threshold, remote_outstanding_requesters,
-                                             outstanding_requesters, utc_now_timestamp_str,
-                                             utc_now_timestamp, force_update):
+                                             outstanding_requesters, utc_now_timestamp, force_update):
         try:
-            for k, v in remote_outstanding_requesters['general'].items():
-                try:
-                    if k in outstanding_requesters['general'].keys():
-                        self.iterate_general_list_for_existing_ip(
-                            k, v, outstanding_requesters, utc_now_timestamp_str)
-    
-                    else:
-                        remote_outstanding_requesters, force_update = \
-                        self.iterate_general_list_for_new_ip(
-                            k, v, threshold, outstanding_requesters, utc_now_timestamp, force_update)
-
-                except Exception as e:
-                    self.log.error("[lambda_log_parser: merge_outstanding_requesters] Error merging general %s rule" % k)
-                    self.log.error(str(e))
+            group = remote_outstanding_requesters['general']
+            if self.merge_requester_group(group, outstanding_requesters['general'],
+                                          self.config['general'][threshold], utc_now_timestamp, 'general'):
+                force_update = True
+            outstanding_requesters['general'] = group
         except Exception as e:
             self.log.error("[lambda_log_parser: merge_outstanding_requesters] Failed to process general group.")
             self.log.error(str(e))
         
-        return remote_outstanding_requesters, force_update
-
-
-    def iterate_urilist_for_existing_uri(self, uri, k, v, outstanding_requesters, utc_now_timestamp_str):
-        self.log.info(
-            "[lambda_log_parser: iterate_urilist_for_existing_uri] \
-            Updating uriList (%s) data of BLOCK %s rule" % (uri, k))
-
-        outstanding_requesters['uriList'][uri][k]['updated_at'] = utc_now_timestamp_str
-        if v['max_counter_per_min'] > outstanding_requesters['uriList'][uri][k]['max_counter_per_min']:
-            outstanding_requesters['uriList'][uri][k]['max_counter_per_min'] = v['max_counter_per_min']
-
-        return outstanding_requesters
-    
-
-    def iterate_urilist_for_new_uri(self, uri, k, v, threshold, utc_now_timestamp,
-                                         outstanding_requesters, force_update):
-        utc_prev_updated_at = datetime.datetime.strptime(
-            v['updated_at'], FORMAT_DATE_TIME).astimezone(datetime.timezone.utc)
-        total_diff_min = ((utc_now_timestamp - utc_prev_updated_at).total_seconds()) / 60
-
-        if v['max_counter_per_min'] < self.config['uriList'][uri][threshold]:
-            force_update = True
-            self.log.info(
-                "[lambda_log_parser: iterate_urilist_for_new_uri] \
-                %s is bellow the current uriList (%s) threshold" % (
-                k, uri))
-
-        elif total_diff_min < self.config['general']['blockPeriod']:
-            self.log.debug(
-                "[lambda_log_parser: iterate_urilist_for_new_uri] \
-                Keeping %s in uriList (%s)" % (k, uri))
-
-            if uri not in outstanding_requesters['uriList'].keys():
-                outstanding_requesters['uriList'][uri] = {}
-
-            outstanding_requesters['uriList'][uri][k] = v
-
-        else:
-            force_update = True
-            self.log.info(
-                "[lambda_log_parser: iterate_urilist_for_new_uri] \
-                %s expired in uriList (%s)" % (k, uri))
-                                
         return outstanding_requesters, force_update
 
 
-    def iterate_urilist(self, uri, threshold, remote_outstanding_requesters, outstanding_requesters,
-                        utc_now_timestamp_str, utc_now_timestamp, force_update):
-        for k, v in remote_outstanding_requesters['uriList'][uri].items():
-            try:
-                if uri in outstanding_requesters['uriList'].keys() and k in \
-                        outstanding_requesters['uriList'][uri].keys():
-
-                    outstanding_requesters = self.iterate_urilist_for_existing_uri(
-                        uri, k, v, outstanding_requesters, utc_now_timestamp_str)
-
-                else:
-                    outstanding_requesters, force_update = self.iterate_urilist_for_new_uri(
-                        uri, k, v, threshold, utc_now_timestamp,
-                        outstanding_requesters, force_update)
-
-            except Exception:
-                self.log.error(
-                    "[lambda_log_parser: iterate_urilist] Error merging uriList (%s) %s rule" % (uri, k))
-                
-            return outstanding_requesters, force_update
-    
-    
     def merge_urilist_outstanding_requesters(self, threshold, remote_outstanding_requesters, outstanding_requesters,
-                                             utc_now_timestamp_str, utc_now_timestamp, force_update):
+                                             utc_now_timestamp, force_update):
         try:
             if 'uriList' not in self.config or len(self.config['uriList']) == 0:
                 force_update = True
                 self.log.info(
                     "[lambda_log_parser: merge_urilist_outstanding_requesters] Current config file does not contain uriList anymore")
             else:
-                for uri in remote_outstanding_requesters['uriList'].keys():
+                for uri, group in remote_outstanding_requesters['uriList'].items():
+                    # State is kept per uriList entry (exact path, prefix or glob)
+                    if uri not in self.config['uriList']:
+                        force_update = True
+                        self.log.info(
+                            "[lambda_log_parser: merge_urilist_outstanding_requesters] %s is not in uriList anymore." % uri)
+                        continue
+
                     if 'ignoredSufixes' in self.config['general'] and uri.endswith(
                             tuple(self.config['general']['ignoredSufixes'])):
                         force_update = True
@@ -419,9 +377,17 @@ class LambdaLogParser(object):
                             "[lambda_log_parser: merge_urilist_outstanding_requesters] %s is in current ignored suffixes list." % uri)
                         continue
 
-                    outstanding_requesters, force_update = self.iterate_urilist(
-                        uri, threshold, remote_outstanding_requesters, outstanding_requesters,
-                        utc_now_timestamp_str, utc_now_timestamp, force_update)
+                    try:
+                        if self.merge_requester_group(group, outstanding_requesters['uriList'].get(uri, {}),
+                                                      self.config['uriList'][uri][threshold], utc_now_timestamp,
+                                                      'uriList (%s)' % uri):
+                            force_update = True
+                        if group:
+                            outstanding_requesters['uriList'][uri] = group
+                    except Exception as e:
+                        self.log.error(
+                            "[lambda_log_parser: merge_urilist_outstanding_requesters] Error merging uriList (%s)" % uri)
+                        self.log.error(str(e))
         except Exception:
             self.log.error("[lambda_log_parser: merge_outstanding_requesters] Failed to process uriList group.")
         
@@ -436,6 +402,7 @@ class LambdaLogParser(object):
 
         # Get metadata of object key_name
         response = self.s3_util.get_head_object(bucket_name, output_key_name)
+        self.metrics.add('S3Calls', 1)
         if response is None:
             self.log.info("[lambda_log_parser: merge_outstanding_requesters] No file to be merged.")
             need_update = True
@@ -444,25 +411,22 @@ class LambdaLogParser(object):
         # --------------------------------------------------------------------------------------------------------------
         self.log.info("[lambda_log_parser: merge_outstanding_requesters] Calculate Last Update Age")
         # --------------------------------------------------------------------------------------------------------------
-        utc_now_timestamp, utc_now_timestamp_str, last_update_age = self.calculate_last_update_age(response)
+        utc_now_timestamp, last_update_age = self.calculate_last_update_age(response)
  
         # --------------------------------------------------------------------------------------------------------------
         self.log.info("[lambda_log_parser: merge_outstanding_requesters] Download current blocked IPs")
         # --------------------------------------------------------------------------------------------------------------
         remote_outstanding_requesters = self.get_current_blocked_ips(bucket_name, key_name, output_key_name)
+        self.metrics.add('S3Calls', 1)
 
         # ----------------------------------------------------------------------------------------------------------
         self.log.info("[lambda_log_parser: merge_outstanding_requesters] Process outstanding requesters files")
         # ----------------------------------------------------------------------------------------------------------
         threshold = 'requestThreshold' if log_type == 'waf' else "errorThreshold"
-        if 'general' in remote_outstanding_requesters:
-            remote_outstanding_requesters, force_update = self.merge_general_outstanding_requesters(
-                threshold, remote_outstanding_requesters, outstanding_requesters,
-                utc_now_timestamp_str, utc_now_timestamp, force_update)
-        if 'uriList' in remote_outstanding_requesters:    
-            outstanding_requesters, force_update = self.merge_urilist_outstanding_requesters(
-                threshold, remote_outstanding_requesters, outstanding_requesters,
-                utc_now_timestamp_str, utc_now_timestamp, force_update)
+        outstanding_requesters, force_update = self.merge_general_outstanding_requesters(
+            threshold, remote_outstanding_requesters, outstanding_requesters, utc_now_timestamp, force_update)
+        outstanding_requesters, force_update = self.merge_urilist_outstanding_requesters(
+            threshold, remote_outstanding_requesters, outstanding_requesters, utc_now_timestamp, force_update)
     
         need_update = (force_update or
                     last_update_age > int(os.getenv('MAX_AGE_TO_UPDATE')) or
@@ -477,12 +441,11 @@ class LambdaLogParser(object):
         self.log.debug("[lambda_log_parser: write_output] Start")
 
         try:
-            current_data = TMP_DIR + key_name.split('/')[-1] + '_LOCAL.json'
-            with open(current_data, 'w') as outfile:
-                json.dump(outstanding_requesters, outfile)
-
-            self.s3_util.upload_file_to_s3(current_data, bucket_name, output_key_name)
-            remove(current_data)
+            body = encode_state(outstanding_requesters, self.state_format)
+            self.s3_util.put_object(bucket_name, output_key_name, body,
+                                    'application/gzip' if self.state_format == 'compact' else 'application/json')
+            self.metrics.add('S3Calls', 1)
+            self.metrics.add('StateBytes', len(body), 'Bytes')
 
         except Exception as e:
             self.log.error("[lambda_log_parser: write_output] Error to write output file")
@@ -491,61 +454,117 @@ class LambdaLogParser(object):
         self.log.debug("[lambda_log_parser: write_output] End")
 
 
+    def iter_unified_requesters(self, outstanding_requesters):
+        """
+        Yield (ip, requester) for each ip of general and uriList, once, with its highest
+        max_counter_per_min. Only the uriList ips are indexed, general is not copied.
+        """
+        urilist_requesters = {}
+        for requesters in outstanding_requesters['uriList'].values():
+            for k, v in requesters.items():
+                if k not in urilist_requesters or \
+                        v['max_counter_per_min'] > urilist_requesters[k]['max_counter_per_min']:
+                    urilist_requesters[k] = v
+
+        for k, v in outstanding_requesters['general'].items():
+            urilist_v = urilist_requesters.pop(k, None)
+            if urilist_v is not None and urilist_v['max_counter_per_min'] > v['max_counter_per_min']:
+                v = urilist_v
+            yield k, v
+        yield from urilist_requesters.items()
+
+
     def merge_lists(self, outstanding_requesters):
         self.log.debug("[lambda_log_parser: merge_lists] Start to merge general and uriList into a single list")
 
-        unified_outstanding_requesters = outstanding_requesters['general']
-        for uri in outstanding_requesters['uriList'].keys():
-            for k in outstanding_requesters['uriList'][uri].keys():
-                if (k not in unified_outstanding_requesters.keys() or
-                        outstanding_requesters['uriList'][uri][k]['max_counter_per_min'] >
-                        unified_outstanding_requesters[k]['max_counter_per_min']):
-                    unified_outstanding_requesters[k] = outstanding_requesters['uriList'][uri][k]
+        unified_outstanding_requesters = dict(self.iter_unified_requesters(outstanding_requesters))
 
         self.log.debug("[lambda_log_parser: merge_lists] End")
         return unified_outstanding_requesters
 
 
     def truncate_list(self, unified_outstanding_requesters):
+        """
+        Keep the requesters with the highest max_counter_per_min, up to the WAF ip
+        range limit. Ties go to the most recently updated, then to the first seen.
+        Accepts a dict or (ip, requester) pairs (see iter_unified_requesters); only
+        the selected requesters are held in a heap, nothing is sorted under the limit.
+        """
         self.log.debug("[lambda_log_parser: truncate_list] " +
                        "Start to truncate [if necessary] list to respect WAF ip range limit")
 
-        ip_range_limit = int(os.getenv('LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION'))
-        if len(unified_outstanding_requesters) > ip_range_limit:
-            ordered_unified_outstanding_requesters = sorted(
-                unified_outstanding_requesters.items(),
-                key=lambda kv: kv[1]['max_counter_per_min'], reverse=True)
-            unified_outstanding_requesters = {}
-            for key, value in ordered_unified_outstanding_requesters:
-                if counter < ip_range_limit:
-                    unified_outstanding_requesters[key] = value
-                    counter += 1
-                else:
-                    break
+        ip_range_limit = int(os.getenv('LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION', DEFAULT_IP_RANGE_LIMIT))
+        requesters = iter(unified_outstanding_requesters.items() if isinstance(unified_outstanding_requesters, dict)
+                          else unified_outstanding_requesters)
+        selected = list(islice(requesters, ip_range_limit))
+        first_over_limit = next(requesters, None)
+        if first_over_limit is not None:
+            selected = heapq.nlargest(
+                ip_range_limit, chain(selected, [first_over_limit], requesters),
+                key=lambda kv: (kv[1]['max_counter_per_min'], kv[1]['updated_at']))
+            self.log.info("[lambda_log_parser: truncate_list] Truncated to %d requesters" % ip_range_limit)
 
         self.log.debug("[lambda_log_parser: truncate_list] End")
-        return unified_outstanding_requesters 
+        return dict(selected)
+
+
+    def get_allowlist(self):
+        """
+        Return the addresses of the allowlist IP sets, None if they can't be read,
+        including when their IP_SET_NAME_WHITELIST*/IP_SET_ID_WHITELIST* are not set.
+        """
+        allowlist = []
+        for version in ['V4', 'V6']:
+            name = os.getenv('IP_SET_NAME_WHITELIST' + version)
+            arn = os.getenv('IP_SET_ID_WHITELIST' + version)
+            if not name or not arn:
+                self.log.warning("[lambda_log_parser: get_allowlist] IPV%s allowlist IP set not configured"
+                                 % version[1])
+                return None
+            response = self.waflib.get_ip_set_cached(self.log, self.scope, name, arn)
+            if response is None:
+                return None
+            allowlist.extend(response['IPSet']['Addresses'])
+        return allowlist
+
+
+    def aggregate_cidrs(self, unified_outstanding_requesters):
+        """
+        Fold the dense prefixes of (ip, requester) pairs, see cidr_aggregator.
+        """
+        allowlist = self.get_allowlist()
+        if allowlist is None:
+            self.log.warning("[lambda_log_parser: aggregate_cidrs] Allowlist unavailable, not aggregating")
+            return unified_outstanding_requesters
+
+        aggregator = get_cidr_aggregator(self.log, int(os.getenv('CIDR_AGGREGATION_DENSITY', DEFAULT_DENSITY)),
+                                         int(os.getenv('CIDR_AGGREGATION_PREFIX_V6', DEFAULT_PREFIX_V6)), allowlist)
+        with self.metrics.stage('Aggregate'):
+            unified_outstanding_requesters, report = aggregator.aggregate(unified_outstanding_requesters)
+        for cidr, addresses in report.items():
+            self.log.info("[lambda_log_parser: aggregate_cidrs] %s stands for %d offending addresses" % (cidr, addresses))
+        self.metrics.add('AggregatedPrefixes', len(report))
+        self.metrics.add('AggregatedIPs', sum(report.values()))
+        return unified_outstanding_requesters
 
 
     def build_ip_list_to_block(self, unified_outstanding_requesters):
         self.log.debug("[lambda_log_parser: truncate_list] Start to build list of ips to be blocked")
 
-        addresses_v4 = []
-        addresses_v6 = []
-
-        for k in unified_outstanding_requesters.keys():
-            ip_type = self.waflib.which_ip_version(self.log, k)
-            source_ip = self.waflib.set_ip_cidr(self.log, k)
-
-            if ip_type == "IPV4":
-                addresses_v4.append(source_ip)
-            elif ip_type == "IPV6":
-                addresses_v6.append(source_ip)
+        # ips get /32 or /128, prefixes from aggregate_cidrs are kept
+        addresses_v4, addresses_v6 = split_ip_set_addresses(unified_outstanding_requesters.keys(), self.log)
 
         self.log.debug("[lambda_log_parser: truncate_list] End")
         return addresses_v4, addresses_v6
  
 
+    def count_ip_set_update(self, applied, response):
+        if applied:
+            self.metrics.add('IPSetUpdateCalls', 1)
+        elif response is not None:
+            self.metrics.add('IPSetUpdatesSkipped', 1)
+
+
     def update_ip_set(self, ip_set_type, outstanding_requesters):
         self.log.info("[update_ip_set] Start")
 
@@ -580,11 +599,11 @@ class LambdaLogParser(object):
             # --------------------------------------------------------------------------------------------------------------
             self.log.info("[update_ip_set] Merge general and uriList into a single list")
             # --------------------------------------------------------------------------------------------------------------
-            unified_outstanding_requesters = self.merge_lists(outstanding_requesters)
+            unified_outstanding_requesters = self.iter_unified_requesters(outstanding_requesters)
+            if self.cidr_aggregation:
+                unified_outstanding_requesters = self.aggregate_cidrs(unified_outstanding_requesters)
 
-            # --------------------------------------------------------------------------------------------------------------
-            self.log.info("[update_ip_set] Truncate [if necessary] list to respect WAF limit")
-            # --------------------------------------------------------------------------------------------------------------
+            # Truncate [if necessary] list to respect WAF limit, as it is merged
             unified_outstanding_requesters = self.truncate_list(unified_outstanding_requesters)
 
             # --------------------------------------------------------------------------------------------------------------
@@ -592,17 +611,33 @@ class LambdaLogParser(object):
             # --------------------------------------------------------------------------------------------------------------
             addresses_v4, addresses_v6 = self.build_ip_list_to_block(unified_outstanding_requesters)
 
+            self.metrics.add('BlockedIPs', len(addresses_v4) + len(addresses_v6))
+            mutation_queue = get_ip_set_mutation_queue()
+            if mutation_queue is not None:
+                # --------------------------------------------------------------------------------------------------------------
+                self.log.info("[update_ip_set] Queue changes for the IP set mutation applier")
+                # --------------------------------------------------------------------------------------------------------------
+                with self.metrics.stage('QueueIPSetMutations'):
+                    queued = mutation_queue.send(
+                        make_intents(self.scope, ipset_name_v4, ipset_arn_v4, REPLACE, addresses_v4) +
+                        make_intents(self.scope, ipset_name_v6, ipset_arn_v6, REPLACE, addresses_v6))
+                self.metrics.add('IPSetMutationsQueued', queued)
+                self.log.info("[update_ip_set] End")
+                return counter
+
             # --------------------------------------------------------------------------------------------------------------
             self.log.info("[ update_ip_set] Commit changes in WAF IP set")
             # --------------------------------------------------------------------------------------------------------------
-            response = self.waflib.update_ip_set(self.log, self.scope, ipset_name_v4, ipset_arn_v4, addresses_v4)
-            self.log.debug("[update_ip_set] update ipsetv4 response: \n%s" % response)
-
-            # Sleep for a few seconds to mitigate AWS WAF Update API call throttling issue
-            sleep(self.delay_between_updates)
-            
-            response = self.waflib.update_ip_set(self.log, self.scope, ipset_name_v6, ipset_arn_v6, addresses_v6)
-            self.log.debug("[update_ip_set] update ipsetv6 response: \n%s" % response)
+            # v4 and v6 at the same time, rate limited (see lib.ip_set_updater). IP sets already holding
+            # the addresses are not written
+            ip_set_updater = get_ip_set_updater(self.log, self.waflib)
+            with self.metrics.stage('WAFUpdateIPSets'):
+                results = ip_set_updater.commit_all(self.scope, [(ipset_name_v4, ipset_arn_v4, addresses_v4),
+                                                                 (ipset_name_v6, ipset_arn_v6, addresses_v6)])
+            for version, (applied, response) in zip(['v4', 'v6'], results):
+                self.count_ip_set_update(applied, response)
+                self.log.debug("[update_ip_set] update ipset%s response: \n%s" % (version, response))
+            self.metrics.add('WAFThrottledCalls', ip_set_updater.throttled)
 
         except Exception as error:
             self.log.error(str(error))
@@ -612,32 +647,152 @@ class LambdaLogParser(object):
         return counter
 
 
-    def process_log_file(self, bucket_name, key_name, conf_filename, output_filename, log_type, ip_set_type):
-        self.log.debug("[lambda_log_parser: process_log_file] Start")
-       
-        # --------------------------------------------------------------------------------------------------------------
-        self.log.info("[lambda_log_parser: process_log_file] Reading input data and get outstanding requesters")
-        # --------------------------------------------------------------------------------------------------------------
-        self.config = self.s3_util.read_json_config_file_from_s3(bucket_name, conf_filename)
-        counter, outstanding_requesters = self.parse_log_file(bucket_name, key_name, log_type)
-        outstanding_requesters = self.get_outstanding_requesters(log_type, counter, outstanding_requesters)
-        outstanding_requesters, need_update = self.merge_outstanding_requesters(
-            bucket_name, key_name, log_type, output_filename, outstanding_requesters)
+    def parse_log_files(self, bucket_name, key_names, log_type, object_sizes=None):
+        """
+        Parse several log files concurrently and fold them into a single counter.
+        Return the counter and {key_name: exception} for the files that failed.
+        object_sizes ({key_name: size}, e.g. from the S3 event) spares ranged GETs
+        on files smaller than one part.
+        """
+        self.log.debug("[lambda_log_parser: parse_log_files] Start")
+
+        # Don't fork parser processes while other threads are running
+        max_workers = 1 if self.log_parser_workers > 1 else max(min(self.batch_concurrency, len(key_names)), 1)
+        counter = self.new_request_counter()
+        failures = {}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [(key_name, executor.submit(self.parse_log_file, bucket_name, key_name, log_type,
+                                                  (object_sizes or {}).get(key_name)))
+                       for key_name in key_names]
+            # Merge in record order so the result does not depend on timing
+            for key_name, future in futures:
+                try:
+                    file_counter, _ = future.result()
+                    counter.merge(file_counter)
+                except Exception as e:
+                    self.log.error("[lambda_log_parser: parse_log_files] Error to process file %s" % key_name)
+                    self.log.error(str(e))
+                    failures[key_name] = e
+
+        self.log.debug("[lambda_log_parser: parse_log_files] End")
+        return counter, failures
+
+
+    def aggregate_window_counts(self, bucket_name, key_names, output_filename, counter):
+        store = get_window_store(self.log, self.window_store, self.s3_util,
+                                 os.getenv('WINDOW_STORE_BUCKET', bucket_name), os.getenv('WINDOW_STORE_TABLE'),
+                                 int(os.getenv('WINDOW_TTL_MINUTES', WINDOW_TTL_MINUTES)))
+        if store is None:
+            return counter
+
+        try:
+            # ----------------------------------------------------------------------------------------------------------
+            self.log.info("[lambda_log_parser: aggregate_window_counts] Add counts to %s window store" % self.window_store)
+            # ----------------------------------------------------------------------------------------------------------
+            with self.metrics.stage('WindowStore'):
+                return aggregate_counter(store, output_filename, key_names, counter)
+        except Exception as e:
+            self.log.error("[lambda_log_parser: aggregate_window_counts] Error to update window store. "
+                           "Using the counts of this invocation only.")
+            self.log.error(str(e))
+            return counter
+
+
+    def add_requester_counts(self, counter, outstanding_requesters):
+        if not self.metrics.enabled:
+            return
+        self.metrics.add('UniqueIPs', len(set().union(*counter.general.values())))
+        offenders = set(outstanding_requesters['general'])
+        for requesters in outstanding_requesters['uriList'].values():
+            offenders.update(requesters)
+        self.metrics.add('Offenders', len(offenders))
+
+
+    def update_outstanding_requesters(self, bucket_name, key_name, log_type, output_filename,
+                                      ip_set_type, counter, outstanding_requesters):
+        with self.metrics.stage('Threshold'):
+            outstanding_requesters = self.get_outstanding_requesters(log_type, counter, outstanding_requesters)
+        self.add_requester_counts(counter, outstanding_requesters)
+        with self.metrics.stage('Merge'):
+            outstanding_requesters, need_update = self.merge_outstanding_requesters(
+                bucket_name, key_name, log_type, output_filename, outstanding_requesters)
 
         if need_update:
             # ----------------------------------------------------------------------------------------------------------
             self.log.info("[process_log_file] Update new blocked requesters list to S3")
             # ----------------------------------------------------------------------------------------------------------
-            self.write_output(bucket_name, key_name, output_filename, outstanding_requesters)
+            with self.metrics.stage('StateWrite'):
+                self.write_output(bucket_name, key_name, output_filename, outstanding_requesters)
 
             # ----------------------------------------------------------------------------------------------------------
             self.log.info("[process_log_file] Update WAF IP Set")
             # ----------------------------------------------------------------------------------------------------------
-            self.update_ip_set(ip_set_type, outstanding_requesters)
+            with self.metrics.stage('WAFUpdate'):
+                self.update_ip_set(ip_set_type, outstanding_requesters)
 
         else:
             # ----------------------------------------------------------------------------------------------------------
             self.log.info("[process_log_file] No changes identified")
             # ----------------------------------------------------------------------------------------------------------
 
-        self.log.debug('[process_log_file] End')
\ No newline at end of file
+
+    def process_log_file(self, bucket_name, key_name, conf_filename, output_filename, log_type, ip_set_type,
+                         object_size=None):
+        self.log.debug("[lambda_log_parser: process_log_file] Start")
+       
+        # --------------------------------------------------------------------------------------------------------------
+        self.log.info("[lambda_log_parser: process_log_file] Reading input data and get outstanding requesters")
+        # --------------------------------------------------------------------------------------------------------------
+        self.metrics.set_dimension('LogType', log_type)
+        self.metrics.set_property('KeyName', key_name)
+        try:
+            with self.metrics.stage('ConfigRead'):
+                self.load_config(bucket_name, conf_filename)
+            self.metrics.add('S3Calls', 1)
+            counter, outstanding_requesters = self.parse_log_file(bucket_name, key_name, log_type, object_size)
+            counter = self.aggregate_window_counts(bucket_name, [key_name], output_filename, counter)
+            self.update_outstanding_requesters(bucket_name, key_name, log_type, output_filename,
+                                               ip_set_type, counter, outstanding_requesters)
+        finally:
+            self.metrics.flush()
+
+        self.log.debug('[process_log_file] End')
+
+
+    def process_log_files(self, bucket_name, key_names, conf_filename, output_filename, log_type, ip_set_type,
+                          object_sizes=None):
+        """
+        Batch version of process_log_file: the log files are parsed concurrently and
+        folded together, then the state file is merged and written and the IP sets
+        are updated once for all of them. Return {key_name: exception} for the files
+        that could not be parsed; they are left out of the update.
+        """
+        self.log.debug("[lambda_log_parser: process_log_files] Start")
+
+        # --------------------------------------------------------------------------------------------------------------
+        self.log.info("[lambda_log_parser: process_log_files] Reading %d files and get outstanding requesters"
+                      % len(key_names))
+        # --------------------------------------------------------------------------------------------------------------
+        self.metrics.set_dimension('LogType', log_type)
+        try:
+            with self.metrics.stage('ConfigRead'):
+                self.load_config(bucket_name, conf_filename)
+            self.metrics.add('S3Calls', 1)
+            counter, failures = self.parse_log_files(bucket_name, key_names, log_type, object_sizes)
+            self.metrics.add('Files', len(key_names))
+            self.metrics.add('FailedFiles', len(failures))
+            if len(failures) < len(key_names):
+                counter = self.aggregate_window_counts(
+                    bucket_name, [key_name for key_name in key_names if key_name not in failures],
+                    output_filename, counter)
+                outstanding_requesters = {
+                    'general': {},
+                    'uriList': {}
+                }
+                self.update_outstanding_requesters(bucket_name, key_names[0], log_type, output_filename,
+                                                   ip_set_type, counter, outstanding_requesters)
+        finally:
+            self.metrics.flush()
+
+        self.log.debug('[lambda_log_parser: process_log_files] End')
+        return failures
@@ -0,0 +1,182 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from operator import itemgetter
+from urllib.parse import urlparse
+
+from waf_log_decoder import URI_NEEDS_URLPARSE, get_uri_path
+
+# Access log formats parsed by the lambda log parser, by log type. Fields are
+# positions after splitting on the delimiter; fields in quotes (quote_char) count
+# as one and fields before quoted_fields_from never contain quotes. Field names:
+#   timestamp (ISO 8601) or date and time: the request minute
+#   source_ip, or source_ip_port (ip:port)
+#   uri (path or url), or request ("<method> <url> <protocol>")
+#   code (optional): status code, compared with the errorCodes of the config
+# A new format only needs a new entry.
+
+# CloudFront Access Logs
+# http://docs.aws.amazon.com/AmazonCloudFront/latest/DeveloperGuide/AccessLogs.html#BasicDistributionFileFormat
+CLOUDFRONT_LOG_FORMAT = {
+    'delimiter': '\t',
+    'fields': {'date': 0, 'time': 1, 'source_ip': 4, 'uri': 7, 'code': 8}
+}
+
+# ALB Access Logs
+# http://docs.aws.amazon.com/elasticloadbalancing/latest/application/load-balancer-access-logs.html
+ALB_LOG_FORMAT = {
+    'delimiter': ' ',
+    'quote_char': '"',
+    'escape_char': '\\',
+    'quoted_fields_from': 12,
+    # GitHub issue #44. Changed from elb_status_code to target_status_code.
+    'fields': {'timestamp': 1, 'source_ip_port': 3, 'code': 9, 'request': 12}
+}
+
+LOG_FORMATS = {
+    'alb': ALB_LOG_FORMAT,
+    'cloudfront': CLOUDFRONT_LOG_FORMAT
+}
+
+
+def get_request_url(request):
+    parts = request.split(' ', 2)
+    return parts[1] if len(parts) > 1 else ''
+
+
+def get_url_path(url):
+    """
+    Return the same value as urlparse(url).path, skipping the parse for plain
+    http(s) urls and paths.
+    """
+    if url[:7] == 'http://':
+        netloc_start = 7
+    elif url[:8] == 'https://':
+        netloc_start = 8
+    else:
+        return get_uri_path(url)
+
+    path_start = url.find('/', netloc_start)
+    if path_start < 0 or URI_NEEDS_URLPARSE.search(url) is not None:
+        return urlparse(url).path
+    return url[path_start:]
+
+
+def split_quoted(line, delimiter, count, quote_char, escape_char=None):
+    """
+    Return the first count fields of line, a field in quotes being a single field
+    without its quotes.
+    """
+    fields = []
+    pos = 0
+    while len(fields) < count:
+        if line.startswith(quote_char, pos):
+            end = line.find(quote_char, pos + 1)
+            while end > 0 and escape_char and line[end - 1] == escape_char:
+                end = line.find(quote_char, end + 1)
+            if end < 0:
+                raise ValueError("Quoted field not terminated: %s" % line[pos:])
+            fields.append(line[pos + 1:end])
+            pos = end + 1 + len(delimiter)
+        else:
+            end = line.find(delimiter, pos)
+            if end < 0:
+                fields.append(line[pos:])
+                break
+            fields.append(line[pos:end])
+            pos = end + len(delimiter)
+    return fields
+
+
+def compile_tokenizer(log_format, indexes):
+    """
+    Return a function returning the fields of a line at indexes (a tuple), that
+    stops splitting after the highest of them.
+    """
+    delimiter = log_format['delimiter']
+    max_index = max(indexes)
+    get_fields = itemgetter(*indexes) if len(indexes) > 1 else lambda fields: (fields[indexes[0]],)
+    quote_char = log_format.get('quote_char')
+    quoted_fields_from = log_format.get('quoted_fields_from', 0)
+
+    if not quote_char or max_index < quoted_fields_from:
+        def tokenize(line):
+            return get_fields(line.split(delimiter, max_index + 1))
+        return tokenize
+
+    escape_char = log_format.get('escape_char')
+    count = max_index + 1 - quoted_fields_from
+
+    if count == 1:
+        # Only the first field that may be quoted: find its end without walking the line
+        closing = quote_char + delimiter
+
+        def tokenize_one_quoted(line):
+            fields = line.split(delimiter, quoted_fields_from)
+            rest = fields[-1]
+            if rest[:1] != quote_char:
+                fields[-1] = rest.split(delimiter, 1)[0]
+                return get_fields(fields)
+            end = rest.find(closing, 1)
+            if end < 0 and rest[-1:] == quote_char and len(rest) > 1:
+                end = len(rest) - 1
+            if end < 0 or (escape_char and rest[end - 1] == escape_char):
+                fields[-1:] = split_quoted(rest, delimiter, 1, quote_char, escape_char)
+            else:
+                fields[-1] = rest[1:end]
+            return get_fields(fields)
+        return tokenize_one_quoted
+
+    def tokenize_quoted(line):
+        fields = line.split(delimiter, quoted_fields_from)
+        fields[quoted_fields_from:] = split_quoted(fields[-1], delimiter, count, quote_char, escape_char)
+        return get_fields(fields)
+    return tokenize_quoted
+
+
+def compile_log_format(log_format):
+    """
+    Return a function reading a decoded log line into (minute string, source ip,
+    uri path, status code or None) for the format descriptor log_format.
+    """
+    fields = log_format['fields']
+    names = tuple(fields)
+    tokenize = compile_tokenizer(log_format, tuple(fields[name] for name in names))
+    positions = {name: position for position, name in enumerate(names)}
+    code = positions.get('code')
+
+    if 'timestamp' in positions:
+        timestamp = positions['timestamp']
+
+        def get_minute_str(values):
+            return values[timestamp].rsplit(':', 1)[0]
+    else:
+        date, time = positions['date'], positions['time']
+
+        def get_minute_str(values):
+            return values[date] + ' ' + values[time][:-3]
+
+    if 'source_ip_port' in positions:
+        source_ip_port = positions['source_ip_port']
+
+        def get_source_ip(values):
+            return values[source_ip_port].rsplit(':', 1)[0]
+    else:
+        get_source_ip = itemgetter(positions['source_ip'])
+
+    if 'request' in positions:
+        request = positions['request']
+
+        def get_uri(values):
+            return get_url_path(get_request_url(values[request]))
+    else:
+        uri = positions['uri']
+
+        def get_uri(values):
+            return get_url_path(values[uri])
+
+    def read_line(line):
+        values = tokenize(line)
+        return get_minute_str(values), get_source_ip(values), get_uri(values), \
+            values[code] if code is not None else None
+    return read_line
@@ -6,7 +6,7 @@ from os import environ
 from urllib.parse import unquote_plus
 from lib.waflibv2 import WAFLIBv2
 from lib.solution_metrics import send_metrics
-from lib.cw_metrics_util import WAFCloudWatchMetrics
+from lib.cw_metrics_util import UsageReportTimer, WAFCloudWatchMetrics
 from lambda_log_parser import LambdaLogParser
 from athena_log_parser import AthenaLogParser
 from aws_lambda_powertools import Logger
@@ -19,6 +19,7 @@ scope = os.getenv('SCOPE')
 scanners = 1
 flood = 2
 CW_METRIC_PERIOD_SECONDS = 300    # 5 minutes in seconds
+usage_report_timer = UsageReportTimer(CW_METRIC_PERIOD_SECONDS)
 
 
 def initialize_usage_data():
@@ -38,10 +39,14 @@ def initialize_usage_data():
     return usage_data
 
 
-def get_log_parser_usage_data(log, waf_rule, cw, ipv4_set_id, ipv6_set_id,
+def get_log_parser_usage_data(log, waf_rule, ipv4_set_id, ipv6_set_id,
                               ipset_name_v4, ipset_arn_v4, ipset_name_v6,
                               ipset_arn_v6, usage_data, usage_data_ip_set_field,
                               usage_data_blocked_request_field):
+    """
+    Add the IP set size of waf_rule to usage_data, return the CloudWatch metrics of
+    the rule to add to it (see WAFCloudWatchMetrics.add_waf_cw_metrics_to_usage_data).
+    """
     log.info("[get_log_parser_usage_data] Get %s data", waf_rule)
 
     if ipv4_set_id in environ or ipv6_set_id in environ:
@@ -51,16 +56,9 @@ def get_log_parser_usage_data(log, waf_rule, cw, ipv4_set_id, ipv6_set_id,
         ipv6_count = waflib.get_ip_address_count(log, scope, ipset_name_v6, ipset_arn_v6)
         usage_data[usage_data_ip_set_field] = str(ipv4_count + ipv6_count)
 
-        # Get the count of blocked requests for the bad bot rule from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            os.getenv('METRIC_NAME_PREFIX') + waf_rule,
-            usage_data,
-            usage_data_blocked_request_field,
-            0
-        )
-    return usage_data
+        # The count of blocked requests for the rule
+        return [('BlockedRequests', os.getenv('METRIC_NAME_PREFIX') + waf_rule, usage_data_blocked_request_field, 0)]
+    return []
 
 
 def send_anonymized_usage_data(log):
@@ -68,34 +66,26 @@ def send_anonymized_usage_data(log):
         if 'SEND_ANONYMIZED_USAGE_DATA' not in environ or os.getenv('SEND_ANONYMIZED_USAGE_DATA').lower() != 'yes':
             return
 
+        # At most one report per metric period per container, not one per log file
+        if not usage_report_timer.due():
+            log.info("[send_anonymized_usage_data] Usage data sent less than %d seconds ago"
+                     % CW_METRIC_PERIOD_SECONDS)
+            return
+
         log.info("[send_anonymized_usage_data] Start")
 
         cw = WAFCloudWatchMetrics(log)
         usage_data = initialize_usage_data()
 
-        # Get the count of allowed requests for all the waf rules from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'AllowedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            'ALL',
-            usage_data,
-            'allowed_requests',
-            0
-        )
-
-        # Get the count of blocked requests for all the waf rules from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            'ALL',
-            usage_data,
-            'blocked_requests_all',
-            0
-        )
+        # The count of allowed and blocked requests for all the waf rules
+        metrics = [
+            ('AllowedRequests', 'ALL', 'allowed_requests', 0),
+            ('BlockedRequests', 'ALL', 'blocked_requests_all', 0)
+        ]
 
         # Get scanners probes rule specific usage data
-        get_log_parser_usage_data(
-            log, 'ScannersProbesRule', cw,
+        metrics += get_log_parser_usage_data(
+            log, 'ScannersProbesRule',
             'IP_SET_ID_SCANNERS_PROBESV4', 
             'IP_SET_ID_SCANNERS_PROBESV6',
             os.getenv('IP_SET_NAME_SCANNERS_PROBESV4'), 
@@ -107,8 +97,8 @@ def send_anonymized_usage_data(log):
         )
 
         # Get HTTP flood rule specific usage data
-        get_log_parser_usage_data(
-            log, 'HttpFloodRegularRule', cw,
+        metrics += get_log_parser_usage_data(
+            log, 'HttpFloodRegularRule',
             'IP_SET_ID_HTTP_FLOODV4', 
             'IP_SET_ID_HTTP_FLOODV6',
             os.getenv('IP_SET_NAME_HTTP_FLOODV4'), 
@@ -119,25 +109,14 @@ def send_anonymized_usage_data(log):
             'blocked_requests_http_flood'
         )
 
-        # Get the count of allowed requests for the web acl from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'AllowedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            os.getenv('METRIC_NAME_PREFIX') + 'WAFWebACL',
-            usage_data,
-            'allowed_requests_WAFWebACL',
-            0
-        )
+        # The count of allowed and blocked requests for the web acl
+        metrics += [
+            ('AllowedRequests', os.getenv('METRIC_NAME_PREFIX') + 'WAFWebACL', 'allowed_requests_WAFWebACL', 0),
+            ('BlockedRequests', os.getenv('METRIC_NAME_PREFIX') + 'WAFWebACL', 'blocked_requests_WAFWebACL', 0)
+        ]
 
-        # Get the count of allowed requests for the web acl from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            os.getenv('METRIC_NAME_PREFIX') + 'WAFWebACL',
-            usage_data,
-            'blocked_requests_WAFWebACL',
-            0
-        )
+        # Get all of them from cloudwatch metrics with one request
+        usage_data = cw.add_waf_cw_metrics_to_usage_data(metrics, CW_METRIC_PERIOD_SECONDS, usage_data)
 
         # Send usage data
         log.info('[send_anonymized_usage_data] Send usage data: \n{}'.format(usage_data))
@@ -172,8 +151,12 @@ def lambda_handler(event, _):
 
         elif 'Records' in event:
             lambda_log_parser = LambdaLogParser(logger)
-            for record in event['Records']:
-                process_record(record, logger, result, athena_log_parser, lambda_log_parser)
+            if os.getenv('BATCH_RECORDS', 'no').lower() == 'yes':
+                process_records_in_batch(event['Records'], logger, result, athena_log_parser, lambda_log_parser)
+                send_anonymized_usage_data(logger)
+            else:
+                for record in event['Records']:
+                    process_record(record, logger, result, athena_log_parser, lambda_log_parser)
                 send_anonymized_usage_data(logger)
 
         else:
@@ -202,7 +185,8 @@ def process_record(r, log, result, athena_log_parser, lambda_log_parser):
             conf_filename = os.getenv('STACK_NAME') + '-app_log_conf.json'
             output_filename = os.getenv('STACK_NAME') + '-app_log_out.json'
             log_type = os.getenv('LOG_TYPE')
-            lambda_log_parser.process_log_file(bucket_name, key_name, conf_filename, output_filename, log_type, scanners)
+            lambda_log_parser.process_log_file(bucket_name, key_name, conf_filename, output_filename, log_type, scanners,
+                                               r['s3']['object'].get('size'))
             result['message'] = "[lambda_handler] App access log file processed."
             log.info(result['message'])
 
@@ -216,10 +200,79 @@ def process_record(r, log, result, athena_log_parser, lambda_log_parser):
             conf_filename = os.getenv('STACK_NAME') + '-waf_log_conf.json'
             output_filename = os.getenv('STACK_NAME') + '-waf_log_out.json'
             log_type = 'waf'
-            lambda_log_parser.process_log_file(bucket_name, key_name, conf_filename, output_filename, log_type, flood)
+            lambda_log_parser.process_log_file(bucket_name, key_name, conf_filename, output_filename, log_type, flood,
+                                               r['s3']['object'].get('size'))
             result['message'] = "[lambda_handler] AWS WAF access log file processed."
             log.info(result['message'])
 
     else:
         result['message'] = "[lambda_handler] undefined handler for bucket %s" % bucket_name
         log.info(result['message'])
+
+
+def get_log_file_target(bucket_name, key_name):
+    """
+    Return (conf_filename, output_filename, log_type, ip_set_type, message) for a
+    record of a log file processed by the lambda log parser, None otherwise.
+    """
+    if key_name.startswith('athena_results/'):
+        return None
+
+    if 'APP_ACCESS_LOG_BUCKET' in environ and bucket_name == os.getenv('APP_ACCESS_LOG_BUCKET'):
+        return (os.getenv('STACK_NAME') + '-app_log_conf.json', os.getenv('STACK_NAME') + '-app_log_out.json',
+                os.getenv('LOG_TYPE'), scanners, "[lambda_handler] App access log file processed.")
+
+    elif 'WAF_ACCESS_LOG_BUCKET' in environ and bucket_name == os.getenv('WAF_ACCESS_LOG_BUCKET'):
+        return (os.getenv('STACK_NAME') + '-waf_log_conf.json', os.getenv('STACK_NAME') + '-waf_log_out.json',
+                'waf', flood, "[lambda_handler] AWS WAF access log file processed.")
+
+    return None
+
+
+def process_records_in_batch(records, log, result, athena_log_parser, lambda_log_parser):
+    """
+    Process the log files of all records with one state merge and one IP set update
+    per target, instead of one per record. Athena query results and records of other
+    buckets are processed one by one as usual. Log files that failed are listed in
+    result['failed_records'], the invocation only fails if none could be processed.
+    """
+    log_files = {}
+    object_sizes = {}
+    for r in records:
+        bucket_name = r['s3']['bucket']['name']
+        key_name = unquote_plus(r['s3']['object']['key'])
+        target = get_log_file_target(bucket_name, key_name)
+        if target is None:
+            process_record(r, log, result, athena_log_parser, lambda_log_parser)
+        else:
+            # S3 may notify the same object more than once
+            key_names = log_files.setdefault((bucket_name,) + target, [])
+            if key_name not in key_names:
+                key_names.append(key_name)
+            if 'size' in r['s3']['object']:
+                object_sizes[(bucket_name, key_name)] = r['s3']['object']['size']
+
+    failed_records = []
+    errors = []
+    num_log_files = 0
+    for target, key_names in log_files.items():
+        bucket_name, conf_filename, output_filename, log_type, ip_set_type, message = target
+        failures = lambda_log_parser.process_log_files(
+            bucket_name, key_names, conf_filename, output_filename, log_type, ip_set_type,
+            {key_name: object_sizes[(bucket_name, key_name)] for key_name in key_names
+             if (bucket_name, key_name) in object_sizes})
+        num_log_files += len(key_names)
+        for key_name in key_names:
+            if key_name in failures:
+                failed_records.append({'bucket': bucket_name, 'key': key_name, 'error': str(failures[key_name])})
+                errors.append(failures[key_name])
+
+        if len(failures) < len(key_names):
+            result['message'] = message
+            log.info(result['message'])
+
+    if len(failed_records) > 0:
+        log.error("[process_records_in_batch] %d of %d log files failed" % (len(failed_records), num_log_files))
+        if len(failed_records) == num_log_files:
+            raise errors[0]
+        result['failed_records'] = failed_records
@@ -0,0 +1,142 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import multiprocessing
+import os
+from collections import deque
+from itertools import islice
+
+LINE_BLOCK_SIZE = 20000     # lines sent to a worker at a time
+WORKER_JOIN_TIMEOUT = 5     # seconds
+
+
+def get_worker_count(value):
+    """
+    Return the number of parser processes for LOG_PARSER_WORKERS: a number, or auto
+    to use one per available CPU.
+    """
+    if str(value).lower() == 'auto':
+        return os.cpu_count() or 1
+    return max(int(value), 1)
+
+
+def iter_line_blocks(lines, block_size=LINE_BLOCK_SIZE):
+    lines = iter(lines)
+    while True:
+        block = list(islice(lines, block_size))
+        if not block:
+            return
+        yield block
+
+
+def parse_blocks(conn, parser, log_type, max_errors):
+    """
+    Worker loop: receive blocks of lines, answer with (partial counter, errors)
+    until None is received.
+    """
+    ip_keys = {}
+    outstanding_requesters = {'general': {}, 'uriList': {}}
+    while True:
+        lines = conn.recv()
+        if lines is None:
+            break
+
+        counter = parser.new_request_counter()
+        counter.ip_keys = ip_keys
+        errors = []
+        for line in lines:
+            try:
+                parser.read_contents(line, log_type, outstanding_requesters, counter)
+            except Exception as e:
+                errors.append((line, e))
+                if len(errors) == max_errors:
+                    # The parent stops at this point anyway
+                    break
+
+        try:
+            conn.send((counter, errors))
+        except Exception:
+            # Exception that can't be pickled
+            conn.send((counter, [(line, Exception(str(e))) for line, e in errors]))
+    conn.close()
+
+
+class ParallelLogReader(object):
+    """
+    Parse log lines with several processes and return a single RequestCounter.
+
+    Blocks of lines are handed out to the workers in turn and their partial
+    counters are merged in block order, so the result does not depend on timing.
+    The error budget applies to the whole file: errors are counted by the parent
+    in line order and the exception of the max_errors-th one is raised.
+
+    Workers are forked and talk to the parent over pipes only, as AWS Lambda does
+    not provide /dev/shm (needed by multiprocessing queues, pools and locks).
+    """
+
+    def __init__(self, parser, log_type, workers, max_errors, block_size=LINE_BLOCK_SIZE):
+        self.parser = parser
+        self.log = parser.log
+        self.log_type = log_type
+        self.workers = workers
+        self.max_errors = max_errors
+        self.block_size = block_size
+
+    def start_workers(self):
+        context = multiprocessing.get_context('fork')
+        workers = []
+        for _ in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            process = context.Process(target=parse_blocks,
+                                      args=(child_conn, self.parser, self.log_type, self.max_errors),
+                                      daemon=True)
+            process.start()
+            child_conn.close()
+            workers.append((process, parent_conn))
+        return workers
+
+    def stop_workers(self, workers):
+        for process, conn in workers:
+            try:
+                conn.send(None)
+            except (OSError, ValueError):
+                pass
+        for process, conn in workers:
+            process.join(WORKER_JOIN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+            conn.close()
+
+    def read(self, lines, error_count):
+        counter = self.parser.new_request_counter()
+        blocks = iter_line_blocks(lines, self.block_size)
+        workers = self.start_workers()
+        try:
+            # One block in flight per worker, so neither side can block on a full pipe
+            pending = deque()
+            for process, conn in workers:
+                block = next(blocks, None)
+                if block is None:
+                    break
+                conn.send(block)
+                pending.append(conn)
+
+            while pending:
+                conn = pending.popleft()
+                # Read the next block while the workers are busy
+                block = next(blocks, None)
+                partial_counter, errors = conn.recv()
+                counter.merge(partial_counter)
+                for line, e in errors:
+                    error_count += 1
+                    self.log.error("[lambda_log_parser: get_outstanding_requesters] Error to process line: %s" % line)
+                    self.log.error(str(e))
+                    if error_count == self.max_errors:
+                        raise e
+                if block is not None:
+                    conn.send(block)
+                    pending.append(conn)
+        finally:
+            self.stop_workers(workers)
+
+        return counter
@@ -0,0 +1,153 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+from lib.ip_util import format_address, parse_address
+from uri_matcher import UriMatcher
+
+# IPv6 keys carry this bit so they never collide with IPv4 keys (which are < 2**32)
+IPV6_KEY_FLAG = 1 << 128
+INVALID_IP_KEY = -1
+
+
+def parse_ip_key(ip):
+    """
+    Return the integer key of an IP address string, or INVALID_IP_KEY if it can't be parsed.
+    """
+    parsed = parse_address(ip)
+    if parsed is None:
+        return INVALID_IP_KEY
+    return parsed[1] | IPV6_KEY_FLAG if parsed[0] == 6 else parsed[1]
+
+
+def get_ip_key_version(ip_key):
+    return 6 if ip_key & IPV6_KEY_FLAG else 4
+
+
+def format_ip_key(ip_key):
+    if ip_key & IPV6_KEY_FLAG:
+        return format_address(6, ip_key ^ IPV6_KEY_FLAG)
+    return format_address(4, ip_key)
+
+
+class RequestCounter(object):
+    """
+    Number of requests per (minute, source ip), for all requests (general) and for
+    each uriList pattern (see UriMatcher) a request matches.
+
+    Minutes are epoch minutes, source ips are integer keys (see parse_ip_key) and
+    uriList patterns are interned to small ids, so counting a request allocates
+    nothing once its ip and uri have been seen.
+    """
+
+    def __init__(self, uri_list=(), uri_matcher=None):
+        self.uris = list(uri_list)
+        self.uri_ids = {uri: uri_id for uri_id, uri in enumerate(self.uris)}
+        self.uri_matcher = uri_matcher if uri_matcher is not None else UriMatcher(self.uris)
+        self.general = {}                                   # minute -> {ip_key: count}
+        self.uri_list = [{} for _ in self.uris]             # uri id -> minute -> {ip_key: count}
+        self.ip_keys = {}                                   # ip string -> ip key
+        self.invalid_ips = 0
+        self.current_minute = None
+        self.current_counts = None
+
+    def __getstate__(self):
+        # The ip cache is only useful to the process that fills the counter
+        state = self.__dict__.copy()
+        state['ip_keys'] = {}
+        state['current_minute'] = None
+        state['current_counts'] = None
+        return state
+
+    def get_ip_key(self, ip):
+        ip_key = self.ip_keys.get(ip)
+        if ip_key is None:
+            ip_key = parse_ip_key(ip)
+            self.ip_keys[ip] = ip_key
+        return ip_key
+
+    def add(self, minute, ip, uri):
+        ip_key = self.ip_keys.get(ip)
+        if ip_key is None:
+            ip_key = self.get_ip_key(ip)
+        if ip_key == INVALID_IP_KEY:
+            self.invalid_ips += 1
+            return
+
+        # Log files are mostly sorted by time, so the current minute is almost always a hit
+        if minute == self.current_minute:
+            counts = self.current_counts
+        else:
+            counts = self.general.get(minute)
+            if counts is None:
+                counts = self.general[minute] = {}
+            self.current_minute = minute
+            self.current_counts = counts
+        counts[ip_key] = counts.get(ip_key, 0) + 1
+
+        uri_ids = self.uri_matcher.cache.get(uri)
+        if uri_ids is None:
+            uri_ids = self.uri_matcher.match(uri)
+        for uri_id in uri_ids:
+            minute_counts = self.uri_list[uri_id]
+            counts = minute_counts.get(minute)
+            if counts is None:
+                counts = minute_counts[minute] = {}
+            counts[ip_key] = counts.get(ip_key, 0) + 1
+
+    def add_requests(self, minute, ip, uri, num_reqs):
+        """
+        Same as add, for num_reqs requests at once.
+        """
+        ip_key = self.get_ip_key(ip)
+        if ip_key == INVALID_IP_KEY:
+            self.invalid_ips += num_reqs
+            return
+
+        counts = self.general.setdefault(minute, {})
+        counts[ip_key] = counts.get(ip_key, 0) + num_reqs
+        for uri_id in self.uri_matcher.match(uri):
+            counts = self.uri_list[uri_id].setdefault(minute, {})
+            counts[ip_key] = counts.get(ip_key, 0) + num_reqs
+
+    def merge(self, other):
+        """
+        Add the counts of another RequestCounter built with the same uri list.
+        """
+        merge_minute_counts(self.general, other.general)
+        for minute_counts, other_minute_counts in zip(self.uri_list, other.uri_list):
+            merge_minute_counts(minute_counts, other_minute_counts)
+        self.invalid_ips += other.invalid_ips
+        self.current_minute = None
+        self.current_counts = None
+
+    def get_general_max_counts(self, threshold):
+        return get_max_counts(self.general, threshold)
+
+    def get_urilist_max_counts(self, uri, threshold):
+        uri_id = self.uri_ids.get(uri)
+        if uri_id is None:
+            return {}
+        return get_max_counts(self.uri_list[uri_id], threshold)
+
+
+def merge_minute_counts(minute_counts, other_minute_counts):
+    for minute, other_counts in other_minute_counts.items():
+        counts = minute_counts.get(minute)
+        if counts is None:
+            minute_counts[minute] = dict(other_counts)
+        else:
+            for ip_key, num_reqs in other_counts.items():
+                counts[ip_key] = counts.get(ip_key, 0) + num_reqs
+
+
+def get_max_counts(minute_counts, threshold):
+    """
+    Return {ip_key: highest number of requests in a single minute} for the ips
+    that reached threshold in at least one minute.
+    """
+    max_counts = {}
+    for counts in minute_counts.values():
+        for ip_key, num_reqs in counts.items():
+            if num_reqs >= threshold and num_reqs > max_counts.get(ip_key, 0):
+                max_counts[ip_key] = num_reqs
+    return max_counts
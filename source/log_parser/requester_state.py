@@ -0,0 +1,190 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import datetime
+import gzip
+import json
+from operator import itemgetter
+
+from request_counter import INVALID_IP_KEY, format_ip_key, parse_ip_key
+
+FORMAT_DATE_TIME = "%Y-%m-%d %H:%M:%S %Z%z"
+STATE_FORMATS = ['json', 'compact']
+COMPACT_STATE_VERSION = 1
+GZIP_MAGIC = b'\x1f\x8b'
+
+# Outstanding requesters state file, per log type.
+#
+# json (legacy): the outstanding requesters dict, updated_at as a date string
+#   {"general": {"<ip>": {"max_counter_per_min": 120, "updated_at": "2023-04-24 21:00:00 UTC+0000"}},
+#    "uriList": {"<uri>": {"<ip>": {...}}}}
+#
+# compact: gzip compressed JSON, ips as integer keys (see parse_ip_key) and
+# updated_at as epoch seconds, one [ip, max_counter_per_min, updated_at] row per ip, rows in updated_at order
+#   {"version": 1, "general": [[3232235777, 120, 1682370000]], "uriList": {"<uri>": [[...]]}}
+#
+# Both are read whatever STATE_FORMAT says, so the format can be switched either way.
+# In memory, updated_at is always epoch seconds.
+
+
+def get_state_format(log, name='json'):
+    name = (name or 'json').lower()
+    if name not in STATE_FORMATS:
+        log.warning("[requester_state: get_state_format] Unknown state format %s. Using json." % name)
+        name = 'json'
+    return name
+
+
+class TimestampCodec(object):
+    """
+    updated_at strings <-> epoch seconds, memoized: most entries of a state file
+    share the timestamp of the invocation that last updated them.
+    """
+
+    def __init__(self):
+        self.epochs = {}
+        self.strings = {}
+
+    def to_epoch(self, updated_at):
+        epoch = self.epochs.get(updated_at)
+        if epoch is None:
+            epoch = self.epochs[updated_at] = int(datetime.datetime.strptime(
+                updated_at, FORMAT_DATE_TIME).timestamp())
+        return epoch
+
+    def to_string(self, epoch):
+        updated_at = self.strings.get(epoch)
+        if updated_at is None:
+            updated_at = self.strings[epoch] = datetime.datetime.fromtimestamp(
+                epoch, datetime.timezone.utc).strftime(FORMAT_DATE_TIME)
+        return updated_at
+
+
+class RequesterGroup(dict):
+    """
+    Requesters of a group of the state (general or a uriList entry):
+    {ip: {'max_counter_per_min': n, 'updated_at': epoch seconds}}.
+
+    The dict order is the expiry index: requesters are kept in updated_at order,
+    refreshed requesters move to the end, so the expired ones are always first.
+    min_count is a lower bound of max_counter_per_min, so the requesters below a
+    threshold are only looked for when the threshold was raised above it.
+    """
+
+    def __init__(self, requesters=()):
+        super().__init__(requesters)
+        self.min_count = min((v['max_counter_per_min'] for v in self.values()), default=0)
+
+    @classmethod
+    def from_unordered(cls, requesters):
+        return cls(sorted(requesters.items(), key=lambda kv: kv[1]['updated_at']))
+
+    def refresh(self, ip, max_counter_per_min, updated_at):
+        """
+        Set the requester as seen at updated_at, which can't be before any updated_at
+        of the group, keeping the highest max_counter_per_min.
+        """
+        v = self.pop(ip, None)
+        if v is not None and v['max_counter_per_min'] > max_counter_per_min:
+            max_counter_per_min = v['max_counter_per_min']
+        self[ip] = {'max_counter_per_min': max_counter_per_min, 'updated_at': updated_at}
+        if max_counter_per_min < self.min_count:
+            self.min_count = max_counter_per_min
+
+    def pop_expired(self, cutoff):
+        """
+        Remove and return the requesters last updated at or before cutoff.
+        """
+        expired = []
+        for ip, v in self.items():
+            if v['updated_at'] > cutoff:
+                break
+            expired.append(ip)
+        for ip in expired:
+            del self[ip]
+        return expired
+
+    def pop_below(self, threshold):
+        """
+        Remove and return the requesters whose max_counter_per_min is below threshold.
+        """
+        if self.min_count >= threshold:
+            return []
+        below = [ip for ip, v in self.items() if v['max_counter_per_min'] < threshold]
+        for ip in below:
+            del self[ip]
+        self.min_count = threshold
+        return below
+
+
+def encode_rows(requesters):
+    rows = []
+    for ip, v in requesters.items():
+        ip_key = parse_ip_key(ip)
+        rows.append([ip if ip_key == INVALID_IP_KEY else ip_key, v['max_counter_per_min'], v['updated_at']])
+    # Linear for RequesterGroups, which are already in order
+    rows.sort(key=itemgetter(2))
+    return rows
+
+
+def decode_rows(rows):
+    return RequesterGroup(
+        (ip_key if isinstance(ip_key, str) else format_ip_key(ip_key),
+         {'max_counter_per_min': max_counter_per_min, 'updated_at': updated_at})
+        for ip_key, max_counter_per_min, updated_at in rows)
+
+
+def to_legacy(requesters, timestamps):
+    return {ip: {'max_counter_per_min': v['max_counter_per_min'],
+                 'updated_at': timestamps.to_string(v['updated_at'])} for ip, v in requesters.items()}
+
+
+def from_legacy(requesters, timestamps):
+    return RequesterGroup.from_unordered(
+        {ip: {'max_counter_per_min': v['max_counter_per_min'],
+              'updated_at': timestamps.to_epoch(v['updated_at'])} for ip, v in requesters.items()})
+
+
+def encode_state(outstanding_requesters, state_format='json'):
+    """
+    Return the bytes of the state file of outstanding_requesters in state_format.
+    """
+    if state_format != 'compact':
+        timestamps = TimestampCodec()
+        return json.dumps({
+            'general': to_legacy(outstanding_requesters.get('general', {}), timestamps),
+            'uriList': {uri: to_legacy(requesters, timestamps)
+                        for uri, requesters in outstanding_requesters.get('uriList', {}).items()}
+        }).encode('utf8')
+
+    state = {
+        'version': COMPACT_STATE_VERSION,
+        'general': encode_rows(outstanding_requesters.get('general', {})),
+        'uriList': {uri: encode_rows(requesters)
+                    for uri, requesters in outstanding_requesters.get('uriList', {}).items()}
+    }
+    return gzip.compress(json.dumps(state, separators=(',', ':')).encode('utf8'), compresslevel=6)
+
+
+def decode_state(data):
+    """
+    Return the outstanding requesters of a state file in any supported format, as
+    RequesterGroups.
+    """
+    if data[:2] != GZIP_MAGIC:
+        state = json.loads(data)
+        timestamps = TimestampCodec()
+        return {
+            'general': from_legacy(state.get('general', {}), timestamps),
+            'uriList': {uri: from_legacy(requesters, timestamps)
+                        for uri, requesters in state.get('uriList', {}).items()}
+        }
+
+    state = json.loads(gzip.decompress(data))
+    version = state.get('version')
+    if version != COMPACT_STATE_VERSION:
+        raise ValueError("Unsupported state file version %s" % version)
+    return {
+        'general': decode_rows(state['general']),
+        'uriList': {uri: decode_rows(rows) for uri, rows in state['uriList'].items()}
+    }
@@ -0,0 +1,120 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+GZIP_WBITS = zlib.MAX_WBITS | 16
+READ_CHUNK_SIZE = 256 * 1024                 # 256 KiB of compressed data per read
+MAX_DECOMPRESSED_BLOCK_SIZE = 256 * 1024     # 256 KiB of plain text per decompress call
+RANGE_PART_SIZE = 8 * 1024 * 1024            # 8 MiB per ranged GET
+
+
+def get_object_size(response):
+    """
+    Return the total object size from the Content-Range header of a ranged GET
+    response, e.g. 'bytes 0-8388607/123456789'.
+    """
+    content_range = response.get('ContentRange')
+    if content_range is None:
+        return response['ContentLength']
+    return int(content_range.rsplit('/', 1)[-1])
+
+
+def iter_body_chunks(body, chunk_size=READ_CHUNK_SIZE):
+    try:
+        for chunk in body.iter_chunks(chunk_size):
+            yield chunk
+    finally:
+        body.close()
+
+
+def iter_object_chunks(s3_util, bucket_name, key_name,
+                       max_concurrency=1, part_size=RANGE_PART_SIZE, object_size=None):
+    """
+    Yield the raw bytes of an S3 object in order.
+
+    With max_concurrency > 1 the object is fetched with ranged GETs. At most
+    max_concurrency parts are in flight (or buffered) at any time, which keeps
+    memory bounded to roughly max_concurrency * part_size. An object known
+    (object_size, e.g. from the S3 event) to be empty or smaller than one part
+    is fetched with a plain GET.
+    """
+    if max_concurrency <= 1 or (object_size is not None and object_size < part_size):
+        response = s3_util.get_object(bucket_name, key_name)
+        yield from iter_body_chunks(response['Body'])
+        return
+
+    # The first part tells us the object size, so no extra HEAD call is needed
+    try:
+        response = s3_util.get_object(bucket_name, key_name, (0, part_size - 1))
+    except ClientError as e:
+        # No byte to range over: an empty object
+        if e.response['Error']['Code'] != 'InvalidRange':
+            raise
+        response = s3_util.get_object(bucket_name, key_name)
+    object_size = get_object_size(response)
+    yield from iter_body_chunks(response['Body'])
+
+    ranges = [(start, min(start + part_size, object_size) - 1)
+              for start in range(part_size, object_size, part_size)]
+    if len(ranges) == 0:
+        return
+
+    def fetch_part(byte_range):
+        part = s3_util.get_object(bucket_name, key_name, byte_range)
+        return part['Body'].read()
+
+    with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        in_flight = [executor.submit(fetch_part, r) for r in ranges[:max_concurrency]]
+        next_range = max_concurrency
+        while in_flight:
+            data = in_flight.pop(0).result()
+            if next_range < len(ranges):
+                in_flight.append(executor.submit(fetch_part, ranges[next_range]))
+                next_range += 1
+            yield data
+
+
+def iter_gzip_lines(chunks, max_block_size=MAX_DECOMPRESSED_BLOCK_SIZE):
+    """
+    Decompress a stream of gzip chunks (one or more concatenated members) and
+    yield one line at a time, without the trailing new line character.
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    in_member = False
+    remainder = b''
+    for chunk in chunks:
+        data = chunk
+        while True:
+            if data:
+                in_member = True
+            block = decompressor.decompress(data, max_block_size)
+            if decompressor.eof:
+                # Start a new decompressor for the next gzip member, if any
+                data = decompressor.unused_data
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+                in_member = False
+            else:
+                data = decompressor.unconsumed_tail
+
+            if block:
+                lines = (remainder + block).split(b'\n')
+                remainder = lines.pop()
+                yield from lines
+            elif not data:
+                # Input consumed and no more output pending, wait for the next chunk
+                break
+
+    if in_member:
+        raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+    if remainder:
+        yield remainder
+
+
+def iter_log_lines(s3_util, bucket_name, key_name,
+                   max_concurrency=1, part_size=RANGE_PART_SIZE, object_size=None):
+    chunks = iter_object_chunks(s3_util, bucket_name, key_name, max_concurrency, part_size, object_size)
+    return iter_gzip_lines(chunks)
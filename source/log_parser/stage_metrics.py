@@ -0,0 +1,185 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from aws_lambda_powertools import Metrics
+
+STAGE_METRICS_NAMESPACE = 'WAFSecurityAutomations/LogParser'
+NULL_STAGE = nullcontext()
+
+
+class StdoutMetricsSink(object):
+    """
+    Write each record as one JSON line to stdout, which Lambda sends to CloudWatch
+    Logs where Embedded Metric Format records are turned into metrics, as
+    aws_lambda_powertools Metrics.flush_metrics does.
+    """
+
+    def emit(self, record):
+        sys.stdout.write(json.dumps(record, separators=(',', ':')) + '\n')
+        sys.stdout.flush()
+
+
+class ListMetricsSink(object):
+    """
+    Keep the records in memory (tests, benchmarks).
+    """
+
+    def __init__(self):
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class CountingLines(object):
+    """
+    Iterate over lines counting them and their bytes.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.line_count = 0
+        self.byte_count = 0
+
+    def __iter__(self):
+        for line in self.lines:
+            self.line_count += 1
+            self.byte_count += len(line)
+            yield line
+
+
+class CountingFile(CountingLines):
+    """
+    CountingLines for file objects, which may also be read in blocks.
+    """
+
+    def read(self, size=-1):
+        data = self.lines.read(size)
+        self.line_count += data.count(b'\n')
+        self.byte_count += len(data)
+        return data
+
+    def readline(self):
+        line = self.lines.readline()
+        self.line_count += line.endswith(b'\n')
+        self.byte_count += len(line)
+        return line
+
+
+class StageMetrics(object):
+    """
+    Durations (milliseconds) and volumes (counts, bytes) of the stages of an
+    invocation, summed until flush writes them as a single CloudWatch Embedded
+    Metric Format record, serialized by aws_lambda_powertools Metrics. Safe to use
+    from the threads parsing log files.
+    """
+
+    enabled = True
+
+    def __init__(self, namespace=STAGE_METRICS_NAMESPACE, sink=None):
+        self.namespace = namespace
+        self.sink = sink or StdoutMetricsSink()
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.values = {}            # metric name -> value
+        self.units = {}             # metric name -> unit
+        self.dimensions = {}        # dimension name -> value
+        self.properties = {}        # extra fields of the record, not metrics
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name + 'Time', (time.perf_counter() - start) * 1000.0, 'Milliseconds')
+
+    def add(self, name, value, unit='Count'):
+        with self.lock:
+            self.values[name] = self.values.get(name, 0) + value
+            self.units[name] = unit
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = str(value)
+
+    def set_property(self, name, value):
+        self.properties[name] = value
+
+    def count_lines(self, lines):
+        return CountingFile(lines) if hasattr(lines, 'read') else CountingLines(lines)
+
+    def add_line_counts(self, lines):
+        if isinstance(lines, CountingLines):
+            self.add('Lines', lines.line_count)
+            self.add('Bytes', lines.byte_count, 'Bytes')
+
+    def flush(self, timestamp=None):
+        """
+        Emit the metrics recorded since the last flush, return the record (None if
+        there were none).
+        """
+        with self.lock:
+            if not self.values:
+                return None
+            metrics = Metrics(namespace=self.namespace)
+            try:
+                for name, value in self.dimensions.items():
+                    metrics.add_dimension(name=name, value=value)
+                for name in sorted(self.values):
+                    metrics.add_metric(name=name, unit=self.units[name], value=self.values[name])
+                for name, value in self.properties.items():
+                    metrics.add_metadata(key=name, value=value)
+                metrics.set_timestamp(int((timestamp or time.time()) * 1000))
+                record = metrics.serialize_metric_set()
+            finally:
+                metrics.clear_metrics()
+            self.reset()
+        self.sink.emit(record)
+        return record
+
+
+class NullStageMetrics(object):
+    """
+    StageMetrics when disabled: nothing is measured or recorded.
+    """
+
+    enabled = False
+
+    def stage(self, name):
+        return NULL_STAGE
+
+    def add(self, name, value, unit='Count'):
+        pass
+
+    def set_dimension(self, name, value):
+        pass
+
+    def set_property(self, name, value):
+        pass
+
+    def count_lines(self, lines):
+        return lines
+
+    def add_line_counts(self, lines):
+        pass
+
+    def flush(self, timestamp=None):
+        return None
+
+
+def get_stage_metrics(log, enabled='no', namespace=STAGE_METRICS_NAMESPACE, sink=None):
+    """
+    Return StageMetrics if enabled is yes, a NullStageMetrics otherwise.
+    """
+    if (enabled or 'no').lower() != 'yes':
+        return NullStageMetrics()
+    log.info("[stage_metrics: get_stage_metrics] Emitting stage metrics to namespace %s" % namespace)
+    return StageMetrics(namespace, sink)
@@ -16,6 +16,7 @@
 import boto3
 import pytest
 from os import environ
+from botocore.exceptions import ClientError
 from moto import mock_s3, mock_glue, mock_athena, mock_wafv2
 
 
@@ -326,4 +327,60 @@ def partition_s3_alb_log_test_event_setup():
                     }
                 }]
             }
-     return event
\ No newline at end of file
+     return event
+
+class FakeWAFv2Client(object):
+    """
+    WAFv2 client keeping IP sets in memory and counting the calls per operation.
+    The next throttle calls fail with WAFLimitsExceededException.
+    """
+
+    def __init__(self, exceptions):
+        self.exceptions = exceptions
+        self.ip_sets = {}
+        self.lock_tokens = {}
+        self.calls = {}
+        self.throttle = 0
+
+    def count(self, operation):
+        self.calls[operation] = self.calls.get(operation, 0) + 1
+        if self.throttle > 0:
+            self.throttle -= 1
+            raise ClientError({'Error': {'Code': 'WAFLimitsExceededException', 'Message': 'Rate exceeded'}},
+                              operation)
+
+    def put_ip_set(self, Id, Name, Addresses, Description=None):
+        """
+        Write an IP set like another client would, changing its lock token.
+        """
+        self.ip_sets[Id] = {'Name': Name, 'Id': Id, 'Description': Description or Name, 'Addresses': list(Addresses)}
+        self.lock_tokens[Id] = self.lock_tokens.get(Id, 0) + 1
+        return 'token-%d' % self.lock_tokens[Id]
+
+    def get_ip_set(self, Scope, Name, Id):
+        self.count('get_ip_set')
+        ip_set = self.ip_sets.setdefault(Id, {'Name': Name, 'Id': Id, 'Description': Name, 'Addresses': []})
+        return {'IPSet': dict(ip_set), 'LockToken': 'token-%d' % self.lock_tokens.get(Id, 0)}
+
+    def update_ip_set(self, Scope, Name, Id, Addresses, LockToken, Description=None):
+        self.count('update_ip_set')
+        if LockToken != 'token-%d' % self.lock_tokens.get(Id, 0):
+            raise ClientError({'Error': {'Code': 'WAFOptimisticLockException', 'Message': 'Stale lock token'}},
+                              'update_ip_set')
+        return {'NextLockToken': self.put_ip_set(Id, Name, Addresses, Description)}
+
+
+@pytest.fixture(scope='function', autouse=True)
+def ip_set_snapshots(mocker):
+    import lib.waflibv2
+    snapshots = lib.waflibv2.IPSetSnapshotCache()
+    mocker.patch.object(lib.waflibv2, 'ip_set_snapshots', snapshots)
+    return snapshots
+
+
+@pytest.fixture(scope='function')
+def wafv2_client(mocker):
+    import lib.waflibv2
+    client = FakeWAFv2Client(lib.waflibv2.client.exceptions)
+    mocker.patch.object(lib.waflibv2, 'client', client)
+    return client
@@ -0,0 +1,88 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+
+from cidr_aggregator import CidrAggregator, IntervalSet, get_cidr_aggregator
+from lambda_log_parser import LambdaLogParser
+
+log = logging.getLogger('test_cidr_aggregator')
+
+
+def make_requesters(ips, max_counter_per_min=100):
+    return [(ip, {'max_counter_per_min': max_counter_per_min + i, 'updated_at': 1682370000 + i})
+            for i, ip in enumerate(ips)]
+
+
+def test_interval_set():
+    intervals = IntervalSet([(20, 30), (0, 9), (10, 12), (50, 60)])
+    assert len(intervals) == 3
+    assert intervals.overlaps(12, 15)
+    assert intervals.overlaps(40, 55)
+    assert intervals.overlaps(25, 25)
+    assert not intervals.overlaps(13, 19)
+    assert not intervals.overlaps(61, 100)
+
+
+def test_dense_prefixes_are_aggregated():
+    aggregator = CidrAggregator(density=3)
+    requesters = make_requesters(['10.0.1.%d' % i for i in range(1, 5)] + ['10.0.2.1', '10.0.2.2', 'x.0.0.0'])
+    aggregated, report = aggregator.aggregate(requesters)
+
+    assert report == {'10.0.1.0/24': 4}
+    assert dict(aggregated)['10.0.1.0/24'] == {
+        'max_counter_per_min': 103, 'updated_at': 1682370003, 'addresses': 4}
+    assert sorted(ip for ip, _ in aggregated) == ['10.0.1.0/24', '10.0.2.1', '10.0.2.2', 'x.0.0.0']
+
+
+def test_allowlisted_prefixes_are_never_covered():
+    aggregator = CidrAggregator(density=2, allowlist=['10.0.1.128/25', '2001:db8:0:1::1/128'])
+    ips = ['10.0.1.1', '10.0.1.2', '10.0.3.1', '10.0.3.2', '2001:db8:0:1::10', '2001:db8:0:1::11',
+           '2001:db8:0:2::10', '2001:db8:0:2::11']
+    aggregated, report = aggregator.aggregate(make_requesters(ips))
+    assert report == {'10.0.3.0/24': 2, '2001:db8:0:2::/64': 2}
+    assert {'10.0.1.1', '10.0.1.2', '2001:db8:0:1::10', '2001:db8:0:1::11'} < set(ip for ip, _ in aggregated)
+
+
+def test_ipv6_prefix():
+    aggregator = get_cidr_aggregator(log, density=2, prefix_v6=48)
+    _, report = aggregator.aggregate(make_requesters(['2001:db8:0:1::10', '2001:db8:0:2::10']))
+    assert report == {'2001:db8::/48': 2}
+    assert get_cidr_aggregator(log, prefix_v6=56).prefixes[6] == 64
+
+
+def test_update_ip_set_blocks_aggregated_prefixes(monkeypatch, mocker):
+    monkeypatch.setenv('CIDR_AGGREGATION', 'yes')
+    monkeypatch.setenv('CIDR_AGGREGATION_DENSITY', '2')
+    monkeypatch.setenv('IP_SET_NAME_WHITELISTV4', 'allowlist')
+    monkeypatch.setenv('IP_SET_ID_WHITELISTV4', 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/allowlist/id')
+    monkeypatch.setenv('IP_SET_NAME_WHITELISTV6', 'allowlist-v6')
+    monkeypatch.setenv('IP_SET_ID_WHITELISTV6', 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/allowlist-v6/id')
+    monkeypatch.setenv('IP_SET_ID_HTTP_FLOODV4', 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/v4/id')
+    monkeypatch.setenv('IP_SET_ID_HTTP_FLOODV6', 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/v6/id')
+    parser = LambdaLogParser(log)
+    mocker.patch.object(parser.waflib, 'get_ip_set', return_value={'IPSet': {'Addresses': ['10.0.2.0/28']}})
+    commit_ip_set = mocker.patch.object(parser.waflib, 'commit_ip_set', return_value=(True, {}))
+
+    outstanding_requesters = {'general': dict(make_requesters(['10.0.1.1', '10.0.1.2', '10.0.2.1', '10.0.2.2'])),
+                              'uriList': {}}
+    parser.update_ip_set(parser.flood, outstanding_requesters)
+    assert sorted(commit_ip_set.call_args_list[0][0][4]) == ['10.0.1.0/24', '10.0.2.1/32', '10.0.2.2/32']
+    assert commit_ip_set.call_args_list[1][0][4] == []
+
+
+def test_no_aggregation_without_allowlist(monkeypatch, mocker):
+    monkeypatch.setenv('CIDR_AGGREGATION', 'yes')
+    monkeypatch.setenv('CIDR_AGGREGATION_DENSITY', '2')
+    monkeypatch.setenv('IP_SET_ID_HTTP_FLOODV4', 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/v4/id')
+    monkeypatch.setenv('IP_SET_ID_HTTP_FLOODV6', 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/v6/id')
+    for name in ['IP_SET_NAME_WHITELISTV4', 'IP_SET_ID_WHITELISTV4', 'IP_SET_NAME_WHITELISTV6', 'IP_SET_ID_WHITELISTV6']:
+        monkeypatch.delenv(name, raising=False)
+    parser = LambdaLogParser(log)
+    get_ip_set = mocker.patch.object(parser.waflib, 'get_ip_set')
+    commit_ip_set = mocker.patch.object(parser.waflib, 'commit_ip_set', return_value=(True, {}))
+
+    outstanding_requesters = {'general': dict(make_requesters(['10.0.1.1', '10.0.1.2'])), 'uriList': {}}
+    parser.update_ip_set(parser.flood, outstanding_requesters)
+    get_ip_set.assert_not_called()
+    assert sorted(commit_ip_set.call_args_list[0][0][4]) == ['10.0.1.1/32', '10.0.1.2/32']
@@ -0,0 +1,106 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import logging
+import os
+
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from columnar_log_reader import ColumnarLogReader, get_log_parser_engine
+from lambda_log_parser import LambdaLogParser
+
+log = logging.getLogger('test_columnar_log_reader')
+
+CLOUDFRONT_LOG_FILE_LOCAL_PATH = "./test/test_data/cf-access-log-sample.gz"
+ALB_LOG_FILE_LOCAL_PATH = "./test/test_data/XXXXXXXXXXXX_elasticloadbalancing_us-east-1_app.ApplicationLoadBalancer.fa87e1db7badc175_20230424T2110Z_X.X.X.X_4c8scnzy.log.gz"
+
+
+def make_parsers(config):
+    line_parser = LambdaLogParser(log)
+    line_parser.config = config
+    os.environ['LOG_PARSER_ENGINE'] = 'pyarrow'
+    columnar_parser = LambdaLogParser(log)
+    os.environ.pop('LOG_PARSER_ENGINE')
+    columnar_parser.config = config
+    return line_parser, columnar_parser
+
+
+def assert_same_counts(config, lines, log_type, block_size):
+    line_parser, columnar_parser = make_parsers(config)
+    expected, _ = line_parser.read_log_lines(lines, log_type, 0)
+    counter = ColumnarLogReader(columnar_parser, log_type, 5, block_size).read(lines, 0)
+    assert counter.general == expected.general
+    assert counter.uri_list == expected.uri_list
+    assert counter.general
+    return counter
+
+
+def test_get_log_parser_engine():
+    assert get_log_parser_engine(log, 'PyArrow') == 'pyarrow'
+    assert get_log_parser_engine(log, 'unknown') == 'lines'
+    assert get_log_parser_engine(log, None) == 'lines'
+
+
+def test_cloudfront_counts_match_line_parser():
+    with gzip.open(CLOUDFRONT_LOG_FILE_LOCAL_PATH, 'r') as content:
+        lines = list(content)
+    config = {
+        'general': {'errorThreshold': 1, 'errorCodes': ['200', '404'], 'ignoredSufixes': ['.css']},
+        'uriList': {'page.html': {'errorThreshold': 1}}
+    }
+    # Header lines, and lines streamed without their new line character
+    lines = [b'#Version: 1.0\n', b'#Fields: date time\n'] + lines
+    assert_same_counts(config, lines, 'cloudfront', 5000)
+    assert_same_counts(config, [line.rstrip(b'\r\n') for line in lines], 'cloudfront', 5000)
+
+
+def test_alb_counts_match_line_parser():
+    with gzip.open(ALB_LOG_FILE_LOCAL_PATH, 'r') as content:
+        # The sample has anonymized source ips, give them a few real ones
+        lines = [line.replace(b'x.0.0.0:', b'10.0.0.%d:' % (i % 3)) for i, line in enumerate(content)]
+    assert lines[0].startswith(b'#')
+    config = {
+        'general': {'errorThreshold': 1, 'errorCodes': ['400', '403', '404']},
+        'uriList': {'/': {'errorThreshold': 1}}
+    }
+    counter = assert_same_counts(config, lines, 'alb', 30)
+    assert counter.uri_list[0]
+
+
+def test_file_objects_are_read_in_blocks():
+    config = {'general': {'errorThreshold': 1, 'errorCodes': ['200', '404']}, 'uriList': {}}
+    line_parser, columnar_parser = make_parsers(config)
+    with gzip.open(CLOUDFRONT_LOG_FILE_LOCAL_PATH, 'r') as content:
+        expected, _ = line_parser.read_log_lines(content, 'cloudfront', 0)
+    with gzip.open(CLOUDFRONT_LOG_FILE_LOCAL_PATH, 'r') as content:
+        counter = ColumnarLogReader(columnar_parser, 'cloudfront', 5, block_bytes=64 * 1024).read(content, 0)
+    assert counter.general == expected.general
+
+
+def test_read_log_lines_uses_columnar_engine():
+    with gzip.open(CLOUDFRONT_LOG_FILE_LOCAL_PATH, 'r') as content:
+        lines = list(content)
+    config = {'general': {'errorThreshold': 2, 'errorCodes': ['404']}, 'uriList': {}}
+    line_parser, columnar_parser = make_parsers(config)
+
+    expected, _ = line_parser.read_log_lines(lines, 'cloudfront', 0)
+    counter, _ = columnar_parser.read_log_lines(lines, 'cloudfront', 0)
+    assert columnar_parser.get_outstanding_requesters('cloudfront', counter, {'general': {}, 'uriList': {}}) == \
+        line_parser.get_outstanding_requesters('cloudfront', expected, {'general': {}, 'uriList': {}})
+
+
+def test_invalid_lines_use_the_error_budget():
+    with gzip.open(CLOUDFRONT_LOG_FILE_LOCAL_PATH, 'r') as content:
+        lines = list(content)[:10]
+    config = {'general': {'errorThreshold': 1, 'errorCodes': ['404']}, 'uriList': {}}
+    _, columnar_parser = make_parsers(config)
+
+    # Below the budget, invalid lines are skipped
+    counter = ColumnarLogReader(columnar_parser, 'cloudfront', 5).read(lines + [b'bad line'] * 4, 0)
+    assert sum(sum(counts.values()) for counts in counter.general.values()) > 0
+
+    with pytest.raises(Exception):
+        ColumnarLogReader(columnar_parser, 'cloudfront', 5).read(lines + [b'bad line'] * 5, 0)
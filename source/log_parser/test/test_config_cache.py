@@ -0,0 +1,59 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import logging
+
+from lib.s3_util import S3
+from config_cache import CONFIG_CACHE, CompiledConfig, get_compiled_config
+from lambda_log_parser import LambdaLogParser
+
+log = logging.getLogger('test_config_cache')
+
+S3_BUCKET_NAME = "test_bucket"
+CONF_FILE_S3_KEY = "test_config_cache-waf_log_conf.json"
+
+
+def test_compiled_config():
+    compiled_config = CompiledConfig({
+        'general': {'errorCodes': ['400', 403], 'ignoredSufixes': ['.css', '.js']},
+        'uriList': {'/login': {}, '/admin': {}}
+    })
+    assert compiled_config.error_codes == frozenset(['400', '403'])
+    assert compiled_config.ignored_suffixes == ('.css', '.js')
+    assert compiled_config.uri_list == ('/login', '/admin')
+
+    empty_config = CompiledConfig({'general': {}})
+    assert not '/app.css'.endswith(empty_config.ignored_suffixes)
+    assert empty_config.uri_list == ()
+
+
+def test_get_compiled_config_revalidates_etag(s3_client, mocker):
+    s3_util = S3(log)
+    s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=CONF_FILE_S3_KEY,
+                         Body=json.dumps({'general': {'requestThreshold': 10}, 'uriList': {}}))
+    get_object = mocker.spy(s3_util.s3_client, 'get_object')
+
+    first = get_compiled_config(s3_util, log, S3_BUCKET_NAME, CONF_FILE_S3_KEY)
+    assert first.config['general']['requestThreshold'] == 10
+    assert first.etag is not None
+
+    # Not modified: the cached config is reused
+    assert get_compiled_config(s3_util, log, S3_BUCKET_NAME, CONF_FILE_S3_KEY) is first
+    assert get_object.call_args.kwargs['IfNoneMatch'] == first.etag
+
+    s3_client.put_object(Bucket=S3_BUCKET_NAME, Key=CONF_FILE_S3_KEY,
+                         Body=json.dumps({'general': {'requestThreshold': 20}, 'uriList': {}}))
+    second = get_compiled_config(s3_util, log, S3_BUCKET_NAME, CONF_FILE_S3_KEY)
+    assert second is not first
+    assert second.config['general']['requestThreshold'] == 20
+    assert CONFIG_CACHE[(S3_BUCKET_NAME, CONF_FILE_S3_KEY)] is second
+
+
+def test_lambda_log_parser_compiles_assigned_config():
+    parser = LambdaLogParser(log)
+    parser.config = {'general': {'errorCodes': ['404']}, 'uriList': {'/login': {}}}
+    compiled_config = parser.compile_config()
+    assert compiled_config.config is parser.config
+    assert compiled_config.error_codes == frozenset(['404'])
+    assert parser.compile_config() is compiled_config
@@ -0,0 +1,105 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import datetime
+import logging
+from os import environ
+
+from lib.cw_metrics_util import UsageReportTimer, WAFCloudWatchMetrics
+from log_parser import log_parser
+
+log = logging.getLogger('test_cw_metrics_util')
+
+
+class FakeCloudWatchClient(object):
+
+    def __init__(self, values, page_size=None):
+        self.values = values
+        self.page_size = page_size
+        self.requests = []
+
+    def get_metric_data(self, MetricDataQueries, StartTime, EndTime, NextToken=None):
+        self.requests.append({'MetricDataQueries': MetricDataQueries, 'StartTime': StartTime, 'EndTime': EndTime,
+                              'NextToken': NextToken})
+        start = int(NextToken or 0)
+        end = len(MetricDataQueries) if self.page_size is None else start + self.page_size
+        response = {'MetricDataResults': [
+            {'Id': query['Id'], 'Values': self.values.get(query['MetricStat']['Metric']['MetricName'] + ':'
+                                                          + query['MetricStat']['Metric']['Dimensions'][0]['Value'],
+                                                          [])}
+            for query in MetricDataQueries[start:end]]}
+        if end < len(MetricDataQueries):
+            response['NextToken'] = str(end)
+        return response
+
+
+def test_usage_data_metrics_in_one_request():
+    cw = WAFCloudWatchMetrics(log)
+    cw.cw_client = FakeCloudWatchClient({'AllowedRequests:ALL': [10.0, 5.0], 'BlockedRequests:ALL': [3.0]})
+    usage_data = cw.add_waf_cw_metrics_to_usage_data([
+        ('AllowedRequests', 'ALL', 'allowed_requests', 0),
+        ('BlockedRequests', 'ALL', 'blocked_requests', 0),
+        ('BlockedRequests', 'BadBotRule', 'blocked_requests_bad_bot', -1)
+    ], 300, {'data_type': 'test'})
+
+    assert usage_data == {'data_type': 'test', 'allowed_requests': 15.0, 'blocked_requests': 3.0,
+                          'blocked_requests_bad_bot': -1}
+    assert len(cw.cw_client.requests) == 1
+    request = cw.cw_client.requests[0]
+    assert [query['Id'] for query in request['MetricDataQueries']] == ['m0', 'm1', 'm2']
+    assert request['EndTime'] - request['StartTime'] == datetime.timedelta(seconds=300)
+    assert request['EndTime'].second == 0
+
+
+def test_time_window_is_computed_per_call():
+    cw = WAFCloudWatchMetrics(log)
+    cw.cw_client = FakeCloudWatchClient({})
+    end_time = datetime.datetime(2023, 4, 25, 12, 30, 42, tzinfo=datetime.timezone.utc)
+    cw.get_waf_cw_metrics([('AllowedRequests', 'ALL')], 3600, end_time=end_time)
+    cw.get_waf_cw_metrics([('AllowedRequests', 'ALL')], 3600)
+
+    first, second = cw.cw_client.requests
+    assert first['StartTime'] == datetime.datetime(2023, 4, 25, 11, 30, tzinfo=datetime.timezone.utc)
+    assert second['EndTime'] > first['EndTime']
+
+
+def test_paginated_and_failed_requests():
+    cw = WAFCloudWatchMetrics(log)
+    cw.cw_client = FakeCloudWatchClient({'AllowedRequests:ALL': [1.0], 'BlockedRequests:ALL': [2.0]}, page_size=1)
+    assert cw.get_waf_cw_metrics([('AllowedRequests', 'ALL'), ('BlockedRequests', 'ALL')], 300) == [1.0, 2.0]
+    assert [request['NextToken'] for request in cw.cw_client.requests] == [None, '1']
+
+    cw.cw_client = None
+    assert cw.get_waf_cw_metrics([('AllowedRequests', 'ALL'), ('BlockedRequests', 'ALL')], 300) == [None, None]
+
+
+def test_usage_report_timer():
+    now = [1000.0]
+    timer = UsageReportTimer(300, clock=lambda: now[0])
+    assert timer.due()
+    now[0] += 299
+    assert not timer.due()
+    now[0] += 1
+    assert timer.due()
+    assert not timer.due()
+
+
+def test_log_parser_usage_data_is_throttled(mocker):
+    mocker.patch.dict(environ, {'SEND_ANONYMIZED_USAGE_DATA': 'yes', 'METRIC_NAME_PREFIX': 'test'})
+    for name in ['IP_SET_ID_SCANNERS_PROBESV4', 'IP_SET_ID_SCANNERS_PROBESV6', 'IP_SET_ID_HTTP_FLOODV4',
+                 'IP_SET_ID_HTTP_FLOODV6']:
+        environ.pop(name, None)
+    now = [1000.0]
+    mocker.patch.object(log_parser, 'usage_report_timer', UsageReportTimer(300, clock=lambda: now[0]))
+    add_metrics = mocker.patch.object(WAFCloudWatchMetrics, 'add_waf_cw_metrics_to_usage_data',
+                                      side_effect=lambda metrics, period_seconds, usage_data: usage_data)
+    send_metrics = mocker.patch.object(log_parser, 'send_metrics')
+    for _ in range(3):
+        log_parser.send_anonymized_usage_data(log)
+    now[0] += 300
+    log_parser.send_anonymized_usage_data(log)
+
+    assert add_metrics.call_count == 2
+    assert send_metrics.call_count == 2
+    metrics = add_metrics.call_args[0][0]
+    assert ('AllowedRequests', 'testWAFWebACL', 'allowed_requests_WAFWebACL', 0) in metrics
@@ -0,0 +1,121 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import logging
+import os
+import pickle
+import random
+
+from heavy_hitters import HeavyHitterCounter, SpaceSavingCounts
+from lambda_log_parser import LambdaLogParser
+from request_counter import RequestCounter, parse_ip_key
+
+log = logging.getLogger('test_heavy_hitters')
+
+WAF_LOG_FILE_LOCAL_PATH = "./test/test_data/test_waf_log.gz"
+
+
+def flood(seed=7, heavy=5, noise=5000):
+    """
+    heavy ips sending 100, 200, ... requests hidden in noise ips sending one request each.
+    """
+    rnd = random.Random(seed)
+    requests = []
+    for i in range(heavy):
+        requests += ['10.1.0.%d' % i] * (100 * (i + 1))
+    requests += ['172.16.%d.%d' % (i // 250, i % 250 + 1) for i in range(noise)]
+    rnd.shuffle(requests)
+    return requests
+
+
+def test_space_saving_counts_exact_below_capacity():
+    counts = SpaceSavingCounts(capacity=4)
+    for ip_key in [1, 2, 1, 3, 1]:
+        counts.increment(ip_key)
+    assert counts == {1: 3, 2: 1, 3: 1}
+    assert counts.get_max_error() == 0
+
+
+def test_space_saving_counts_bounds():
+    capacity = 100
+    true_counts = {}
+    counts = SpaceSavingCounts(capacity)
+    requests = flood()
+    for ip in requests:
+        ip_key = parse_ip_key(ip)
+        true_counts[ip_key] = true_counts.get(ip_key, 0) + 1
+        counts.increment(ip_key)
+
+    assert len(counts) == capacity
+    max_error = counts.get_max_error()
+    assert 0 < max_error <= len(requests) // capacity
+    for ip_key, count in counts.items():
+        assert count <= true_counts[ip_key] <= counts.get_estimate(ip_key)
+        assert counts.get_estimate(ip_key) - count <= max_error
+    # Every heavy ip is tracked
+    for i in range(5):
+        assert parse_ip_key('10.1.0.%d' % i) in counts
+
+
+def test_heavy_hitter_counter_thresholds():
+    exact = RequestCounter(['/login'])
+    approximate = HeavyHitterCounter(['/login'], capacity=100)
+    for ip in flood():
+        for counter in (exact, approximate):
+            counter.add(1, ip, '/login')
+    approximate.add(1, 'bad ip', '/')
+
+    assert approximate.invalid_ips == 1
+    exact_max_counts = exact.get_general_max_counts(200)
+    approximate_max_counts = approximate.get_general_max_counts(200)
+    # Never above the exact counts, and within the error bound
+    assert set(approximate_max_counts) <= set(exact_max_counts)
+    for ip_key, num_reqs in exact_max_counts.items():
+        if num_reqs - approximate.get_max_error() >= 200:
+            assert exact_max_counts[ip_key] - approximate.get_max_error() <= approximate_max_counts[ip_key]
+    assert approximate.get_urilist_max_counts('/login', 200) == approximate_max_counts
+
+
+def test_heavy_hitter_counter_merge():
+    requests = flood()
+    whole = HeavyHitterCounter(capacity=100)
+    first = HeavyHitterCounter(capacity=100)
+    second = HeavyHitterCounter(capacity=100)
+    for i, ip in enumerate(requests):
+        whole.add(1, ip, '/')
+        (first if i % 2 else second).add(1, ip, '/')
+
+    # Workers send their counters over pipes
+    first.merge(pickle.loads(pickle.dumps(second)))
+    merged = first.general[1]
+    assert len(merged) == 100
+    for i in range(5):
+        ip_key = parse_ip_key('10.1.0.%d' % i)
+        assert merged[ip_key] <= 100 * (i + 1) <= merged.get_estimate(ip_key)
+    assert set(first.get_general_max_counts(300)) == set(whole.get_general_max_counts(300))
+
+
+def test_lambda_log_parser_heavy_hitter_mode():
+    with gzip.open(WAF_LOG_FILE_LOCAL_PATH, 'r') as content:
+        waf_lines = list(content)
+    config = {'general': {'requestThreshold': 1}, 'uriList': {}}
+
+    exact_parser = LambdaLogParser(log)
+    exact_parser.config = config
+    os.environ['HEAVY_HITTER_CAPACITY'] = '1000'
+    parser = LambdaLogParser(log)
+    os.environ.pop('HEAVY_HITTER_CAPACITY')
+    parser.config = config
+
+    counter, _ = parser.read_log_lines(waf_lines, 'waf', 0)
+    exact_counter, _ = exact_parser.read_log_lines(waf_lines, 'waf', 0)
+    assert isinstance(counter, HeavyHitterCounter)
+    assert counter.capacity == 1000
+
+    # Below capacity the counts are exact
+    assert counter.get_max_error() == 0
+    outstanding_requesters = parser.get_outstanding_requesters('waf', counter, {'general': {}, 'uriList': {}})
+    exact_outstanding_requesters = exact_parser.get_outstanding_requesters(
+        'waf', exact_counter, {'general': {}, 'uriList': {}})
+    assert outstanding_requesters['general'].keys() == exact_outstanding_requesters['general'].keys()
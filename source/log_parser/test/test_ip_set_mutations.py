@@ -0,0 +1,219 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import logging
+from os import environ
+
+import boto3
+from moto import mock_dynamodb, mock_sqs
+
+import lambda_log_parser
+from lambda_log_parser import LambdaLogParser
+from lib.ip_set_mutations import (ADD, REMOVE, REPLACE, DynamoDBReplaceGenerationStore, IPSetMutationApplier,
+                                  LocalMutationQueue, SQSMutationQueue, coalesce, make_intents)
+from lib.ip_set_updater import IPSetUpdater, TokenBucket
+from lib.waflibv2 import WAFLIBv2
+
+log = logging.getLogger('test_ip_set_mutations')
+
+SCOPE = 'REGIONAL'
+IP_SET_ARN_V4 = 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/test-v4/id-v4'
+IP_SET_ARN_V6 = 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/test-v6/id-v6'
+
+
+def make_updater():
+    return IPSetUpdater(log, WAFLIBv2(), TokenBucket(rate=1000, burst=1000), sleep=lambda _: None)
+
+
+def messages(*intents):
+    return list(enumerate(intent for intents_ in intents for intent in intents_))
+
+
+def test_make_intents_splits_large_mutations():
+    intents = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REPLACE, ['10.0.0.%d/32' % i for i in range(5)], 2)
+    assert [(intent['action'], len(intent['addresses']), intent['part'], intent['parts']) for intent in intents] == [
+        (REPLACE, 2, 0, 3), (REPLACE, 2, 1, 3), (REPLACE, 1, 2, 3)]
+    assert len(set(intent['replace_id'] for intent in intents)) == 1
+    assert len(set(intent['generation'] for intent in intents)) == 1
+    assert intents[0]['generation'] == '%016d#%s' % (int(intents[0]['enqueued_at'] * 1000000),
+                                                     intents[0]['replace_id'])
+    intents = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REPLACE, [])
+    assert [intent['action'] for intent in intents] == [REPLACE]
+    assert 'replace_id' not in intents[0]
+    assert 'generation' in intents[0]
+    assert 'generation' not in make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, ADD, ['10.0.0.1/32'])[0]
+
+
+def test_coalesce_folds_intents_in_order():
+    mutations = coalesce(messages(
+        make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, ADD, ['10.0.0.1', '10.0.0.2/32']),
+        make_intents(SCOPE, 'test-v6', IP_SET_ARN_V6, REMOVE, ['2001:db8::1/128']),
+        make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REMOVE, ['10.0.0.2/32', '10.0.0.3/32']),
+        make_intents(SCOPE, 'test-v6', IP_SET_ARN_V6, REPLACE, ['2001:db8::2/128']),
+        make_intents(SCOPE, 'test-v6', IP_SET_ARN_V6, ADD, ['2001:db8::3/128'])))
+
+    v4, v6 = mutations
+    assert (v4.replaced, v4.added, v4.removed) == (None, {'10.0.0.1/32'}, {'10.0.0.2/32', '10.0.0.3/32'})
+    assert v4.receipts == [0, 2]
+    assert v6.replaced == {'2001:db8::2/128', '2001:db8::3/128'}
+    assert v6.intents == 3
+
+
+def test_applier_writes_each_ip_set_once_per_window(wafv2_client):
+    wafv2_client.put_ip_set('id-v4', 'test-v4', ['10.0.0.1/32', '10.0.0.2/32'])
+    queue = LocalMutationQueue()
+    for i in range(50):
+        queue.send(make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, ADD, ['10.0.1.%d/32' % i]))
+    queue.send(make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REMOVE, ['10.0.0.1/32', '10.0.1.0/32']))
+    queue.send(make_intents(SCOPE, 'test-v6', IP_SET_ARN_V6, REPLACE, ['2001:db8::1/128']))
+
+    now = [0.0]
+
+    def sleep(seconds):
+        now[0] += seconds
+
+    applier = IPSetMutationApplier(log, queue, make_updater(), window_seconds=1, clock=lambda: now[0], sleep=sleep)
+    assert applier.run_once() == 52
+    assert len(queue) == 0 and queue.in_flight == {}
+    assert sorted(wafv2_client.ip_sets['id-v4']['Addresses']) == sorted(
+        ['10.0.0.2/32'] + ['10.0.1.%d/32' % i for i in range(1, 50)])
+    assert wafv2_client.ip_sets['id-v6']['Addresses'] == ['2001:db8::1/128']
+    assert wafv2_client.calls == {'get_ip_set': 2, 'update_ip_set': 2}
+    assert applier.stats == {'intents': 52, 'updates': 2, 'applied': 2, 'skipped': 0, 'failed': 0, 'held': 0,
+                             'stale': 0}
+
+    # Nothing to change: no write, nothing queued: no WAF call
+    queue.send(make_intents(SCOPE, 'test-v6', IP_SET_ARN_V6, ADD, ['2001:db8::1/128']))
+    applier.run_once()
+    applier.run_once()
+    assert wafv2_client.calls == {'get_ip_set': 2, 'update_ip_set': 2}
+
+
+def test_failed_ip_sets_are_reported(wafv2_client, mocker):
+    applier = IPSetMutationApplier(log, None, make_updater())
+    commit_ip_set = mocker.patch.object(applier.updater.waflib, 'commit_ip_set',
+                                        side_effect=lambda log, scope, name, *args, **kwargs:
+                                        (False, None) if name == 'test-v6' else (True, {}))
+    records = [{'messageId': 'm%d' % i, 'body': body} for i, body in enumerate([
+        '{"scope": "REGIONAL", "name": "test-v4", "ip_set_arn": "%s", "action": "add", "addresses": ["10.0.0.1"]}'
+        % IP_SET_ARN_V4,
+        '{"scope": "REGIONAL", "name": "test-v6", "ip_set_arn": "%s", "action": "add", "addresses": ["::1"]}'
+        % IP_SET_ARN_V6])]
+    assert applier.apply_sqs_records(records) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    assert commit_ip_set.call_count == 2
+
+
+def test_split_replace_is_applied_once_complete(wafv2_client):
+    wafv2_client.put_ip_set('id-v4', 'test-v4', ['10.0.9.9/32'])
+    replace = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REPLACE, ['10.0.0.%d/32' % i for i in range(5)], 2)
+    add = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, ADD, ['10.0.1.1/32'])
+    add[0]['enqueued_at'] += 1
+    records = [{'messageId': 'm%d' % i, 'body': json.dumps(intent)} for i, intent in enumerate(replace + add)]
+    applier = IPSetMutationApplier(log, None, make_updater())
+
+    # Last part and the later add first, held: the IP set is untouched
+    assert applier.apply_sqs_records([records[2], records[3]]) == {
+        'batchItemFailures': [{'itemIdentifier': 'm2'}, {'itemIdentifier': 'm3'}]}
+    assert applier.apply_sqs_records([records[1]]) == {'batchItemFailures': [{'itemIdentifier': 'm1'}]}
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.9.9/32']
+    assert wafv2_client.calls.get('update_ip_set', 0) == 0
+
+    # The first part completes the replace, applied with the add in one update
+    assert applier.apply_sqs_records([records[0]]) == {'batchItemFailures': []}
+    assert sorted(wafv2_client.ip_sets['id-v4']['Addresses']) == ['10.0.0.%d/32' % i for i in range(5)] + [
+        '10.0.1.1/32']
+    assert wafv2_client.calls['update_ip_set'] == 1
+
+    # The held records delivered again are acknowledged without another update
+    assert applier.apply_sqs_records(records[1:]) == {'batchItemFailures': []}
+    assert wafv2_client.calls['update_ip_set'] == 1
+    assert applier.held == {}
+
+
+def test_run_once_deletes_held_intents_once_applied(wafv2_client):
+    queue = LocalMutationQueue()
+    replace = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REPLACE, ['10.0.0.%d/32' % i for i in range(3)], 2)
+    applier = IPSetMutationApplier(log, queue, make_updater(), window_seconds=0)
+    queue.send(replace[1:])
+    applier.apply(queue.receive())
+    queue.send(replace[:1])
+    applier.window_seconds = 0.01
+    applier.run_once()
+    assert sorted(wafv2_client.ip_sets['id-v4']['Addresses']) == ['10.0.0.%d/32' % i for i in range(3)]
+    assert queue.in_flight == {}
+
+
+@mock_dynamodb
+def test_replace_older_than_the_applied_one_is_dropped(wafv2_client, mocker):
+    table = boto3.resource('dynamodb', region_name='us-east-1').create_table(
+        TableName='generations', KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}],
+        AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'}], BillingMode='PAY_PER_REQUEST')
+    older = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REPLACE, ['10.0.0.1/32'])[0]
+    newer = make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, REPLACE, ['10.0.0.2/32'])[0]
+    older['generation'] = '%016d#a' % 1
+    newer['generation'] = '%016d#b' % 2
+    records = [{'messageId': 'older', 'body': json.dumps(older)}, {'messageId': 'newer', 'body': json.dumps(newer)}]
+
+    def applier():
+        # A new container each time: only the table is shared
+        return IPSetMutationApplier(log, None, make_updater(), generations=DynamoDBReplaceGenerationStore(table))
+
+    # The older replace fails and is delivered again after the newer one was applied
+    failing = applier()
+    commit_ip_set = failing.updater.waflib.commit_ip_set
+    fail = [True]
+    mocker.patch.object(failing.updater.waflib, 'commit_ip_set', side_effect=lambda *args, **kwargs:
+                        (False, None) if fail else commit_ip_set(*args, **kwargs))
+    assert failing.apply_sqs_records(records[:1]) == {'batchItemFailures': [{'itemIdentifier': 'older'}]}
+    fail.clear()
+    assert applier().apply_sqs_records(records[1:]) == {'batchItemFailures': []}
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.2/32']
+    assert table.get_item(Key={'pk': 'REGIONAL#id-v4'})['Item']['generation'] == newer['generation']
+
+    redelivered = applier()
+    assert redelivered.apply_sqs_records(records[:1]) == {'batchItemFailures': []}
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.2/32']
+    assert redelivered.stats['stale'] == 1 and redelivered.stats['updates'] == 0
+
+    # The newer replace delivered again is dropped too, an older one never overwrites its generation
+    assert redelivered.apply_sqs_records(records[1:]) == {'batchItemFailures': []}
+    assert redelivered.stats['stale'] == 2
+    redelivered.generations.put(('REGIONAL', 'id-v4'), older['generation'])
+    assert redelivered.generations.get(('REGIONAL', 'id-v4')) == newer['generation']
+
+
+@mock_sqs
+def test_sqs_queue_round_trip():
+    client = boto3.client('sqs', region_name='us-east-1')
+    queue_url = client.create_queue(QueueName='mutations.fifo', Attributes={'FifoQueue': 'true'})['QueueUrl']
+    queue = SQSMutationQueue(queue_url, client)
+    intents = [intent for i in range(12) for intent in make_intents(SCOPE, 'test-v4', IP_SET_ARN_V4, ADD,
+                                                                     ['10.0.0.%d/32' % i])]
+    assert queue.send(intents) == 12
+
+    # The intents of an IP set stay in order, the next ones are delivered once the received ones are deleted
+    addresses = []
+    for _ in range(3):
+        received = queue.receive()
+        addresses.extend(intent['addresses'] for _, intent in received)
+        queue.delete([receipt for receipt, _ in received])
+    assert addresses == [['10.0.0.%d/32' % i] for i in range(12)]
+
+
+def test_log_parser_queues_ip_set_mutations(mocker):
+    environ['IP_SET_ID_HTTP_FLOODV4'] = IP_SET_ARN_V4
+    environ['IP_SET_ID_HTTP_FLOODV6'] = IP_SET_ARN_V6
+    environ['IP_SET_NAME_HTTP_FLOODV4'] = 'test-v4'
+    queue = LocalMutationQueue()
+    mocker.patch.object(lambda_log_parser, 'get_ip_set_mutation_queue', return_value=queue)
+    parser = LambdaLogParser(log)
+    commit_ip_set = mocker.patch.object(parser.waflib, 'commit_ip_set')
+
+    parser.update_ip_set(parser.flood, {'general': {'10.0.0.1': {'max_counter_per_min': 200, 'updated_at': 0}},
+                                        'uriList': {}})
+    for name in ['IP_SET_ID_HTTP_FLOODV4', 'IP_SET_ID_HTTP_FLOODV6', 'IP_SET_NAME_HTTP_FLOODV4']:
+        environ.pop(name)
+    assert [(intent['name'], intent['action'], intent['addresses']) for _, intent in queue.receive()] == [
+        ('test-v4', REPLACE, ['10.0.0.1/32']), (None, REPLACE, [])]
+    commit_ip_set.assert_not_called()
@@ -0,0 +1,98 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+import threading
+
+import pytest
+from botocore.exceptions import ClientError
+
+from lib.ip_set_updater import IPSetUpdater, TokenBucket
+from lib.waflibv2 import WAFLIBv2
+
+log = logging.getLogger('test_ip_set_updater')
+
+SCOPE = 'REGIONAL'
+IP_SET_ARN_V4 = 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/test-v4/id-v4'
+IP_SET_ARN_V6 = 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/test-v6/id-v6'
+
+
+class FakeClock(object):
+    """
+    Time that only moves when slept.
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def make_updater(max_workers=2, max_retries=5):
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, burst=2, clock=clock, sleep=clock.sleep)
+    return IPSetUpdater(log, WAFLIBv2(), bucket, max_workers=max_workers, max_retries=max_retries,
+                        sleep=clock.sleep), clock
+
+
+def test_token_bucket_waits_for_tokens():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2.0, burst=2, clock=clock, sleep=clock.sleep)
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == 0
+    assert bucket.acquire() == pytest.approx(0.5)
+    clock.now += 10
+    # Refilled up to burst only
+    assert [bucket.acquire() for _ in range(3)] == [0, 0, pytest.approx(0.5)]
+
+
+def test_throttled_calls_are_retried(wafv2_client):
+    updater, _ = make_updater()
+    wafv2_client.throttle = 2
+
+    applied, _ = updater.commit(SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.1/32'])
+    assert applied
+    assert updater.throttled == 2
+    assert wafv2_client.calls == {'get_ip_set': 3, 'update_ip_set': 1}
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.1/32']
+
+
+def test_throttling_gives_up_after_max_retries(wafv2_client):
+    updater, _ = make_updater(max_retries=2)
+    wafv2_client.throttle = 3
+    with pytest.raises(ClientError):
+        updater.call('get_ip_set', Scope=SCOPE, Name='test-v4', Id='id-v4')
+    assert updater.throttled == 2
+
+
+def test_other_errors_are_not_retried(wafv2_client, mocker):
+    updater, clock = make_updater()
+    error = ClientError({'Error': {'Code': 'WAFNonexistentItemException', 'Message': ''}}, 'get_ip_set')
+    mocker.patch.object(wafv2_client, 'get_ip_set', side_effect=error)
+    with pytest.raises(ClientError):
+        updater.call('get_ip_set', Scope=SCOPE, Name='test-v4', Id='id-v4')
+    assert updater.throttled == 0
+    assert clock.slept == []
+
+
+def test_commit_all_commits_ip_sets_concurrently(wafv2_client):
+    updater, _ = make_updater()
+    threads = set()
+    update_ip_set = wafv2_client.update_ip_set
+
+    def record_thread(**kwargs):
+        threads.add(threading.get_ident())
+        return update_ip_set(**kwargs)
+
+    wafv2_client.update_ip_set = record_thread
+    results = updater.commit_all(SCOPE, [('test-v4', IP_SET_ARN_V4, ['10.0.0.1/32']),
+                                         ('test-v6', IP_SET_ARN_V6, [])])
+    assert [applied for applied, _ in results] == [True, False]
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.1/32']
+    assert threading.get_ident() not in threads
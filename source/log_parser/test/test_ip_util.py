@@ -0,0 +1,40 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+
+from lib.ip_util import format_cidr, ip_version, is_address, is_network, network_range, parse_ip, \
+    split_ip_set_addresses
+from lib.waflibv2 import WAFLIBv2
+
+log = logging.getLogger('test_ip_util')
+
+
+def test_parse_ip():
+    assert parse_ip('192.168.1.1') == (4, 3232235777, 32)
+    assert parse_ip(' 10.0.0.0/8 ') == (4, 167772160, 8)
+    assert parse_ip('2001:db8::1') == (6, 0x20010db8000000000000000000000001, 128)
+    for text in ['01.2.3.4', '1.2.3', '10.0.0.0/33', '10.0.0.0/a', '::1/129', 'x.0.0.0', '', None]:
+        assert parse_ip(text) is None
+    assert ip_version('2001:db8::/32') == 6
+    assert is_address('10.0.0.1') and not is_address('10.0.0.1/32')
+
+
+def test_networks():
+    assert is_network(parse_ip('10.0.1.0/24'))
+    assert not is_network(parse_ip('10.0.1.1/24'))
+    assert network_range(parse_ip('10.0.1.1/24')) == (167772416, 167772671)
+    assert format_cidr(parse_ip('2001:DB8:0::1')) == '2001:db8::1/128'
+
+
+def test_split_ip_set_addresses():
+    assert split_ip_set_addresses(['10.0.0.1', '2001:db8::1', '10.0.1.0/24', 'x.0.0.0'], log) == \
+        (['10.0.0.1/32', '10.0.1.0/24'], ['2001:db8::1/128'])
+
+
+def test_waflib_ip_helpers():
+    waflib = WAFLIBv2()
+    assert waflib.which_ip_version(log, '2001:db8::1') == 'IPV6'
+    assert waflib.set_ip_cidr(log, ' 10.0.0.1') == '10.0.0.1/32'
+    assert waflib.which_ip_version(log, '10.0.0.0/8') is None
+    assert waflib.set_ip_cidr(log, 'x.0.0.0') is None
@@ -0,0 +1,92 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import logging
+from urllib.parse import urlparse
+
+from lambda_log_parser import LambdaLogParser
+from log_formats import ALB_LOG_FORMAT, CLOUDFRONT_LOG_FORMAT, compile_log_format, compile_tokenizer, \
+    get_url_path, split_quoted
+from request_counter import RequestCounter, parse_ip_key
+
+log = logging.getLogger('test_log_formats')
+
+CLOUDFRONT_LOG_FILE_LOCAL_PATH = "./test/test_data/cf-access-log-sample.gz"
+ALB_LOG_FILE_LOCAL_PATH = "./test/test_data/XXXXXXXXXXXX_elasticloadbalancing_us-east-1_app.ApplicationLoadBalancer.fa87e1db7badc175_20230424T2110Z_X.X.X.X_4c8scnzy.log.gz"
+
+# Common Log Format, as configured for API Gateway access logs:
+# $context.identity.sourceIp - - [$context.requestTime] "$context.httpMethod $context.path $context.protocol"
+# $context.status $context.responseLength $context.requestId
+API_GATEWAY_CLF_LOG_FORMAT = {
+    'delimiter': ' ',
+    'quote_char': '"',
+    'quoted_fields_from': 4,
+    'fields': {'source_ip': 0, 'timestamp': 3, 'request': 4, 'code': 5}
+}
+
+
+def test_split_quoted():
+    assert split_quoted('"GET / HTTP/1.1" "agent \\"x\\" y" z', ' ', 3, '"', '\\') == \
+        ['GET / HTTP/1.1', 'agent \\"x\\" y', 'z']
+    assert split_quoted('a b', ' ', 5, '"') == ['a', 'b']
+
+
+def test_tokenizer_stops_after_highest_index():
+    tokenize = compile_tokenizer({'delimiter': ' '}, (0, 2))
+    assert tokenize('a b c d e') == ('a', 'c')
+    tokenize = compile_tokenizer({'delimiter': ' '}, (1,))
+    assert tokenize('a b c') == ('b',)
+
+    tokenize = compile_tokenizer(ALB_LOG_FORMAT, (1, 12))
+    assert tokenize('h 2023 c d e f g h i j k l "GET http://x/ HTTP/1.1" "Mozilla/5.0 (X11)" -') == \
+        ('2023', 'GET http://x/ HTTP/1.1')
+    # Quoted field at the end of the line, with an escaped quote, or not quoted
+    assert tokenize('h 2023 c d e f g h i j k l "GET /"') == ('2023', 'GET /')
+    assert tokenize('h 2023 c d e f g h i j k l "GET /\\" x" -') == ('2023', 'GET /\\" x')
+    assert tokenize('h 2023 c d e f g h i j k l - -') == ('2023', '-')
+
+
+def test_get_url_path_matches_urlparse():
+    for url in ['http://example.com:80/', 'https://example.com/a/b.css', 'http://example.com:80/a?b=c',
+                'http://example.com', 'http://example.com?x=/y', 'https://example.com/a;p/b', '/login',
+                'page.html', '//example.com/a', '-', '', 'HTTP://EXAMPLE.com/A', 'http://example.com//a']:
+        assert get_url_path(url) == urlparse(url).path, url
+
+
+def test_compiled_formats_match_full_split():
+    read_cloudfront_line = compile_log_format(CLOUDFRONT_LOG_FORMAT)
+    with gzip.open(CLOUDFRONT_LOG_FILE_LOCAL_PATH, 'r') as content:
+        for line in content:
+            line = line.decode('utf8')
+            line_data = line.split('\t')
+            assert read_cloudfront_line(line) == (line_data[0] + ' ' + line_data[1][:-3], line_data[4],
+                                                  urlparse(line_data[7]).path, line_data[8])
+
+    read_alb_line = compile_log_format(ALB_LOG_FORMAT)
+    with gzip.open(ALB_LOG_FILE_LOCAL_PATH, 'r') as content:
+        for line in content:
+            if line.startswith(b'#'):
+                continue
+            line = line.decode('utf8')
+            line_data = line.split(' ')
+            assert read_alb_line(line) == (line_data[1].rsplit(':', 1)[0], line_data[3].rsplit(':', 1)[0],
+                                           urlparse(line_data[13]).path, line_data[9])
+
+
+def test_new_format_only_needs_a_descriptor():
+    read_line = compile_log_format(API_GATEWAY_CLF_LOG_FORMAT)
+    line = '10.0.0.1 - - 2023-04-24T21:28:01Z "POST /prod/login HTTP/1.1" 403 12 abc-123'
+    assert read_line(line) == ('2023-04-24T21:28', '10.0.0.1', '/prod/login', '403')
+
+
+def test_header_lines_are_skipped_before_decoding():
+    parser = LambdaLogParser(log)
+    parser.config = {'general': {'errorCodes': ['404']}, 'uriList': {}}
+    parser.compile_config()
+    counter = RequestCounter()
+    # Not valid utf8, so decoding it would fail
+    parser.read_contents(b'#\xff\n', 'cloudfront', {'general': {}, 'uriList': {}}, counter)
+    parser.read_contents(b'2023-04-24\t21:57:56\tFRA6\t1\t10.0.0.1\tGET\th\t/a\t404\t-\n', 'cloudfront',
+                         {'general': {}, 'uriList': {}}, counter)
+    assert counter.general == {parser.get_minute('2023-04-24 21:57'): {parse_ip_key('10.0.0.1'): 1}}
@@ -1,10 +1,13 @@
 #  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 #  SPDX-License-Identifier: Apache-2.0
 
-from os import environ
+import json
+import pytest
+from os import environ, path
 from types import SimpleNamespace
 
 from log_parser import log_parser
+from lambda_log_parser import LambdaLogParser
 
 context = SimpleNamespace(**{
     'function_name': 'foo',
@@ -133,4 +136,96 @@ def test_lambda_parser_unsupported_log_type(cloudfront_log_lambda_parser_test_ev
         assert str(e) == TYPE_ERROR_MESSAGE
     finally:
         environ.pop('APP_ACCESS_LOG_BUCKET')
-        environ.pop('LOG_TYPE')
\ No newline at end of file
+        environ.pop('LOG_TYPE')
+
+def test_waf_lambda_parser_streaming(waf_log_lambda_parser_test_event_setup):
+    environ['LOG_TYPE'] = "waf"
+    environ['STREAM_LOG_FILES'] = 'yes'
+    environ['RANGE_GET_CONCURRENCY'] = '2'
+    event = waf_log_lambda_parser_test_event_setup
+    result = {"message": WAF_LOG_LAMBDA_PARSER_PROCESSED_MESSAGE}
+    assert result == log_parser.lambda_handler(event, context)
+    environ.pop('WAF_ACCESS_LOG_BUCKET')
+    environ.pop('LOG_TYPE')
+    environ.pop('STREAM_LOG_FILES')
+    environ.pop('RANGE_GET_CONCURRENCY')
+
+
+def test_waf_lambda_parser_batch(waf_log_lambda_parser_test_event_setup, s3_client, mocker):
+    environ['LOG_TYPE'] = "waf"
+    environ['BATCH_RECORDS'] = 'yes'
+    s3_client.upload_file("./test/test_data/test_waf_log.gz", "test_bucket", "AWSLogs/test_waf_log_2.gz")
+    event = waf_log_lambda_parser_test_event_setup
+    record = event['Records'][0]
+    keys = ["AWSLogs/test_waf_log_2.gz", "AWSLogs/missing_waf_log.gz", record['s3']['object']['key']]
+    event['Records'] = [record] + [{"s3": {"bucket": record['s3']['bucket'], "object": {"key": key}}} for key in keys]
+    # The object size of the S3 event is passed on to the log file reader
+    size = path.getsize("./test/test_data/test_waf_log.gz")
+    event['Records'][1]['s3']['object']['size'] = size
+    update_ip_set = mocker.spy(LambdaLogParser, 'update_ip_set')
+    parse_log_file = mocker.spy(LambdaLogParser, 'parse_log_file')
+
+    result = log_parser.lambda_handler(event, context)
+    assert result['message'] == WAF_LOG_LAMBDA_PARSER_PROCESSED_MESSAGE
+    assert [(r['bucket'], r['key']) for r in result['failed_records']] == \
+        [("test_bucket", "AWSLogs/missing_waf_log.gz")]
+    assert update_ip_set.call_count == 1
+    assert {call[0][2]: call[0][4] for call in parse_log_file.call_args_list}["AWSLogs/test_waf_log_2.gz"] == size
+
+    # The invocation fails when no log file could be processed
+    event['Records'] = [{"s3": {"bucket": record['s3']['bucket'], "object": {"key": "AWSLogs/missing_waf_log.gz"}}}]
+    with pytest.raises(Exception, match='404'):
+        log_parser.lambda_handler(event, context)
+    environ.pop('WAF_ACCESS_LOG_BUCKET')
+    environ.pop('LOG_TYPE')
+    environ.pop('BATCH_RECORDS')
+
+
+def test_waf_lambda_parser_stage_metrics(waf_log_lambda_parser_test_event_setup, capsys):
+    environ['LOG_TYPE'] = "waf"
+    environ['STAGE_METRICS'] = 'yes'
+    event = waf_log_lambda_parser_test_event_setup
+    capsys.readouterr()
+    result = {"message": WAF_LOG_LAMBDA_PARSER_PROCESSED_MESSAGE}
+    assert result == log_parser.lambda_handler(event, context)
+
+    records = [json.loads(line) for line in capsys.readouterr().out.splitlines() if '"_aws"' in line]
+    assert len(records) == 1
+    record = records[0]
+    assert record['LogType'] == 'waf'
+    for name in ['ConfigReadTime', 'DownloadTime', 'ParseTime', 'ThresholdTime', 'MergeTime', 'Lines',
+                 'Bytes', 'DownloadBytes', 'UniqueIPs', 'Offenders', 'S3Calls']:
+        assert name in record
+    assert record['Lines'][0] > 0
+    assert record['UniqueIPs'][0] > 0
+    environ.pop('WAF_ACCESS_LOG_BUCKET')
+    environ.pop('LOG_TYPE')
+    environ.pop('STAGE_METRICS')
+
+
+def test_truncate_list_keeps_top_requesters():
+    parser = LambdaLogParser(log_parser.logger)
+    outstanding_requesters = {
+        'general': {
+            '10.0.0.1': {'max_counter_per_min': 50, 'updated_at': 100},
+            '10.0.0.2': {'max_counter_per_min': 80, 'updated_at': 100},
+            '10.0.0.3': {'max_counter_per_min': 60, 'updated_at': 200}
+        },
+        'uriList': {
+            '/login': {'10.0.0.1': {'max_counter_per_min': 90, 'updated_at': 100},
+                       '10.0.0.4': {'max_counter_per_min': 60, 'updated_at': 300}},
+            '/api/*': {'10.0.0.1': {'max_counter_per_min': 70, 'updated_at': 100}}
+        }
+    }
+
+    unified_outstanding_requesters = parser.merge_lists(outstanding_requesters)
+    assert list(unified_outstanding_requesters) == ['10.0.0.1', '10.0.0.2', '10.0.0.3', '10.0.0.4']
+    assert unified_outstanding_requesters['10.0.0.1']['max_counter_per_min'] == 90
+    assert '10.0.0.4' not in outstanding_requesters['general']
+
+    environ['LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION'] = '3'
+    truncated = parser.truncate_list(parser.iter_unified_requesters(outstanding_requesters))
+    assert list(truncated) == ['10.0.0.1', '10.0.0.2', '10.0.0.4']
+    environ['LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION'] = '4'
+    assert parser.truncate_list(unified_outstanding_requesters) == unified_outstanding_requesters
+    environ.pop('LIMIT_IP_ADDRESS_RANGES_PER_IP_MATCH_CONDITION')
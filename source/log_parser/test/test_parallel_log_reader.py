@@ -0,0 +1,96 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import logging
+import os
+import pickle
+
+import pytest
+
+from lambda_log_parser import LambdaLogParser
+from parallel_log_reader import ParallelLogReader, get_worker_count, iter_line_blocks
+
+log = logging.getLogger('test_parallel_log_reader')
+
+CLOUDFRONT_LOG_FILE_LOCAL_PATH = "./test/test_data/E3HXCM7PFRG6HT.2023-04-24-21.d740d76bCloudFront.gz"
+WAF_LOG_FILE_LOCAL_PATH = "./test/test_data/test_waf_log.gz"
+
+
+def read_lines(file_path):
+    with gzip.open(file_path, 'r') as content:
+        return list(content)
+
+
+def make_parser(config):
+    parser = LambdaLogParser(log)
+    parser.config = config
+    return parser
+
+
+def test_get_worker_count(mocker):
+    mocker.patch('os.cpu_count', return_value=6)
+    assert get_worker_count('auto') == 6
+    assert get_worker_count('AUTO') == 6
+    assert get_worker_count('3') == 3
+    assert get_worker_count('0') == 1
+
+
+def test_iter_line_blocks():
+    assert list(iter_line_blocks(range(7), 3)) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert list(iter_line_blocks([], 3)) == []
+
+
+def test_parallel_reader_matches_serial():
+    config = {
+        'general': {'requestThreshold': 1, 'errorThreshold': 1, 'errorCodes': ['200', '403', '404']},
+        'uriList': {'/': {'requestThreshold': 1, 'errorThreshold': 1}}
+    }
+    for log_type, file_path in [('waf', WAF_LOG_FILE_LOCAL_PATH), ('cloudfront', CLOUDFRONT_LOG_FILE_LOCAL_PATH)]:
+        lines = read_lines(file_path)
+        expected, _ = make_parser(config).read_log_lines(lines, log_type, 0)
+        counter = ParallelLogReader(make_parser(config), log_type, 3, 5, block_size=7).read(lines, 0)
+
+        assert counter.general == expected.general
+        assert counter.uri_list == expected.uri_list
+        assert counter.invalid_ips == expected.invalid_ips
+
+
+def test_parallel_reader_error_budget():
+    config = {'general': {'requestThreshold': 1}, 'uriList': {}}
+    lines = read_lines(WAF_LOG_FILE_LOCAL_PATH)
+
+    # Four bad lines spread over several blocks are tolerated
+    lines_with_errors = list(lines)
+    for i in [3, 20, 50, 90]:
+        lines_with_errors[i] = b'not a waf log line\n'
+    ParallelLogReader(make_parser(config), 'waf', 2, 5, block_size=10).read(lines_with_errors, 0)
+
+    # The fifth one stops the parsing, whatever worker found it
+    lines_with_errors[120] = b'not a waf log line\n'
+    with pytest.raises(ValueError):
+        ParallelLogReader(make_parser(config), 'waf', 2, 5, block_size=10).read(lines_with_errors, 0)
+
+
+def test_lambda_log_parser_workers():
+    os.environ['LOG_PARSER_WORKERS'] = '2'
+    config = {'general': {'requestThreshold': 1}, 'uriList': {}}
+    parser = make_parser(config)
+    os.environ.pop('LOG_PARSER_WORKERS')
+    assert parser.log_parser_workers == 2
+
+    lines = read_lines(WAF_LOG_FILE_LOCAL_PATH)
+    counter, outstanding_requesters = parser.read_log_lines(lines, 'waf', 0)
+    expected, _ = make_parser(config).read_log_lines(lines, 'waf', 0)
+    assert counter.general == expected.general
+    assert outstanding_requesters == {'general': {}, 'uriList': {}}
+
+
+def test_request_counter_pickle_drops_ip_cache():
+    parser = make_parser({'general': {'requestThreshold': 1}, 'uriList': {}})
+    counter, _ = parser.read_log_lines(read_lines(WAF_LOG_FILE_LOCAL_PATH), 'waf', 0)
+    assert len(counter.ip_keys) > 0
+
+    copy = pickle.loads(pickle.dumps(counter))
+    assert copy.ip_keys == {}
+    assert copy.general == counter.general
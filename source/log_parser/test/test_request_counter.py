@@ -0,0 +1,115 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import logging
+
+from lambda_log_parser import LambdaLogParser
+from request_counter import RequestCounter, INVALID_IP_KEY, parse_ip_key, format_ip_key, get_ip_key_version
+
+log = logging.getLogger('test_request_counter')
+
+ALB_LOG_FILE_LOCAL_PATH = "./test/test_data/XXXXXXXXXXXX_elasticloadbalancing_us-east-1_app.ApplicationLoadBalancer.fa87e1db7badc175_20230424T2110Z_X.X.X.X_4c8scnzy.log.gz"
+WAF_LOG_FILE_LOCAL_PATH = "./test/test_data/test_waf_log.gz"
+
+
+def test_ip_keys():
+    v4_key = parse_ip_key('10.0.0.1')
+    v6_key = parse_ip_key('2001:DB8::1')
+    mapped_key = parse_ip_key('::10.0.0.1')
+
+    assert get_ip_key_version(v4_key) == 4
+    assert get_ip_key_version(v6_key) == 6
+    assert v4_key != mapped_key
+    assert format_ip_key(v4_key) == '10.0.0.1'
+    assert format_ip_key(v6_key) == '2001:db8::1'
+    assert parse_ip_key('-') == INVALID_IP_KEY
+
+
+def test_request_counter_counts_per_minute():
+    counter = RequestCounter(['/login'])
+    for minute, ip, uri in [(1, '10.0.0.1', '/'), (1, '10.0.0.1', '/login'), (1, '10.0.0.1', '/login'),
+                            (2, '10.0.0.1', '/'), (2, '10.0.0.2', '/login'), (1, 'bad ip', '/login')]:
+        counter.add(minute, ip, uri)
+
+    assert counter.invalid_ips == 1
+    assert counter.get_general_max_counts(1) == {parse_ip_key('10.0.0.1'): 3, parse_ip_key('10.0.0.2'): 1}
+    assert counter.get_general_max_counts(2) == {parse_ip_key('10.0.0.1'): 3}
+    assert counter.get_urilist_max_counts('/login', 2) == {parse_ip_key('10.0.0.1'): 2}
+    assert counter.get_urilist_max_counts('/other', 1) == {}
+
+
+def test_request_counter_merge():
+    requests = [(minute % 3, '10.0.0.%d' % (minute % 5), '/login' if minute % 2 else '/') for minute in range(60)]
+    expected = RequestCounter(['/login'])
+    for request in requests:
+        expected.add(*request)
+
+    merged = RequestCounter(['/login'])
+    for start in range(0, len(requests), 7):
+        partial = RequestCounter(['/login'])
+        for request in requests[start:start + 7]:
+            partial.add(*request)
+        merged.merge(partial)
+
+    assert merged.general == expected.general
+    assert merged.uri_list == expected.uri_list
+
+
+def legacy_outstanding_requesters(lines, read_request_key, threshold):
+    """
+    String keyed counting that the integer keyed counter replaced. Invalid ips, that
+    build_ip_list_to_block used to drop, are now skipped while counting.
+    """
+    counter = {}
+    for line in lines:
+        request_key = read_request_key(line)
+        counter[request_key] = counter.get(request_key, 0) + 1
+
+    outstanding = {}
+    for request_key, num_reqs in counter.items():
+        ip = request_key.split(' ')[-1]
+        if parse_ip_key(ip) == INVALID_IP_KEY:
+            continue
+        if num_reqs >= threshold and num_reqs > outstanding.get(ip, 0):
+            outstanding[ip] = num_reqs
+    return outstanding
+
+
+def test_outstanding_requesters_match_string_keys():
+    parser = LambdaLogParser(log)
+
+    with gzip.open(WAF_LOG_FILE_LOCAL_PATH, 'r') as content:
+        waf_lines = list(content)
+    parser.config = {'general': {'requestThreshold': 1}, 'uriList': {}}
+    counter, _ = parser.read_log_lines(waf_lines, 'waf', 0)
+
+    def waf_request_key(line):
+        minute, source_ip, _, _ = parser.read_waf_log_file(line)
+        return '%d %s' % (minute, source_ip)
+
+    for threshold in [1, 2, 5]:
+        parser.config['general']['requestThreshold'] = threshold
+        outstanding_requesters = parser.get_outstanding_requesters(
+            'waf', counter, {'general': {}, 'uriList': {}})
+        assert {ip: v['max_counter_per_min'] for ip, v in outstanding_requesters['general'].items()} == \
+            legacy_outstanding_requesters(waf_lines, waf_request_key, threshold)
+
+    with gzip.open(ALB_LOG_FILE_LOCAL_PATH, 'r') as content:
+        # The sample has anonymized source ips, give them a few real ones
+        alb_lines = [line.replace(b'x.0.0.0:', b'10.0.0.%d:' % (i % 3))
+                     for i, line in enumerate(content) if not line.startswith(b'#')]
+    parser.config = {'general': {'errorThreshold': 1, 'errorCodes': ['400', '403', '404']}, 'uriList': {}}
+    counter, _ = parser.read_log_lines(alb_lines, 'alb', 0)
+
+    def alb_request_key(line):
+        line_data = line.decode().split(' ')
+        return line_data[1].rsplit(':', 1)[0] + ' ' + line_data[3].rsplit(':', 1)[0]
+
+    alb_error_lines = [line for line in alb_lines if line.decode().split(' ')[9] in ['400', '403', '404']]
+    for threshold in [1, 2, 5]:
+        parser.config['general']['errorThreshold'] = threshold
+        outstanding_requesters = parser.get_outstanding_requesters(
+            'alb', counter, {'general': {}, 'uriList': {}})
+        assert {ip: v['max_counter_per_min'] for ip, v in outstanding_requesters['general'].items()} == \
+            legacy_outstanding_requesters(alb_error_lines, alb_request_key, threshold)
@@ -0,0 +1,148 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import json
+import logging
+from os import environ
+
+import pytest
+
+from lambda_log_parser import LambdaLogParser
+from requester_state import RequesterGroup, TimestampCodec, decode_state, encode_state, get_state_format
+
+log = logging.getLogger('test_requester_state')
+
+S3_BUCKET_NAME = "test_bucket"
+WAF_LOG_OUTPUT_FILE_LOCAL_PATH = "./test/test_data/waf_stack-waf_log_out.json"
+STATE_KEY_NAME = "test-requester-state_out.json"
+
+# updated_at in epoch seconds: 2023-04-24 22:16:11, 21:00:00 and 21:30:05 UTC
+OUTSTANDING_REQUESTERS = {
+    'general': {
+        '192.168.1.1': {'max_counter_per_min': 120, 'updated_at': 1682374571},
+        '2001:db8::1': {'max_counter_per_min': 300, 'updated_at': 1682374571},
+        'x.0.0.0': {'max_counter_per_min': 715, 'updated_at': 1682370000}
+    },
+    'uriList': {
+        '/login': {'192.168.1.1': {'max_counter_per_min': 25, 'updated_at': 1682371805}},
+        '/api/*': {}
+    }
+}
+
+
+def test_get_state_format():
+    assert get_state_format(log, 'Compact') == 'compact'
+    assert get_state_format(log, 'unknown') == 'json'
+    assert get_state_format(log, None) == 'json'
+
+
+def test_compact_state_round_trip():
+    data = encode_state(OUTSTANDING_REQUESTERS, 'compact')
+    assert data[:2] == b'\x1f\x8b'
+    state = json.loads(gzip.decompress(data))
+    assert state['version'] == 1
+    assert state['general'][0] == ['x.0.0.0', 715, 1682370000]
+    assert [3232235777, 120, 1682374571] in state['general']
+    assert decode_state(data) == OUTSTANDING_REQUESTERS
+    assert list(decode_state(data)['general']) == ['x.0.0.0', '192.168.1.1', '2001:db8::1']
+
+
+def test_legacy_state_is_read():
+    with open(WAF_LOG_OUTPUT_FILE_LOCAL_PATH, 'rb') as content:
+        data = content.read()
+    timestamps = TimestampCodec()
+    legacy = json.loads(data)
+    for requesters in [legacy['general']] + list(legacy['uriList'].values()):
+        for v in requesters.values():
+            v['updated_at'] = timestamps.to_epoch(v['updated_at'])
+    assert decode_state(data) == legacy
+    assert json.loads(encode_state(OUTSTANDING_REQUESTERS))['general']['x.0.0.0']['updated_at'] == \
+        '2023-04-24 21:00:00 UTC+0000'
+    assert decode_state(encode_state(OUTSTANDING_REQUESTERS)) == OUTSTANDING_REQUESTERS
+
+
+def test_unknown_compact_version_is_rejected():
+    with pytest.raises(ValueError):
+        decode_state(gzip.compress(b'{"version": 99, "general": [], "uriList": {}}'))
+
+
+def test_compact_state_is_smaller():
+    outstanding_requesters = {'general': {}, 'uriList': {}}
+    for i in range(10000):
+        outstanding_requesters['general']['10.%d.%d.%d' % (i >> 16, (i >> 8) & 255, i & 255)] = {
+            'max_counter_per_min': 100 + i % 50, 'updated_at': 1682370011 + (i % 60) * 60}
+    compact = encode_state(outstanding_requesters, 'compact')
+    assert len(compact) * 5 < len(encode_state(outstanding_requesters))
+    assert decode_state(compact) == outstanding_requesters
+
+
+def test_requester_group_expiry_index():
+    group = RequesterGroup.from_unordered({
+        '10.0.0.1': {'max_counter_per_min': 50, 'updated_at': 300},
+        '10.0.0.2': {'max_counter_per_min': 10, 'updated_at': 100},
+        '10.0.0.3': {'max_counter_per_min': 30, 'updated_at': 200}})
+    assert list(group) == ['10.0.0.2', '10.0.0.3', '10.0.0.1']
+    assert group.min_count == 10
+
+    # Refreshed requesters move to the end, keeping their highest count
+    group.refresh('10.0.0.2', 5, 400)
+    assert list(group) == ['10.0.0.3', '10.0.0.1', '10.0.0.2']
+    assert group['10.0.0.2'] == {'max_counter_per_min': 10, 'updated_at': 400}
+
+    assert group.pop_expired(300) == ['10.0.0.3', '10.0.0.1']
+    assert list(group) == ['10.0.0.2']
+    assert group.pop_below(10) == []
+    assert group.pop_below(20) == ['10.0.0.2']
+    assert group == {}
+
+
+def test_merge_prunes_every_urilist_entry():
+    parser = LambdaLogParser(log)
+    parser.config = {
+        'general': {'requestThreshold': 10, 'blockPeriod': 60},
+        'uriList': {'/login': {'requestThreshold': 5}, '/api/*': {'requestThreshold': 20}}
+    }
+    utc_now = 1682374571
+    remote_outstanding_requesters = decode_state(encode_state({
+        'general': {},
+        'uriList': {
+            '/login': {'10.0.0.1': {'max_counter_per_min': 8, 'updated_at': utc_now - 7200},
+                       '10.0.0.2': {'max_counter_per_min': 8, 'updated_at': utc_now - 60}},
+            '/api/*': {'10.0.0.1': {'max_counter_per_min': 30, 'updated_at': utc_now - 7200},
+                       '10.0.0.3': {'max_counter_per_min': 10, 'updated_at': utc_now - 60},
+                       '10.0.0.4': {'max_counter_per_min': 25, 'updated_at': utc_now - 60}}
+        }
+    }, 'compact'))
+    outstanding_requesters = {'general': {}, 'uriList': {
+        '/api/*': {'10.0.0.5': {'max_counter_per_min': 40, 'updated_at': utc_now}}}}
+
+    merged, force_update = parser.merge_urilist_outstanding_requesters(
+        'requestThreshold', remote_outstanding_requesters, outstanding_requesters, utc_now, False)
+    assert force_update
+    assert merged['uriList'] == {
+        '/login': {'10.0.0.2': {'max_counter_per_min': 8, 'updated_at': utc_now - 60}},
+        '/api/*': {'10.0.0.4': {'max_counter_per_min': 25, 'updated_at': utc_now - 60},
+                   '10.0.0.5': {'max_counter_per_min': 40, 'updated_at': utc_now}}
+    }
+
+
+def test_parser_writes_and_reads_state_in_memory(s3_client):
+    environ['STATE_FORMAT'] = 'compact'
+    parser = LambdaLogParser(log)
+    environ.pop('STATE_FORMAT')
+
+    parser.write_output(S3_BUCKET_NAME, 'AWSLogs/test.gz', STATE_KEY_NAME, OUTSTANDING_REQUESTERS)
+    body = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=STATE_KEY_NAME)['Body'].read()
+    assert body[:2] == b'\x1f\x8b'
+    assert parser.get_current_blocked_ips(S3_BUCKET_NAME, 'AWSLogs/test.gz', STATE_KEY_NAME) == \
+        OUTSTANDING_REQUESTERS
+
+    # A parser still writing json reads the compact state, and the other way around
+    parser = LambdaLogParser(log)
+    assert parser.get_current_blocked_ips(S3_BUCKET_NAME, 'AWSLogs/test.gz', STATE_KEY_NAME) == \
+        OUTSTANDING_REQUESTERS
+    parser.write_output(S3_BUCKET_NAME, 'AWSLogs/test.gz', STATE_KEY_NAME, OUTSTANDING_REQUESTERS)
+    body = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=STATE_KEY_NAME)['Body'].read()
+    assert json.loads(body)['uriList']['/login']['192.168.1.1']['updated_at'] == '2023-04-24 21:30:05 UTC+0000'
+    assert decode_state(body) == OUTSTANDING_REQUESTERS
@@ -0,0 +1,122 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import io
+import logging
+
+import pytest
+from botocore.exceptions import ClientError
+from botocore.response import StreamingBody
+
+from lib.s3_util import S3
+from s3_log_stream import iter_gzip_lines, iter_log_lines, iter_object_chunks
+
+log = logging.getLogger('test_s3_log_stream')
+
+S3_BUCKET_NAME = "test_bucket"
+WAF_LOG_FILE_LOCAL_PATH = "./test/test_data/test_waf_log.gz"
+ALB_LOG_FILE_LOCAL_PATH = "./test/test_data/XXXXXXXXXXXX_elasticloadbalancing_us-east-1_app.ApplicationLoadBalancer.fa87e1db7badc175_20230424T2110Z_X.X.X.X_4c8scnzy.log.gz"
+ALB_LOG_FILE_S3_KEY = "AWSLogs/XXXXXXXXXXXX/elasticloadbalancing/us-east-1/2023/04/24/XXXXXXXXXXXX_elasticloadbalancing_us-east-1_app.ApplicationLoadBalancer.fa87e1db7badc175_20230424T2110Z_X.X.X.X_4c8scnzy.log.gz"
+
+
+def read_lines_with_gzip(file_path):
+    with gzip.open(file_path, 'r') as content:
+        return [line.rstrip(b'\n') for line in content]
+
+
+def split_in_chunks(data, chunk_size):
+    return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+
+class RecordingS3(object):
+    """
+    S3 util stand-in serving one object and recording the range of each GET. Like S3, a ranged GET of
+    an empty object fails with InvalidRange.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.ranges = []
+
+    def get_object(self, bucket_name, key_name, byte_range=None):
+        self.ranges.append(byte_range)
+        response = {}
+        body = self.data
+        if byte_range is not None:
+            if not self.data:
+                raise ClientError({'Error': {'Code': 'InvalidRange', 'Message': 'The requested range is not '
+                                                                                'satisfiable'}}, 'GetObject')
+            body = self.data[byte_range[0]:byte_range[1] + 1]
+            response['ContentRange'] = 'bytes %d-%d/%d' % (byte_range[0], byte_range[0] + len(body) - 1,
+                                                           len(self.data))
+        response['ContentLength'] = len(body)
+        response['Body'] = StreamingBody(io.BytesIO(body), len(body))
+        return response
+
+
+def test_iter_gzip_lines_matches_gzip_module():
+    with open(WAF_LOG_FILE_LOCAL_PATH, 'rb') as f:
+        data = f.read()
+    expected = read_lines_with_gzip(WAF_LOG_FILE_LOCAL_PATH)
+
+    for chunk_size in [1, 37, 4096, len(data)]:
+        lines = list(iter_gzip_lines(split_in_chunks(data, chunk_size), max_block_size=512))
+        assert lines == expected
+
+
+def test_iter_gzip_lines_multiple_members():
+    first = b'line 1\nline 2\npartial '
+    second = b'line 3\nline 4\n'
+    data = gzip.compress(first) + gzip.compress(second)
+
+    lines = list(iter_gzip_lines(split_in_chunks(data, 5)))
+    assert lines == [b'line 1', b'line 2', b'partial line 3', b'line 4']
+
+
+def test_iter_gzip_lines_truncated_object():
+    data = gzip.compress(b'line 1\nline 2\n' * 100)
+    with pytest.raises(EOFError):
+        list(iter_gzip_lines([data[:-20]]))
+
+
+def test_iter_object_chunks_ranged_get():
+    s3_util = S3(log)
+    with open(ALB_LOG_FILE_LOCAL_PATH, 'rb') as f:
+        expected = f.read()
+
+    chunks = iter_object_chunks(s3_util, S3_BUCKET_NAME, ALB_LOG_FILE_S3_KEY,
+                                max_concurrency=3, part_size=100)
+    assert b''.join(chunks) == expected
+
+
+def test_iter_log_lines_ranged_get():
+    s3_util = S3(log)
+    expected = read_lines_with_gzip(ALB_LOG_FILE_LOCAL_PATH)
+
+    lines = iter_log_lines(s3_util, S3_BUCKET_NAME, ALB_LOG_FILE_S3_KEY,
+                           max_concurrency=2, part_size=256)
+    assert list(lines) == expected
+
+
+def test_iter_log_lines_plain_get_for_empty_or_small_objects():
+    data = gzip.compress(b'line 1\nline 2\n')
+    small = RecordingS3(data)
+    assert list(iter_log_lines(small, S3_BUCKET_NAME, 'small.gz', max_concurrency=4, part_size=1024,
+                               object_size=len(data))) == [b'line 1', b'line 2']
+    assert small.ranges == [None]
+
+    empty = RecordingS3(b'')
+    assert list(iter_log_lines(empty, S3_BUCKET_NAME, 'empty.gz', max_concurrency=4, part_size=1024,
+                               object_size=0)) == []
+    assert empty.ranges == [None]
+
+    # Size unknown: the ranged GET of the empty object fails, a plain GET follows
+    empty = RecordingS3(b'')
+    assert list(iter_log_lines(empty, S3_BUCKET_NAME, 'empty.gz', max_concurrency=4, part_size=1024)) == []
+    assert empty.ranges == [(0, 1023), None]
+
+    large = RecordingS3(data)
+    assert list(iter_log_lines(large, S3_BUCKET_NAME, 'large.gz', max_concurrency=4, part_size=10,
+                               object_size=len(data))) == [b'line 1', b'line 2']
+    assert large.ranges[0] == (0, 9) and len(large.ranges) == (len(data) + 9) // 10
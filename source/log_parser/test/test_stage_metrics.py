@@ -0,0 +1,76 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import logging
+import time
+
+from stage_metrics import ListMetricsSink, NullStageMetrics, StageMetrics, get_stage_metrics
+
+log = logging.getLogger('test_stage_metrics')
+
+
+def test_get_stage_metrics():
+    assert isinstance(get_stage_metrics(log), NullStageMetrics)
+    assert isinstance(get_stage_metrics(log, 'Yes'), StageMetrics)
+
+
+def test_flush_writes_embedded_metric_format():
+    sink = ListMetricsSink()
+    metrics = StageMetrics('Test', sink)
+    metrics.set_dimension('LogType', 'alb')
+    metrics.set_property('KeyName', 'AWSLogs/a.gz')
+    with metrics.stage('Parse'):
+        pass
+    with metrics.stage('Parse'):
+        pass
+    metrics.add('Lines', 10)
+    metrics.add('Lines', 5)
+
+    timestamp = int(time.time())
+    record = metrics.flush(timestamp=timestamp)
+    assert sink.records == [record]
+    assert record['LogType'] == 'alb'
+    assert record['KeyName'] == 'AWSLogs/a.gz'
+    assert record['Lines'] == [15]
+    assert record['ParseTime'][0] >= 0
+    assert record['_aws'] == {
+        'Timestamp': timestamp * 1000,
+        'CloudWatchMetrics': [{
+            'Namespace': 'Test',
+            'Dimensions': [['LogType']],
+            'Metrics': [{'Name': 'Lines', 'Unit': 'Count'}, {'Name': 'ParseTime', 'Unit': 'Milliseconds'}]
+        }]
+    }
+
+    # Nothing recorded since the last flush
+    assert metrics.flush() is None
+    assert len(sink.records) == 1
+
+
+def test_count_lines():
+    metrics = StageMetrics('Test', ListMetricsSink())
+    lines = metrics.count_lines([b'a\n', b'bc\n'])
+    assert list(lines) == [b'a\n', b'bc\n']
+    metrics.add_line_counts(lines)
+
+    with gzip.open('./test/test_data/test_waf_log.gz', 'r') as content:
+        expected = content.read()
+    with gzip.open('./test/test_data/test_waf_log.gz', 'r') as content:
+        lines = metrics.count_lines(content)
+        assert lines.read(100) + lines.readline() + lines.read() == expected
+        metrics.add_line_counts(lines)
+
+    record = metrics.flush()
+    assert record['Lines'] == [2 + expected.count(b'\n')]
+    assert record['Bytes'] == [5 + len(expected)]
+
+
+def test_disabled_metrics_leave_lines_unchanged():
+    metrics = NullStageMetrics()
+    lines = [b'a\n']
+    assert metrics.count_lines(lines) is lines
+    with metrics.stage('Parse'):
+        metrics.add('Lines', 1)
+    assert metrics.flush() is None
+
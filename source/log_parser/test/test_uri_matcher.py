@@ -0,0 +1,76 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+import pickle
+
+from lambda_log_parser import LambdaLogParser
+from request_counter import RequestCounter, parse_ip_key
+from uri_matcher import UriMatcher
+
+log = logging.getLogger('test_uri_matcher')
+
+PATTERNS = ['/login', '/api/login*', '/api/*', '/wp-*/xmlrpc.php', '/item/?']
+
+
+def test_uri_matcher():
+    matcher = UriMatcher(PATTERNS)
+    assert matcher.match('/login') == (0,)
+    assert matcher.match('/login/') == ()
+    assert matcher.match('/api/login') == (1, 2)
+    assert matcher.match('/api/login/v2') == (1, 2)
+    assert matcher.match('/api/items') == (2,)
+    assert matcher.match('/wp-admin/xmlrpc.php') == (3,)
+    assert matcher.match('/wp-content/plugins/xmlrpc.php') == (3,)
+    assert matcher.match('/wp-admin/xmlrpc.php.bak') == ()
+    assert matcher.match('/item/7') == (4,)
+    assert matcher.match('/item/77') == ()
+    assert UriMatcher().match('/login') == ()
+
+
+def test_uri_matcher_cache_is_bounded():
+    matcher = UriMatcher(PATTERNS, cache_size=3)
+    for i in range(10):
+        matcher.match('/api/%d' % i)
+    assert len(matcher.cache) <= 3
+    assert matcher.match('/api/0') == (2,)
+
+    # Not shipped to other processes
+    assert pickle.loads(pickle.dumps(matcher)).cache == {}
+
+
+def test_request_counter_counts_every_matching_pattern():
+    counter = RequestCounter(PATTERNS)
+    for uri in ['/api/login', '/api/login/v2', '/api/items', '/login', '/wp-admin/xmlrpc.php']:
+        counter.add(1, '10.0.0.1', uri)
+    counter.add_requests(1, '10.0.0.1', '/api/login', 3)
+
+    ip_key = parse_ip_key('10.0.0.1')
+    assert counter.get_urilist_max_counts('/login', 1) == {ip_key: 1}
+    assert counter.get_urilist_max_counts('/api/login*', 1) == {ip_key: 5}
+    assert counter.get_urilist_max_counts('/api/*', 1) == {ip_key: 6}
+    assert counter.get_urilist_max_counts('/wp-*/xmlrpc.php', 1) == {ip_key: 1}
+    assert counter.get_urilist_max_counts('/item/?', 1) == {}
+
+
+def test_outstanding_requesters_are_keyed_by_pattern():
+    parser = LambdaLogParser(log)
+    parser.config = {
+        'general': {'requestThreshold': 100, 'blockPeriod': 240},
+        'uriList': {'/api/login*': {'requestThreshold': 2}}
+    }
+    counter = parser.new_request_counter()
+    for uri in ['/api/login', '/api/login/v2', '/api/logout']:
+        counter.add(1, '10.0.0.1', uri)
+
+    outstanding_requesters = parser.get_outstanding_requesters('waf', counter, {'general': {}, 'uriList': {}})
+    assert list(outstanding_requesters['uriList'].keys()) == ['/api/login*']
+    assert outstanding_requesters['uriList']['/api/login*']['10.0.0.1']['max_counter_per_min'] == 2
+
+    # State of patterns removed from the config is dropped
+    remote_outstanding_requesters = {'general': {}, 'uriList': {'/old*': {'10.0.0.2': {
+        'max_counter_per_min': 5, 'updated_at': 1682370000}}}}
+    merged, force_update = parser.merge_urilist_outstanding_requesters(
+        'requestThreshold', remote_outstanding_requesters, {'general': {}, 'uriList': {}}, 1682374571, False)
+    assert force_update
+    assert merged == {'general': {}, 'uriList': {}}
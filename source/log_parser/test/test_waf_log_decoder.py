@@ -0,0 +1,76 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import gzip
+import json
+import logging
+from urllib.parse import urlparse
+
+import pytest
+
+from lambda_log_parser import LambdaLogParser
+from waf_log_decoder import WafLogDecoder, OrjsonWafLogDecoder, ScanningWafLogDecoder, \
+    get_waf_log_decoder, get_uri_path, orjson
+
+log = logging.getLogger('test_waf_log_decoder')
+
+WAF_LOG_FILE_LOCAL_PATH = "./test/test_data/test_waf_log.gz"
+
+
+def read_waf_lines():
+    with gzip.open(WAF_LOG_FILE_LOCAL_PATH, 'r') as content:
+        return list(content)
+
+
+def legacy_projection(line):
+    line_data = json.loads(line.decode())
+    return (int(line_data['timestamp']) // 60000, line_data['httpRequest']['clientIp'],
+            urlparse(line_data['httpRequest']['uri']).path)
+
+
+def test_decoders_match_json_projection():
+    decoders = [WafLogDecoder(), ScanningWafLogDecoder()]
+    if orjson is not None:
+        decoders.append(OrjsonWafLogDecoder())
+
+    for line in read_waf_lines():
+        line_data = json.loads(line)
+        expected = (line_data['timestamp'], line_data['httpRequest']['clientIp'], line_data['httpRequest']['uri'])
+        for decoder in decoders:
+            assert decoder.decode(line) == expected
+            assert decoder.decode(line.rstrip(b'\n')) == expected
+
+
+def test_scanning_decoder_falls_back_to_json():
+    decoder = ScanningWafLogDecoder()
+    escaped = b'{"timestamp":1682374606245,"httpRequest":{"clientIp":"10.0.0.1","uri":"/a\\u0020b\\"c"}}'
+    spaced = b'{"timestamp": 1682374606245, "httpRequest": {"uri": "/login", "clientIp": "10.0.0.2"}}'
+    last_field = b'{"httpRequest":{"clientIp":"10.0.0.3","uri":"/x"},"timestamp":1682374606245}'
+
+    assert decoder.decode(escaped) == (1682374606245, '10.0.0.1', '/a b"c')
+    assert decoder.decode(spaced) == (1682374606245, '10.0.0.2', '/login')
+    assert decoder.decode(last_field) == (1682374606245, '10.0.0.3', '/x')
+    with pytest.raises(ValueError):
+        decoder.decode(b'not a waf log line')
+
+
+def test_get_uri_path_matches_urlparse():
+    uris = ['/', '/login', '/a/b.js', '/a;b', '/a?x=1', '/a#frag', '//host/path', 'http://host:80/p?q',
+            '', 'relative/path', ' /lead', '/tab\there', '/a b']
+    for uri in uris:
+        assert get_uri_path(uri) == urlparse(uri).path
+
+
+def test_get_waf_log_decoder():
+    assert get_waf_log_decoder(log).name == 'scan'
+    assert get_waf_log_decoder(log, 'JSON').name == 'json'
+    assert get_waf_log_decoder(log, 'unknown').name == 'json'
+    assert get_waf_log_decoder(log, 'orjson').name == ('json' if orjson is None else 'orjson')
+
+
+def test_read_waf_log_file():
+    parser = LambdaLogParser(log)
+    for line in read_waf_lines():
+        minute, source_ip, uri, code = parser.read_waf_log_file(line)
+        assert (minute, source_ip, uri) == legacy_projection(line)
+        assert code is None
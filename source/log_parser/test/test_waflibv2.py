@@ -0,0 +1,79 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+
+from lib.waflibv2 import WAFLIBv2
+
+log = logging.getLogger('test_waflibv2')
+
+SCOPE = 'REGIONAL'
+IP_SET_ARN_V4 = 'arn:aws:wafv2:us-east-1:111111111111:regional/ipset/test-v4/id-v4'
+
+
+def test_commit_ip_set_skips_unchanged_ip_sets(wafv2_client):
+    waflib = WAFLIBv2()
+
+    applied, response = waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.1/32', '10.0.1.0/24'])
+    assert applied
+    assert response == {'NextLockToken': 'token-1'}
+
+    # Same set, in another order and spelling: nothing written
+    applied, response = waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.1.0/24', '10.0.0.1/32 '])
+    assert not applied
+    assert response['IPSet']['Addresses'] == ['10.0.0.1/32', '10.0.1.0/24']
+    assert wafv2_client.calls == {'get_ip_set': 1, 'update_ip_set': 1}
+
+    # update_ip_set returns the IP set after the update
+    response = waflib.update_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.2/32'])
+    assert response['IPSet']['Addresses'] == ['10.0.0.2/32']
+    assert response['LockToken'] == 'token-2'
+    assert waflib.update_counters == {'test-v4': {'applied': 2, 'skipped': 1}}
+
+
+def test_commit_ip_set_without_ip_set():
+    assert WAFLIBv2().commit_ip_set(log, SCOPE, 'test-v4', None, []) == (False, None)
+
+
+def test_snapshots_save_ip_set_reads(wafv2_client):
+    waflib = WAFLIBv2()
+    for i in range(5):
+        waflib.update_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.%d/32' % i])
+    assert waflib.get_ip_address_count(log, SCOPE, 'test-v4', IP_SET_ARN_V4) == 1
+    applied, _ = waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.4/32'], merge=True)
+    assert not applied
+
+    # Without snapshots: a read before and after each of the 5 updates, then 1 for the count, 1 for the merge
+    assert wafv2_client.calls == {'get_ip_set': 1, 'update_ip_set': 5}
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.4/32']
+
+
+def test_stale_lock_token_refreshes_the_snapshot(wafv2_client, ip_set_snapshots):
+    waflib = WAFLIBv2()
+    waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.1/32'])
+    # Someone else adds an address
+    wafv2_client.put_ip_set('id-v4', 'test-v4', ['10.0.0.1/32', '10.0.0.2/32'])
+
+    applied, response = waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.3/32'], merge=True,
+                                             read_back=True)
+    assert applied
+    assert response['IPSet']['Addresses'] == ['10.0.0.1/32', '10.0.0.2/32', '10.0.0.3/32']
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.1/32', '10.0.0.2/32', '10.0.0.3/32']
+    # The rejected update, then a read for the new lock token
+    assert wafv2_client.calls == {'get_ip_set': 2, 'update_ip_set': 3}
+    assert ip_set_snapshots.get(SCOPE, 'id-v4')['LockToken'] == 'token-3'
+
+
+def test_expired_snapshots_are_read_again(wafv2_client, monkeypatch):
+    monkeypatch.setenv('IP_SET_CACHE_TTL_SECONDS', '0')
+    waflib = WAFLIBv2()
+    waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.1/32'])
+    wafv2_client.put_ip_set('id-v4', 'test-v4', [])
+
+    # Writes that would change nothing and read-only callers see the IP set as it is
+    applied, _ = waflib.commit_ip_set(log, SCOPE, 'test-v4', IP_SET_ARN_V4, ['10.0.0.1/32'])
+    assert applied
+    assert wafv2_client.ip_sets['id-v4']['Addresses'] == ['10.0.0.1/32']
+    wafv2_client.put_ip_set('id-v4', 'test-v4', [])
+    assert waflib.get_ip_address_count(log, SCOPE, 'test-v4', IP_SET_ARN_V4) == 0
+    assert wafv2_client.calls == {'get_ip_set': 3, 'update_ip_set': 2}
@@ -0,0 +1,132 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import logging
+import os
+
+import boto3
+from moto import mock_dynamodb
+
+from lib.s3_util import S3
+from lambda_log_parser import LambdaLogParser
+from request_counter import RequestCounter, parse_ip_key
+from window_store import MEMORY_WINDOWS, MemoryWindowStore, S3WindowStore, DynamoDBWindowStore, \
+    aggregate_counter, get_part_id, get_window_store
+
+log = logging.getLogger('test_window_store')
+
+S3_BUCKET_NAME = "test_bucket"
+REGION = "us-east-1"
+IP_1 = parse_ip_key('10.0.0.1')
+IP_2 = parse_ip_key('10.0.0.2')
+IP_6 = parse_ip_key('2001:db8::1')
+
+
+def add_parts(store, namespace):
+    first = store.add(namespace, 'part-1', 100, {'general': {IP_1: 3, IP_2: 1}, '/login': {IP_1: 2}})
+    second = store.add(namespace, 'part-2', 100, {'general': {IP_1: 4, IP_6: 5}})
+    third = store.add(namespace, 'part-3', 100, {'general': {IP_2: 2}, '/login': {IP_1: 1}})
+    other_minute = store.add(namespace, 'part-3', 101, {'general': {IP_1: 1}})
+    return first, second, third, other_minute
+
+
+def assert_totals(first, second, third, other_minute):
+    assert first == {'general': {IP_1: 3, IP_2: 1}, '/login': {IP_1: 2}}
+    assert second == {'general': {IP_1: 7, IP_6: 5}}
+    assert third == {'general': {IP_2: 3}, '/login': {IP_1: 3}}
+    assert other_minute == {'general': {IP_1: 1}}
+
+
+def test_memory_window_store():
+    store = MemoryWindowStore(ttl_minutes=10)
+    assert_totals(*add_parts(store, 'memory-namespace'))
+
+    store.add('memory-namespace', 'part-4', 111, {'general': {IP_1: 1}})
+    assert ('memory-namespace', 100) not in MEMORY_WINDOWS
+    assert ('memory-namespace', 101) in MEMORY_WINDOWS
+
+
+def assert_retried_part_is_counted_once(store, namespace):
+    first = store.add(namespace, 'retried-part', 200, {'general': {IP_1: 3, IP_2: 1}, '/login': {IP_1: 2}})
+    retried = store.add(namespace, 'retried-part', 200, {'general': {IP_1: 3, IP_2: 1}, '/login': {IP_1: 2}})
+    other = store.add(namespace, 'other-part', 200, {'general': {IP_1: 1}})
+    assert retried == first == {'general': {IP_1: 3, IP_2: 1}, '/login': {IP_1: 2}}
+    assert other == {'general': {IP_1: 4}}
+
+
+def test_memory_window_store_retried_part():
+    assert_retried_part_is_counted_once(MemoryWindowStore(), 'memory-retry-namespace')
+
+
+def test_s3_window_store():
+    store = S3WindowStore(S3(log), S3_BUCKET_NAME)
+    assert_totals(*add_parts(store, 's3-namespace'))
+
+    # A retried log file overwrites its own part
+    totals = store.add('s3-namespace', 'part-2', 100, {'general': {IP_1: 4, IP_6: 5}})
+    assert totals == {'general': {IP_1: 7, IP_6: 5}}
+
+    # Another container only knows the parts from S3
+    totals = S3WindowStore(S3(log), S3_BUCKET_NAME).add('s3-namespace', 'part-5', 100, {'general': {IP_6: 1}})
+    assert totals == {'general': {IP_6: 6}}
+
+
+def test_dynamodb_window_store():
+    with mock_dynamodb():
+        table = boto3.resource('dynamodb', region_name=REGION).create_table(
+            TableName='window_counts',
+            KeySchema=[{'AttributeName': 'pk', 'KeyType': 'HASH'}],
+            AttributeDefinitions=[{'AttributeName': 'pk', 'AttributeType': 'S'}],
+            BillingMode='PAY_PER_REQUEST')
+        store = DynamoDBWindowStore(table, shards=2, batch_size=1, max_concurrency=2)
+        assert_totals(*add_parts(store, 'ddb-namespace'))
+
+        items = table.scan()['Items']
+        # general@100 spans both shards, /login@100 and general@101 one each
+        assert len(items) == 4
+        assert all(item['expires_at'] in [(100 + 60) * 60, (101 + 60) * 60] for item in items)
+
+        assert_retried_part_is_counted_once(store, 'ddb-retry-namespace')
+
+
+def test_get_window_store():
+    assert get_window_store(log, 'none', None, S3_BUCKET_NAME) is None
+    assert get_window_store(log, 'unknown', None, S3_BUCKET_NAME) is None
+    assert isinstance(get_window_store(log, 'Memory', None, S3_BUCKET_NAME), MemoryWindowStore)
+    assert get_window_store(log, 's3', None, S3_BUCKET_NAME).bucket_name == S3_BUCKET_NAME
+
+
+def test_aggregate_counter():
+    store = MemoryWindowStore()
+    first = RequestCounter(['/login'])
+    second = RequestCounter(['/login'])
+    for minute, ip, uri in [(200, '10.0.0.1', '/login'), (200, '10.0.0.2', '/'), (201, '10.0.0.1', '/')]:
+        first.add(minute, ip, uri)
+    for minute, ip, uri in [(200, '10.0.0.1', '/login'), (202, '10.0.0.2', '/login')]:
+        second.add(minute, ip, uri)
+
+    aggregate_counter(store, 'aggregate-namespace', ['AWSLogs/first.gz'], first)
+    totals = aggregate_counter(store, 'aggregate-namespace', ['AWSLogs/second.gz'], second)
+    assert totals.general == {200: {IP_1: 2}, 202: {IP_2: 1}}
+    assert totals.uri_list == [{200: {IP_1: 2}, 202: {IP_2: 1}}]
+    assert get_part_id(['b', 'a']) == get_part_id(['a', 'b'])
+
+
+def test_threshold_across_log_files():
+    os.environ['WINDOW_STORE'] = 'memory'
+    parser = LambdaLogParser(log)
+    os.environ.pop('WINDOW_STORE')
+    parser.config = {'general': {'requestThreshold': 3}, 'uriList': {}}
+
+    for i, ips in enumerate([['10.0.1.1', '10.0.1.1'], ['10.0.1.1', '10.0.1.2']]):
+        counter = RequestCounter()
+        for ip in ips:
+            counter.add(300, ip, '/')
+        counter = parser.aggregate_window_counts(
+            S3_BUCKET_NAME, ['AWSLogs/%d.gz' % i], 'threshold-namespace', counter)
+        outstanding_requesters = parser.get_outstanding_requesters(
+            'waf', counter, {'general': {}, 'uriList': {}})
+
+    # Each file is below the threshold, the minute isn't
+    assert list(outstanding_requesters['general'].keys()) == ['10.0.1.1']
+    assert outstanding_requesters['general']['10.0.1.1']['max_counter_per_min'] == 3
@@ -0,0 +1,63 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import re
+from fnmatch import translate
+
+GLOB_CHARS = re.compile(r'[*?\[]')
+URI_MATCH_CACHE_SIZE = 10000    # distinct uris remembered by a UriMatcher
+
+
+class UriMatcher(object):
+    """
+    Match request uris against the uriList entries of a config, compiled once:
+      exact path: /login
+      prefix:     /api/login*
+      glob:       /wp-*/xmlrpc.php (fnmatch syntax: * ? [seq], * also matches /)
+
+    Exact paths are a dict lookup. Prefixes and globs are combined into a single
+    regular expression with one optional lookahead per pattern, so one match
+    returns every pattern matching the uri. Results are cached per uri, as most
+    requests go to a limited set of uris.
+    """
+
+    def __init__(self, patterns=(), cache_size=URI_MATCH_CACHE_SIZE):
+        self.patterns = tuple(patterns)
+        self.cache_size = cache_size
+        self.cache = {}                 # uri -> tuple of pattern ids
+        self.exact = {}                 # uri -> tuple of pattern ids
+        self.glob_ids = []              # regex group -> pattern id
+        lookaheads = []
+        for pattern_id, pattern in enumerate(self.patterns):
+            if GLOB_CHARS.search(pattern) is None:
+                self.exact[pattern] = self.exact.get(pattern, ()) + (pattern_id,)
+            else:
+                lookaheads.append('(?=(%s))?' % translate(pattern))
+                self.glob_ids.append(pattern_id)
+        self.regex = re.compile(''.join(lookaheads)) if lookaheads else None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['cache'] = {}
+        return state
+
+    def match(self, uri):
+        """
+        Return the ids (positions in patterns) of the patterns matching uri, in order.
+        """
+        pattern_ids = self.cache.get(uri)
+        if pattern_ids is not None:
+            return pattern_ids
+
+        pattern_ids = self.exact.get(uri, ())
+        if self.regex is not None:
+            # Every lookahead is optional, so the regex always matches
+            glob_ids = tuple(pattern_id for pattern_id, group in zip(self.glob_ids, self.regex.match(uri).groups())
+                             if group is not None)
+            if glob_ids:
+                pattern_ids = tuple(sorted(pattern_ids + glob_ids))
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[uri] = pattern_ids
+        return pattern_ids
@@ -0,0 +1,114 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import json
+import re
+from urllib.parse import urlparse
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+# Characters that make urlparse().path differ from the raw uri of a request line
+URI_NEEDS_URLPARSE = re.compile(r'[;?#\t\r\n]')
+
+RECORD_START = b'{"timestamp":'
+HTTP_REQUEST_FIELD = b'"httpRequest":{'
+CLIENT_IP_FIELD = b'"clientIp":"'
+URI_FIELD = b'"uri":"'
+
+
+def get_uri_path(uri):
+    """
+    Return the same value as urlparse(uri).path, skipping the parse for plain absolute paths.
+    """
+    if uri[:1] == '/' and uri[:2] != '//' and URI_NEEDS_URLPARSE.search(uri) is None:
+        return uri
+    return urlparse(uri).path
+
+
+class WafLogDecoder(object):
+    """
+    Decode an AWS WAF log line into the only fields the lambda log parser uses:
+    (timestamp in milliseconds, client ip, uri). This default decoder parses the
+    whole record with the json module.
+    """
+    name = 'json'
+
+    def loads(self, line):
+        return json.loads(line)
+
+    def decode(self, line):
+        line_data = self.loads(line)
+        http_request = line_data['httpRequest']
+        return int(line_data['timestamp']), http_request['clientIp'], http_request['uri']
+
+
+class OrjsonWafLogDecoder(WafLogDecoder):
+    """
+    Same projection as WafLogDecoder, parsing the record with orjson.
+    """
+    name = 'orjson'
+
+    def loads(self, line):
+        return orjson.loads(line)
+
+
+class ScanningWafLogDecoder(WafLogDecoder):
+    """
+    Extract timestamp, httpRequest.clientIp and httpRequest.uri by scanning the raw
+    bytes of the record, without building the rest of it. Lines that do not have the
+    compact layout written by AWS WAF (timestamp first, no whitespace), or whose values
+    contain escape sequences, are handed over to the json based decoder.
+    """
+    name = 'scan'
+
+    def decode(self, line):
+        request_start = line.find(HTTP_REQUEST_FIELD)
+        if request_start < 0 or not line.startswith(RECORD_START):
+            return super().decode(line)
+
+        start = len(RECORD_START)
+        end = line.find(b',', start)
+        ip_start = line.find(CLIENT_IP_FIELD, request_start)
+        uri_start = line.find(URI_FIELD, request_start)
+        if end < 0 or ip_start < 0 or uri_start < 0:
+            return super().decode(line)
+
+        ip_start += len(CLIENT_IP_FIELD)
+        uri_start += len(URI_FIELD)
+        ip = line[ip_start:line.find(b'"', ip_start)]
+        uri = line[uri_start:line.find(b'"', uri_start)]
+        if b'\\' in uri or b'\\' in ip:
+            return super().decode(line)
+
+        try:
+            timestamp = int(line[start:end])
+        except ValueError:
+            return super().decode(line)
+
+        return timestamp, ip.decode(), uri.decode()
+
+
+WAF_LOG_DECODERS = {
+    'json': WafLogDecoder,
+    'orjson': OrjsonWafLogDecoder,
+    'scan': ScanningWafLogDecoder
+}
+
+
+def get_waf_log_decoder(log, name='auto'):
+    """
+    Return a decoder instance given its name (auto, json, orjson or scan).
+    """
+    name = (name or 'auto').lower()
+    if name == 'auto':
+        name = 'scan'
+    if name == 'orjson' and orjson is None:
+        log.warning("[waf_log_decoder: get_waf_log_decoder] orjson is not installed. Using json decoder.")
+        name = 'json'
+    if name not in WAF_LOG_DECODERS:
+        log.warning("[waf_log_decoder: get_waf_log_decoder] Unknown decoder %s. Using json decoder." % name)
+        name = 'json'
+    return WAF_LOG_DECODERS[name]()
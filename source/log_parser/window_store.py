@@ -0,0 +1,237 @@
+#  Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+#  SPDX-License-Identifier: Apache-2.0
+
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from request_counter import RequestCounter
+
+WINDOW_STORE_PREFIX = 'window_counts/'
+WINDOW_TTL_MINUTES = 60
+DYNAMODB_SHARDS = 32            # items per (namespace, minute, scope), keeps items far below 400 KB
+DYNAMODB_BATCH_SIZE = 100       # counters per UpdateItem, keeps the update expression below 4 KB
+DYNAMODB_MAX_CONCURRENCY = 8
+
+# Module level, so they survive warm invocations
+MEMORY_WINDOWS = {}             # (namespace, minute) -> {scope: {ip_key: count}}
+MEMORY_PARTS = {}               # (namespace, minute) -> {part id}
+S3_PARTS_CACHE = {}             # (bucket name, namespace, minute) -> {object key: {scope: {ip_key: count}}}
+
+
+class WindowStore(ABC):
+    """
+    Per-minute request counts shared by all the log files of a namespace (the
+    output file of the log type), so thresholds are evaluated on the requests
+    an ip sent in a minute across log files and not within each file only.
+
+    Scopes are 'general' and the uriList uris.
+    """
+
+    def __init__(self, ttl_minutes=WINDOW_TTL_MINUTES):
+        self.ttl_minutes = ttl_minutes
+
+    @abstractmethod
+    def add(self, namespace, part_id, minute, scope_counts):
+        """
+        Add {scope: {ip_key: count}} for one minute and return the resulting
+        totals {scope: {ip_key: total}} for the same ips. Idempotent per part_id:
+        the counts of a part already added (a retried log file) are not added again.
+        """
+
+
+class MemoryWindowStore(WindowStore):
+    """
+    Counts kept in the container memory. Only complete when the log files of a
+    namespace are processed by a single container, e.g. with batched records.
+    """
+
+    def add(self, namespace, part_id, minute, scope_counts):
+        window = MEMORY_WINDOWS.setdefault((namespace, minute), {})
+        parts = MEMORY_PARTS.setdefault((namespace, minute), set())
+        added = part_id not in parts
+        parts.add(part_id)
+        totals = {}
+        for scope, counts in scope_counts.items():
+            stored = window.setdefault(scope, {})
+            if added:
+                for ip_key, num_reqs in counts.items():
+                    stored[ip_key] = stored.get(ip_key, 0) + num_reqs
+            totals[scope] = {ip_key: stored.get(ip_key, 0) for ip_key in counts}
+
+        for key in [key for key in MEMORY_WINDOWS if key[0] == namespace and key[1] < minute - self.ttl_minutes]:
+            del MEMORY_WINDOWS[key]
+            MEMORY_PARTS.pop(key, None)
+        return totals
+
+
+class S3WindowStore(WindowStore):
+    """
+    Each log file writes its counts of a minute as one object:
+    <prefix><namespace>/<minute>/<part id>.json
+    Totals are the sum of all the parts of the minute. Parts never change once
+    written (the part id derives from the log file names, so a retry overwrites
+    its own part), so parts already read are cached. Object keys don't end with
+    gz, so they don't trigger the log parser. Old parts should be removed by an
+    S3 lifecycle rule on the prefix.
+    """
+
+    def __init__(self, s3_util, bucket_name, prefix=WINDOW_STORE_PREFIX, ttl_minutes=WINDOW_TTL_MINUTES):
+        super().__init__(ttl_minutes)
+        self.s3_util = s3_util
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def read_part(self, key_name):
+        part = json.loads(self.s3_util.get_object(self.bucket_name, key_name)['Body'].read())
+        return {scope: dict(counts) for scope, counts in part.items()}
+
+    def add(self, namespace, part_id, minute, scope_counts):
+        minute_prefix = '%s%s/%d/' % (self.prefix, namespace, minute)
+        key_name = minute_prefix + part_id + '.json'
+        body = json.dumps({scope: list(counts.items()) for scope, counts in scope_counts.items()},
+                          separators=(',', ':'))
+        self.s3_util.put_object(self.bucket_name, key_name, body)
+
+        parts = S3_PARTS_CACHE.setdefault((self.bucket_name, namespace, minute), {})
+        parts[key_name] = scope_counts
+        for other_key_name in self.s3_util.list_object_keys(self.bucket_name, minute_prefix):
+            if other_key_name not in parts:
+                parts[other_key_name] = self.read_part(other_key_name)
+
+        totals = {scope: dict.fromkeys(counts, 0) for scope, counts in scope_counts.items()}
+        for part in parts.values():
+            for scope, scope_totals in totals.items():
+                part_counts = part.get(scope)
+                if part_counts:
+                    for ip_key in scope_totals:
+                        scope_totals[ip_key] += part_counts.get(ip_key, 0)
+
+        for key in [key for key in S3_PARTS_CACHE
+                    if key[:2] == (self.bucket_name, namespace) and key[2] < minute - self.ttl_minutes]:
+            del S3_PARTS_CACHE[key]
+        return totals
+
+
+class DynamoDBWindowStore(WindowStore):
+    """
+    Atomic counters in a DynamoDB table with a string partition key named pk and
+    TTL enabled on expires_at. One item per (namespace, minute, scope, shard) holds
+    one number attribute per ip (i<ip key>). Counters are incremented with ADD,
+    up to DYNAMODB_BATCH_SIZE per UpdateItem, which returns the new totals.
+    Each UpdateItem also adds '<part id>#<batch>' to the parts string set of the
+    item, on condition it is not there yet, so a retried part is not counted twice:
+    its totals are read back instead.
+    """
+
+    def __init__(self, table, ttl_minutes=WINDOW_TTL_MINUTES, shards=DYNAMODB_SHARDS,
+                 batch_size=DYNAMODB_BATCH_SIZE, max_concurrency=DYNAMODB_MAX_CONCURRENCY):
+        super().__init__(ttl_minutes)
+        self.table = table
+        self.shards = shards
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+
+    def update_counters(self, request):
+        partition_key, scope, items, expires_at, batch_id = request
+        names = {'#ttl': 'expires_at', '#parts': 'parts'}
+        values = {':ttl': expires_at, ':part': batch_id, ':parts': {batch_id}}
+        additions = ['#parts :parts']
+        for i, (ip_key, num_reqs) in enumerate(items):
+            names['#a%d' % i] = 'i%d' % ip_key
+            values[':v%d' % i] = num_reqs
+            additions.append('#a%d :v%d' % (i, i))
+
+        try:
+            response = self.table.update_item(
+                Key={'pk': partition_key},
+                UpdateExpression='SET #ttl = :ttl ADD ' + ', '.join(additions),
+                ConditionExpression='NOT contains(#parts, :part)',
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ReturnValues='UPDATED_NEW')
+            attributes = response['Attributes']
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                raise
+            # Already added by a previous attempt of the part
+            names = {'#a%d' % i: 'i%d' % ip_key for i, (ip_key, _) in enumerate(items)}
+            response = self.table.get_item(
+                Key={'pk': partition_key},
+                ProjectionExpression=', '.join(names),
+                ExpressionAttributeNames=names,
+                ConsistentRead=True)
+            attributes = response.get('Item', {})
+        return scope, {int(name[1:]): int(value) for name, value in attributes.items() if name[:1] == 'i'}
+
+    def add(self, namespace, part_id, minute, scope_counts):
+        expires_at = (minute + self.ttl_minutes) * 60
+        requests = []
+        for scope, counts in scope_counts.items():
+            shards = {}
+            # Sorted, so a retried part makes the same batches
+            for item in sorted(counts.items()):
+                shards.setdefault(item[0] % self.shards, []).append(item)
+            for shard, items in shards.items():
+                partition_key = '%s#%d#%s#%d' % (namespace, minute, scope, shard)
+                for i in range(0, len(items), self.batch_size):
+                    requests.append((partition_key, scope, items[i:i + self.batch_size], expires_at,
+                                     '%s#%d' % (part_id, i // self.batch_size)))
+
+        totals = {scope: {} for scope in scope_counts}
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for scope, scope_totals in executor.map(self.update_counters, requests):
+                totals[scope].update(scope_totals)
+        return totals
+
+
+def get_window_store(log, name, s3_util, bucket_name, table_name=None, ttl_minutes=WINDOW_TTL_MINUTES):
+    """
+    Return the window store for WINDOW_STORE (none, memory, s3 or dynamodb), None for none.
+    """
+    name = (name or 'none').lower()
+    if name == 'memory':
+        return MemoryWindowStore(ttl_minutes)
+    if name == 's3':
+        return S3WindowStore(s3_util, bucket_name, ttl_minutes=ttl_minutes)
+    if name == 'dynamodb':
+        from lib.boto3_util import create_resource
+        return DynamoDBWindowStore(create_resource('dynamodb').Table(table_name), ttl_minutes)
+    if name != 'none':
+        log.warning("[window_store: get_window_store] Unknown window store %s. Ignoring it." % name)
+    return None
+
+
+def get_part_id(key_names):
+    return hashlib.sha1('\n'.join(sorted(key_names)).encode()).hexdigest()
+
+
+def aggregate_counter(store, namespace, key_names, counter):
+    """
+    Add the counts of the log files key_names to the store and return a
+    RequestCounter with the totals of the same (minute, ip) pairs.
+    """
+    part_id = get_part_id(key_names)
+    totals = RequestCounter(counter.uris, counter.uri_matcher)
+    minutes = set(counter.general)
+    for minute_counts in counter.uri_list:
+        minutes.update(minute_counts)
+
+    for minute in sorted(minutes):
+        scope_counts = {}
+        if minute in counter.general:
+            scope_counts['general'] = counter.general[minute]
+        for uri, minute_counts in zip(counter.uris, counter.uri_list):
+            if minute in minute_counts:
+                scope_counts[uri] = minute_counts[minute]
+
+        minute_totals = store.add(namespace, part_id, minute, scope_counts)
+        if 'general' in minute_totals:
+            totals.general[minute] = minute_totals['general']
+        for uri_id, uri in enumerate(counter.uris):
+            if uri in minute_totals:
+                totals.uri_list[uri_id][minute] = minute_totals[uri]
+    return totals
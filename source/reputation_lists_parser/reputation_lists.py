@@ -5,14 +5,12 @@ import os
 import requests
 import json
 import re
-from time import sleep
-from ipaddress import ip_address
-from ipaddress import ip_network
-from ipaddress import IPv4Network
-from ipaddress import IPv6Network
 from os import environ
+from lib.ip_util import format_cidr, is_network, parse_ips, split_ip_set_addresses
 from lib.solution_metrics import send_metrics
 from lib.waflibv2 import WAFLIBv2
+from lib.ip_set_updater import get_ip_set_updater
+from lib.ip_set_mutations import REPLACE, get_ip_set_mutation_queue, make_intents
 from lib.cfn_response import send_response
 from lib.cw_metrics_util import WAFCloudWatchMetrics
 from aws_lambda_powertools import Logger
@@ -22,7 +20,6 @@ logger = Logger(
 )
 waflib = WAFLIBv2()
 
-delay_between_updates = 5
 CW_METRIC_PERIOD_SECONDS = 3600    # One hour in seconds
 
 # Find matching ip address ranges from a line
@@ -62,52 +59,37 @@ def read_url_list(log, current_list, url, prefix=""):
 # Fully qualify each address with network cidr
 def process_url_list(log, current_list):
     process_list = []
-    for source_ip in current_list:
-        try:
-            ip_type = "IPV%s" % ip_address(source_ip).version
-            if (ip_type == "IPV4"):
-                process_list.append(IPv4Network(source_ip).with_prefixlen)
-            elif (ip_type == "IPV6"):
-                process_list.append(IPv6Network(source_ip).with_prefixlen)
-        except Exception:
-            try:
-                if (ip_network(source_ip)):
-                    process_list.append(source_ip)
-            except Exception:
-                log.debug(source_ip + " not an IP address.")
+    for source_ip, parsed in zip(current_list, parse_ips(current_list)):
+        if parsed is None or not is_network(parsed):
+            log.debug(source_ip + " not an IP address.")
+        elif '/' in source_ip:
+            process_list.append(source_ip)
+        else:
+            process_list.append(format_cidr(parsed))
     return process_list
 
 
 # push each source_ip into the appropriate IPSet
 def populate_ipsets(log, scope, ipset_name_v4, ipset_name_v6, ipset_arn_v4, ipset_arn_v6, current_list):
-    addresses_v4 = []
-    addresses_v6 = []
-
-    for address in current_list:
-        try:
-            source_ip = address.split("/")[0]
-            ip_type = "IPV%s" % ip_address(source_ip).version
-            if ip_type == "IPV4":
-                addresses_v4.append(address)
-            elif ip_type == "IPV6":
-                addresses_v6.append(address)
-        except Exception as e:
-            log.error(e)
-
-    waflib.update_ip_set(log, scope, ipset_name_v4, ipset_arn_v4, addresses_v4)
-    ipset = waflib.get_ip_set(log, scope, ipset_name_v4, ipset_arn_v4)
+    addresses_v4, addresses_v6 = split_ip_set_addresses(current_list, log)
 
-    log.info(ipset)
-    log.info("There are %d IP addresses in IPSet %s", len(ipset["IPSet"]["Addresses"]), ipset_name_v4)
+    mutation_queue = get_ip_set_mutation_queue()
+    if mutation_queue is not None:
+        # Written by the IP set mutation applier
+        queued = mutation_queue.send(make_intents(scope, ipset_name_v4, ipset_arn_v4, REPLACE, addresses_v4) +
+                                     make_intents(scope, ipset_name_v6, ipset_arn_v6, REPLACE, addresses_v6))
+        log.info("Queued %d IP set mutations for IPSets %s and %s", queued, ipset_name_v4, ipset_name_v6)
+        return
 
-    # Sleep for a few seconds to mitigate AWS WAF Update API call throttling issue
-    sleep(delay_between_updates)
+    # v4 and v6 at the same time, rate limited (see lib.ip_set_updater)
+    results = get_ip_set_updater(log, waflib).commit_all(
+        scope, [(ipset_name_v4, ipset_arn_v4, addresses_v4), (ipset_name_v6, ipset_arn_v6, addresses_v6)],
+        read_back=True)
 
-    waflib.update_ip_set(log, scope, ipset_name_v6, ipset_arn_v6, addresses_v6)
-    ipset = waflib.get_ip_set(log, scope, ipset_name_v6, ipset_arn_v6)
-
-    log.info(ipset)
-    log.info("There are %d IP addresses in IPSet %s", len(ipset["IPSet"]["Addresses"]), ipset_name_v6)
+    for ipset_name, (_, ipset) in zip([ipset_name_v4, ipset_name_v6], results):
+        log.info(ipset)
+        if ipset is not None:
+            log.info("There are %d IP addresses in IPSet %s", len(ipset["IPSet"]["Addresses"]), ipset_name)
 
 
 def initialize_usage_data():
@@ -134,7 +116,7 @@ def get_ip_reputation_usage_data(log, scope, ipset_name,
 
     # Get ip reputation ipv4 and ipv6 lists
     if 'IP_SET_ID_REPUTATIONV4' in environ or 'IP_SET_ID_REPUTATIONV6' in environ:
-        response = waflib.get_ip_set(log, scope, ipset_name, ipset_arn)
+        response = waflib.get_ip_set_cached(log, scope, ipset_name, ipset_arn)
 
         if response is not None:
             usage_data[usage_data_ip_list_size_field] = len(response['IPSet']['Addresses'])
@@ -169,35 +151,13 @@ def send_anonymized_usage_data(log, scope):
             'ipv6_reputation_lists'
         )
 
-        # Get the count of allowed requests for all the waf rules from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'AllowedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            'ALL',
-            usage_data,
-            'allowed_requests',
-            0
-        )
-
-        # Get the count of blocked requests for all the waf rules from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            'ALL',
-            usage_data,
-            'blocked_requests',
-            0
-        )
-
-        # Get the count of blocked requests for the Reputation Lists Rule from cloudwatch metrics
-        usage_data = cw.add_waf_cw_metric_to_usage_data(
-            'BlockedRequests',
-            CW_METRIC_PERIOD_SECONDS,
-            os.getenv('IPREPUTATIONLIST_METRICNAME'),
-            usage_data,
-            'blocked_requests_ip_reputation_lists',
-            0
-        )
+        # The count of allowed and blocked requests for all the waf rules and of blocked requests
+        # for the Reputation Lists Rule, from cloudwatch metrics with one request
+        usage_data = cw.add_waf_cw_metrics_to_usage_data([
+            ('AllowedRequests', 'ALL', 'allowed_requests', 0),
+            ('BlockedRequests', 'ALL', 'blocked_requests', 0),
+            ('BlockedRequests', os.getenv('IPREPUTATIONLIST_METRICNAME'), 'blocked_requests_ip_reputation_lists', 0)
+        ], CW_METRIC_PERIOD_SECONDS, usage_data)
 
         # Send usage data
         log.info('[send_anonymized_usage_data] Send usage data: \n{}'.format(usage_data))
@@ -20,7 +20,7 @@ context = SimpleNamespace(**{
 
 def test_lambda_handler_raises_exception_if_env_variable_not_present(mocker):
     event = {}
-    mocker.patch.object(WAFCloudWatchMetrics, 'add_waf_cw_metric_to_usage_data')
+    mocker.patch.object(WAFCloudWatchMetrics, 'add_waf_cw_metrics_to_usage_data')
     with pytest.raises(TypeError):
         reputation_lists.lambda_handler(event, context)
 
@@ -68,7 +68,7 @@ def test_lambda_handler_returns_success(mocker):
         mocker.patch.object(reputation_lists.waflib, 'get_ip_set')
         mocker.patch.object(reputation_lists.waflib, 'update_ip_set')
         mocker.patch.object(reputation_lists.waflib, 'get_ip_set')
-        mocker.patch.object(WAFCloudWatchMetrics, 'add_waf_cw_metric_to_usage_data')
+        mocker.patch.object(WAFCloudWatchMetrics, 'add_waf_cw_metrics_to_usage_data')
         reputation_lists.waflib.get_ip_set.return_value = ip_set
         response = reputation_lists.lambda_handler(event, context)
         assert response == '{"StatusCode": "200", "Body": {"message": "success"}}'